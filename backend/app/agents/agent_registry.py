@@ -0,0 +1,165 @@
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+import time
+from ..config import get_settings
+
+if TYPE_CHECKING:
+    from .base_agent import BaseAgent
+
+class AgentRegistry:
+    """Cache de agentes por tenant (app_id, user_id) com expiração LRU/TTL"""
+    
+    def __init__(
+        self,
+        factory: Callable[[str, str], "BaseAgent"],
+        max_size: int = 256,
+        ttl_seconds: float = 1800
+    ):
+        if max_size < 1:
+            raise ValueError("max_size deve ser maior que zero")
+        
+        self.factory = factory
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._agents: "OrderedDict[Tuple[str, str], Tuple[BaseAgent, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._building: Dict[Tuple[str, str], threading.Lock] = {}
+    
+    def get(self, app_id: str, user_id: str) -> "BaseAgent":
+        """Retorna o agente do tenant, criando-o se não existir ou se expirou
+
+        A criação (cliente da LLM, ferramentas, executor) roda fora do lock do
+        registro, com um lock por tenant: um tenant frio não bloqueia os demais
+        e chamadas simultâneas do mesmo tenant criam o agente uma vez só.
+        """
+        key = (app_id, user_id)
+        
+        with self._lock:
+            agent = self._lookup(key)
+            if agent is not None:
+                return agent
+            build_lock = self._building.setdefault(key, threading.Lock())
+        
+        with build_lock:
+            try:
+                with self._lock:
+                    agent = self._lookup(key)
+                if agent is not None:
+                    return agent
+                
+                agent = self.factory(app_id, user_id)
+                with self._lock:
+                    self._agents[key] = (agent, time.monotonic())
+                    self._agents.move_to_end(key)
+                    # Remove os agentes menos usados recentemente além do limite
+                    while len(self._agents) > self.max_size:
+                        self._agents.popitem(last=False)
+                return agent
+            finally:
+                with self._lock:
+                    if self._building.get(key) is build_lock:
+                        del self._building[key]
+    
+    def _lookup(self, key: Tuple[str, str]) -> Optional["BaseAgent"]:
+        """Agente válido do cache (chamar com o lock do registro)"""
+        entry = self._agents.get(key)
+        if entry is None:
+            return None
+        agent, created_at = entry
+        if time.monotonic() - created_at >= self.ttl_seconds:
+            del self._agents[key]
+            return None
+        self._agents.move_to_end(key)
+        return agent
+    
+    def invalidate(self, app_id: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        """Remove agentes do cache (todos, por app_id ou por tenant) e retorna a quantidade removida"""
+        with self._lock:
+            keys = [
+                key for key in self._agents
+                if (app_id is None or key[0] == app_id) and (user_id is None or key[1] == user_id)
+            ]
+            for key in keys:
+                del self._agents[key]
+            return len(keys)
+    
+    def stats(self) -> Dict[str, float]:
+        """Retorna informações sobre o uso do cache"""
+        with self._lock:
+            return {
+                "size": len(self._agents),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds
+            }
+    
+    def __len__(self) -> int:
+        return len(self._agents)
+
+def _build_dental_agent(app_id: str, user_id: str) -> "BaseAgent":
+    # LangChain, OpenAI e as ferramentas do Firestore só são importados quando o
+    # primeiro agente é criado (rotas sem agente sobem sem eles)
+    from .dental_agent import DentalAgent
+    return DentalAgent(app_id=app_id, user_id=user_id)
+
+@lru_cache()
+def get_agent_registry() -> AgentRegistry:
+    """Retorna o registro de agentes odontológicos do processo"""
+    settings = get_settings()
+    return AgentRegistry(
+        factory=_build_dental_agent,
+        max_size=settings.agent_registry_max_size,
+        ttl_seconds=settings.agent_registry_ttl_seconds
+    )
+
+def benchmark_registry(tenants: int = 50, requests: int = 2000, build_ms: float = 50.0, threads: int = 16) -> Dict[str, Any]:
+    """Compara criar o agente a cada mensagem com reutilizá-lo pelo registro
+
+    A fábrica simula o custo de montar o agente (cliente da LLM, prompt e
+    ferramentas) com uma espera de build_ms; as mensagens são distribuídas
+    entre os tenants e processadas por `threads` threads, como no pool do
+    FastAPI. Rodar com: python -m app.agents.agent_registry
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    builds = {"count": 0}
+    builds_lock = threading.Lock()
+    
+    def factory(app_id: str, user_id: str) -> Any:
+        with builds_lock:
+            builds["count"] += 1
+        time.sleep(build_ms / 1000)
+        return object()
+    
+    keys = [(f"app-{i % tenants}", f"user-{i % tenants}") for i in range(requests)]
+    
+    def run(get_agent: Callable[[str, str], Any]) -> float:
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda key: get_agent(*key), keys))
+        return time.perf_counter() - started_at
+    
+    uncached_s = run(factory)
+    uncached_builds = builds["count"]
+    
+    builds["count"] = 0
+    registry = AgentRegistry(factory=factory, max_size=max(tenants, 1))
+    cached_s = run(registry.get)
+    
+    return {
+        "tenants": tenants,
+        "requests": requests,
+        "threads": threads,
+        "build_ms": build_ms,
+        "uncached_ms_per_request": round(uncached_s / requests * 1000, 3),
+        "uncached_builds": uncached_builds,
+        "registry_ms_per_request": round(cached_s / requests * 1000, 3),
+        "registry_builds": builds["count"],
+        "speedup": round(uncached_s / cached_s, 1) if cached_s else None
+    }
+
+if __name__ == "__main__":
+    import json
+    
+    print(json.dumps(benchmark_registry(), indent=2))
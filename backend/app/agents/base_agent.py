@@ -1,11 +1,121 @@
-from typing import List, Dict, Any, Optional
-from langchain.agents import AgentExecutor, create_openai_functions_agent
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Set, Tuple
+import asyncio
+import threading
+from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools import BaseTool
 from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import SystemMessage
+from langchain.schema import SystemMessage, HumanMessage, AIMessage, BaseMessage
 from ..config import get_settings
+from ..services.firestore_async import run_firestore, turn_writes
+from ..services.metrics import count_error, span
+from ..services.reply_streamer import SentenceChunker
+from ..services.structured_log import get_logger
+from .memory_store import AI, AI_TOOLS, HUMAN, ConversationWindow, get_memory_store
+from .response_cache import get_response_cache, prompt_fingerprint
+from .token_budget import TokenBudgetExceeded, get_token_stats, turn_usage
+
+log = get_logger(__name__)
+
+# Componentes compartilhados por todos os agentes do processo. O cliente da LLM,
+# o prompt e o grafo do agente não dependem do tenant, então são construídos
+# uma única vez por combinação de modelo/temperatura/prompt/ferramentas.
+_shared_lock = threading.Lock()
+_shared_llms: Dict[Tuple[str, float], ChatOpenAI] = {}
+_shared_agents: Dict[Tuple[str, float, str, Tuple[str, ...]], Tuple[ChatPromptTemplate, Any]] = {}
+_chat_model_factory: Optional[Callable[[str, float], Any]] = None
+
+def set_chat_model_factory(factory: Optional[Callable[[str, float], Any]]) -> None:
+    """Substitui o ChatOpenAI por outro modelo de chat (ex.: FakeChatModel nos testes de carga)
+
+    Recebe (model_name, temperature); None volta ao ChatOpenAI. Os modelos e
+    agentes já compartilhados são descartados.
+    """
+    global _chat_model_factory
+    with _shared_lock:
+        _chat_model_factory = factory
+        _shared_llms.clear()
+        _shared_agents.clear()
+
+def get_shared_llm(model_name: str, temperature: float) -> ChatOpenAI:
+    """Retorna o cliente ChatOpenAI compartilhado para o modelo/temperatura"""
+    key = (model_name, temperature)
+    with _shared_lock:
+        llm = _shared_llms.get(key)
+        if llm is None:
+            if _chat_model_factory is not None:
+                llm = _chat_model_factory(model_name, temperature)
+            else:
+                llm = ChatOpenAI(
+                    temperature=temperature,
+                    model_name=model_name,
+                    api_key=get_settings().openai_api_key
+                )
+            _shared_llms[key] = llm
+        return llm
+
+def _get_shared_agent(
+    llm: ChatOpenAI,
+    model_name: str,
+    temperature: float,
+    system_message: str,
+    tools: List[BaseTool]
+) -> Tuple[ChatPromptTemplate, Any]:
+    """Retorna o prompt e o grafo do agente compilados uma única vez"""
+    key = (model_name, temperature, system_message, tuple(tool.name for tool in tools))
+    with _shared_lock:
+        shared = _shared_agents.get(key)
+        if shared is None:
+            prompt = ChatPromptTemplate.from_messages([
+                SystemMessage(content=system_message),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("human", "{input}"),
+                MessagesPlaceholder(variable_name="agent_scratchpad"),
+            ])
+            # Agente de "tools": a LLM pode pedir várias ferramentas no mesmo passo,
+            # e o AgentExecutor as executa em paralelo no ainvoke
+            agent = create_openai_tools_agent(
+                llm=llm,
+                tools=tools,
+                prompt=prompt
+            )
+            shared = (prompt, agent)
+            _shared_agents[key] = shared
+        return shared
+
+SUMMARY_PROMPT = """Resuma a conversa abaixo entre um paciente e o assistente do consultório
+odontológico. Mantenha nomes, datas, horários, procedimentos e pendências.
+Responda apenas com o resumo atualizado, em no máximo {max_words} palavras.
+
+Resumo atual:
+{summary}
+
+Novas mensagens:
+{lines}"""
+
+BUDGET_EXCEEDED_REPLY = (
+    "Desculpe, sua solicitação ficou extensa demais para eu concluir de uma vez. "
+    "Pode dividi-la em partes menores?"
+)
+# Streaming: parte do turno já foi gravada antes de o orçamento acabar
+BUDGET_PARTIAL_REPLY = (
+    "Não consegui concluir toda a sua solicitação de uma vez. Já ficou registrado: {acoes}. "
+    "Pode me enviar o restante em partes menores?"
+)
+# Ferramentas que gravam dados, com a descrição usada na resposta acima
+WRITE_TOOL_LABELS = {
+    "schedule_appointment": "o agendamento da consulta",
+    "process_payment": "o pagamento",
+    "update_patient_record": "a atualização do prontuário",
+    "update_appointment_status": "a atualização da consulta"
+}
+
+def budget_exceeded_reply(saved_tools: List[str]) -> str:
+    """Resposta do turno interrompido, citando o que já foi gravado"""
+    actions = list(dict.fromkeys(WRITE_TOOL_LABELS[name] for name in saved_tools if name in WRITE_TOOL_LABELS))
+    if not actions:
+        return BUDGET_EXCEEDED_REPLY
+    return BUDGET_PARTIAL_REPLY.format(acoes=", ".join(actions))
 
 class BaseAgent:
     def __init__(
@@ -13,60 +123,306 @@ class BaseAgent:
         tools: List[BaseTool],
         system_message: str,
         temperature: float = 0.7,
-        model_name: Optional[str] = None
+        model_name: Optional[str] = None,
+        memory_namespace: str = "default"
     ):
         settings = get_settings()
+        # Separa o histórico de conversas de cada tenant
+        self.memory_namespace = memory_namespace
+        self._summarizing: Set[str] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
         
-        if not settings.openai_api_key:
+        if not settings.openai_api_key and _chat_model_factory is None:
             raise ValueError("OPENAI_API_KEY não configurada no ambiente")
         
-        self.llm = ChatOpenAI(
-            temperature=temperature,
-            model_name=model_name or settings.openai_model_name,
-            api_key=settings.openai_api_key
-        )
-        
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-        
-        self.prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=system_message),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}"),
-            MessagesPlaceholder(variable_name="agent_scratchpad"),
-        ])
-        
-        self.agent = create_openai_functions_agent(
+        model_name = model_name or settings.openai_model_name
+        self.llm = get_shared_llm(model_name, temperature)
+        self.prompt, self.agent = _get_shared_agent(
             llm=self.llm,
-            tools=tools,
-            prompt=self.prompt
+            model_name=model_name,
+            temperature=temperature,
+            system_message=system_message,
+            tools=tools
         )
         
+        # Apenas as ferramentas (com o contexto do tenant) e o executor são
+        # exclusivos de cada instância. Os passos intermediários indicam se o
+        # turno usou ferramentas (e portanto não pode ir para o cache)
         self.agent_executor = AgentExecutor(
             agent=self.agent,
             tools=tools,
-            memory=self.memory,
-            verbose=True
+            verbose=True,
+            return_intermediate_steps=True
+        )
+        
+        # Muda sempre que o prompt do agente muda, invalidando o cache de respostas
+        self.prompt_fingerprint = prompt_fingerprint(
+            model_name,
+            temperature,
+            system_message,
+            "openai-tools",
+            self.format_input("{message}"),
+            *(tool.name for tool in tools)
         )
     
-    async def process_message(self, message: str) -> str:
-        """Processa uma mensagem e retorna a resposta do agente"""
+    def format_input(self, message: str) -> str:
+        """Monta o texto enviado ao agente a partir da mensagem do usuário"""
+        return message
+    
+    def _history_messages(self, window: ConversationWindow) -> List[BaseMessage]:
+        """Converte o resumo e a janela de histórico em mensagens do prompt"""
+        history: List[BaseMessage] = []
+        if window.summary:
+            history.append(SystemMessage(content=f"Resumo da conversa até aqui: {window.summary}"))
+        for role, content in window.messages:
+            history.append(HumanMessage(content=content) if role == HUMAN else AIMessage(content=content))
+        return history
+    
+    async def _summarize(self, conversation_id: str, window: ConversationWindow) -> None:
+        """Incorpora ao resumo as mensagens que saíram da janela de histórico"""
         try:
-            response = await self.agent_executor.ainvoke({"input": message})
-            return response["output"]
+            lines = "\n".join(
+                f"{'Paciente' if role == HUMAN else 'Assistente'}: {content}"
+                for _, role, content in window.overflow
+            )
+            result = await self.llm.ainvoke(SUMMARY_PROMPT.format(
+                max_words=get_settings().memory_summary_max_words,
+                summary=window.summary or "(sem resumo)",
+                lines=lines
+            ))
+            await asyncio.to_thread(
+                get_memory_store().save_summary,
+                self.memory_namespace,
+                conversation_id,
+                result.content,
+                window.overflow[-1][0]
+            )
         except Exception as e:
-            print(f"Erro ao processar mensagem: {str(e)}")
+            log.error("Erro ao resumir conversa", error=str(e))
+        finally:
+            self._summarizing.discard(conversation_id)
+    
+    def _schedule_summary(self, conversation_id: str, window: ConversationWindow) -> None:
+        """Resume em segundo plano para não atrasar a resposta ao paciente"""
+        if conversation_id in self._summarizing:
+            return
+        self._summarizing.add(conversation_id)
+        task = asyncio.create_task(self._summarize(conversation_id, window))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def remember(
+        self,
+        conversation_id: str,
+        message: str,
+        output: str,
+        window: Optional[ConversationWindow] = None,
+        used_tools: bool = False
+    ) -> None:
+        """Grava o turno no histórico da conversa (e agenda o resumo, se preciso)"""
+        store = get_memory_store()
+        await asyncio.to_thread(
+            store.append,
+            self.memory_namespace,
+            conversation_id,
+            [(HUMAN, message), (AI_TOOLS if used_tools else AI, output)]
+        )
+        if window is not None and store.needs_summary(window):
+            self._schedule_summary(conversation_id, window)
+    
+    async def _cached_reply(
+        self,
+        message: str,
+        conversation_id: Optional[str],
+        window: Optional[ConversationWindow]
+    ) -> Optional[str]:
+        """Resposta do cache de perguntas frequentes (já gravada no histórico)
+
+        Vale também para quem já conversou antes, desde que as últimas respostas
+        não tenham vindo de ferramentas: logo depois de listar horários ou de
+        registrar um pagamento, a mensagem continua a ação e vai para a LLM.
+        """
+        settings = get_settings()
+        if not settings.response_cache_enabled:
+            return None
+        if window is not None and window.recent_tool_turn(settings.response_cache_context_turns):
+            return None
+        cached = get_response_cache().get(self.memory_namespace, self.prompt_fingerprint, message)
+        if cached is not None and conversation_id:
+            await self.remember(conversation_id, message, cached)
+        return cached
+    
+    async def _load_history(
+        self,
+        conversation_id: Optional[str]
+    ) -> Tuple[Optional[ConversationWindow], List[BaseMessage]]:
+        # O agente é reutilizado entre requisições do mesmo tenant, então o
+        # histórico não pode ficar no executor (seria compartilhado entre
+        # pacientes diferentes)
+        if not conversation_id:
+            return None, []
+        with span("history"):
+            window = await asyncio.to_thread(get_memory_store().load, self.memory_namespace, conversation_id)
+        return window, self._history_messages(window)
+    
+    async def _finish_turn(
+        self,
+        message: str,
+        conversation_id: Optional[str],
+        output: str,
+        window: Optional[ConversationWindow],
+        chat_history: List[BaseMessage],
+        used_tools: bool
+    ) -> None:
+        # Só respostas sem dados do paciente (sem ferramentas e sem histórico
+        # da conversa no prompt) são gravadas no cache; servidas, valem para
+        # qualquer conversa do tenant sem ação em andamento (_cached_reply)
+        if get_settings().response_cache_enabled and not chat_history and not used_tools:
+            get_response_cache().put(self.memory_namespace, self.prompt_fingerprint, message, output)
+        
+        if conversation_id:
+            await self.remember(conversation_id, message, output, window, used_tools)
+    
+    async def process_message(self, message: str, conversation_id: Optional[str] = None) -> str:
+        """Processa uma mensagem e retorna a resposta do agente
+        
+        Com conversation_id (ex.: número do WhatsApp), o histórico da conversa é
+        carregado do armazenamento persistente dentro do orçamento de tokens.
+        """
+        try:
+            window, chat_history = await self._load_history(conversation_id)
+            cached = await self._cached_reply(message, conversation_id, window)
+            if cached is not None:
+                return cached
+            
+            # As escritas das ferramentas do turno são gravadas juntas, em um único
+            # commit, antes da resposta (se o commit falhar, o paciente recebe erro)
+            with turn_usage(get_settings().agent_turn_token_budget) as usage:
+                try:
+                    with span("agent_turn"):
+                        async with turn_writes():
+                            response = await self.agent_executor.ainvoke(
+                                {"input": self.format_input(message), "chat_history": chat_history},
+                                config={"callbacks": [usage]}
+                            )
+                except TokenBudgetExceeded as e:
+                    # Nada do turno é gravado (as escritas pendentes são descartadas)
+                    log.warning("Turno interrompido", error=str(e))
+                    get_token_stats().record(self.memory_namespace, usage, "budget_exceeded")
+                    return BUDGET_EXCEEDED_REPLY
+                get_token_stats().record(self.memory_namespace, usage)
+            output = response["output"]
+            
+            await self._finish_turn(
+                message,
+                conversation_id,
+                output,
+                window,
+                chat_history,
+                used_tools=bool(response.get("intermediate_steps"))
+            )
+            return output
+        except Exception as e:
+            log.error("Erro ao processar mensagem", error=str(e))
+            count_error("agent")
             return "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente."
     
+    async def stream_message(
+        self,
+        message: str,
+        on_chunk: Callable[[str], Awaitable[None]],
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """Processa uma mensagem entregando a resposta em trechos enquanto a LLM gera
+        
+        Os tokens do modelo são agrupados em frases/parágrafos e cada trecho
+        completo é passado para on_chunk. Antes do primeiro trecho depois de uma
+        ferramenta, as escritas pendentes do turno são gravadas, para que o
+        paciente nunca receba a confirmação de algo que não foi salvo. Se o
+        orçamento de tokens acabar depois disso, a resposta informa o que já
+        foi gravado (em vez de sugerir que nada foi feito).
+        Retorna a resposta completa.
+        """
+        settings = get_settings()
+        chunker = SentenceChunker(settings.stream_min_chunk_chars, settings.stream_max_chunk_chars)
+        sent = False
+        # Ferramentas executadas desde o último commit e as já gravadas
+        pending_tools: List[str] = []
+        saved_tools: List[str] = []
+        try:
+            window, chat_history = await self._load_history(conversation_id)
+            cached = await self._cached_reply(message, conversation_id, window)
+            if cached is not None:
+                for chunk in chunker.split(cached):
+                    await on_chunk(chunk)
+                return cached
+            
+            response: Dict[str, Any] = {}
+            used_tools = False
+            with turn_usage(settings.agent_turn_token_budget) as usage, span("agent_turn"):
+                try:
+                    async with turn_writes() as writes:
+                        events = self.agent_executor.astream_events(
+                            {"input": self.format_input(message), "chat_history": chat_history},
+                            config={"callbacks": [usage]},
+                            version="v2"
+                        )
+                        async for event in events:
+                            kind = event["event"]
+                            if kind == "on_tool_start":
+                                used_tools = True
+                                pending_tools.append(event.get("name", ""))
+                            elif kind == "on_chat_model_stream":
+                                content = event["data"]["chunk"].content
+                                if not isinstance(content, str) or not content:
+                                    continue
+                                chunks = chunker.feed(content)
+                                if chunks and pending_tools:
+                                    if writes is not None:
+                                        await run_firestore(writes.commit)
+                                    saved_tools.extend(pending_tools)
+                                    pending_tools.clear()
+                                for chunk in chunks:
+                                    await on_chunk(chunk)
+                                    sent = True
+                            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                                response = event["data"].get("output") or {}
+                except TokenBudgetExceeded as e:
+                    # O que já foi enviado e gravado fica; o restante do turno é descartado
+                    log.warning("Turno interrompido", error=str(e), saved_tools=saved_tools)
+                    get_token_stats().record(self.memory_namespace, usage, "budget_exceeded")
+                    reply = budget_exceeded_reply(saved_tools)
+                    await on_chunk(reply)
+                    return reply
+                get_token_stats().record(self.memory_namespace, usage)
+            
+            output = response.get("output", "")
+            # Modelos sem streaming entregam a resposta inteira só no fim
+            rest = chunker.flush() if sent else chunker.split(output)
+            for chunk in rest:
+                await on_chunk(chunk)
+                sent = True
+            
+            await self._finish_turn(message, conversation_id, output, window, chat_history, used_tools)
+            return output
+        except Exception as e:
+            log.error("Erro ao processar mensagem em streaming", error=str(e))
+            count_error("agent")
+            error = "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente."
+            try:
+                await on_chunk(error)
+            except Exception as send_error:
+                log.error("Erro ao enviar mensagem de erro", error=str(send_error))
+            return error
+    
     def add_tool(self, tool: BaseTool) -> None:
         """Adiciona uma nova ferramenta ao agente"""
         self.agent_executor.tools.append(tool)
-        # Recria o agente com as novas ferramentas
-        self.agent = create_openai_functions_agent(
+        self.prompt_fingerprint = prompt_fingerprint(self.prompt_fingerprint, tool.name)
+        # Recria o agente com as novas ferramentas (deixa de usar o grafo compartilhado)
+        self.agent = create_openai_tools_agent(
             llm=self.llm,
             tools=self.agent_executor.tools,
             prompt=self.prompt
         )
-        self.agent_executor.agent = self.agent 
\ No newline at end of file
+        self.agent_executor.agent = self.agent
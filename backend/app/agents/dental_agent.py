@@ -1,12 +1,23 @@
-from typing import List
+from typing import Awaitable, Callable, Optional
+import asyncio
+from ..config import get_settings
+from ..services.metrics import span
+from ..services.structured_log import get_logger
 from .base_agent import BaseAgent
+from .intent_router import IntentRouter
+from .memory_store import HUMAN, get_memory_store
 from .tools.firebase_tools import (
     GetPatientTool,
     ScheduleAppointmentTool,
+    FindFreeSlotsTool,
     ProcessPaymentTool,
-    UpdatePatientRecordTool
+    UpdatePatientRecordTool,
+    GetNextAppointmentTool,
+    UpdateAppointmentStatusTool
 )
 
+log = get_logger(__name__)
+
 SYSTEM_MESSAGE = """Você é um assistente virtual especializado em odontologia, 
 ajudando a gerenciar um consultório odontológico. Você pode:
 
@@ -14,56 +25,109 @@ ajudando a gerenciar um consultório odontológico. Você pode:
 2. Agendar consultas
 3. Registrar pagamentos
 4. Atualizar prontuários
-5. Responder dúvidas sobre procedimentos odontológicos
+5. Consultar, confirmar ou cancelar a próxima consulta de um paciente
+6. Responder dúvidas sobre procedimentos odontológicos
 
 Sempre mantenha um tom profissional e empático. Ao agendar consultas, verifique 
-a disponibilidade do horário. Ao registrar pagamentos, confirme os detalhes 
+a disponibilidade do horário; se estiver ocupado, ofereça os horários livres 
+retornados pela ferramenta. Ao registrar pagamentos, confirme os detalhes 
 com o paciente. Ao atualizar prontuários, certifique-se de que todas as 
 informações necessárias foram coletadas.
 
-Use as ferramentas disponíveis para realizar as tarefas solicitadas."""
+Para cada mensagem do paciente, identifique a intenção, use as ferramentas 
+apropriadas e responda de forma clara e profissional."""
 
 class DentalAgent(BaseAgent):
     def __init__(self, app_id: str, user_id: str):
-        # Inicializa as ferramentas com o contexto do usuário
+        self.app_id = app_id
+        self.user_id = user_id
+        # Intenções frequentes (saudação, confirmar, cancelar...) não passam pela LLM
+        self.intent_router = IntentRouter(app_id, user_id)
+        
+        # Cada ferramenta recebe o tenant na criação (fora dos argumentos da LLM)
         tools = [
-            GetPatientTool(),
-            ScheduleAppointmentTool(),
-            ProcessPaymentTool(),
-            UpdatePatientRecordTool()
+            tool_class(app_id=app_id, user_id=user_id)
+            for tool_class in (
+                GetPatientTool,
+                ScheduleAppointmentTool,
+                FindFreeSlotsTool,
+                ProcessPaymentTool,
+                UpdatePatientRecordTool,
+                GetNextAppointmentTool,
+                UpdateAppointmentStatusTool
+            )
         ]
         
-        # Adiciona o contexto do usuário às ferramentas
-        for tool in tools:
-            if hasattr(tool, '_run'):
-                original_run = tool._run
-                def new_run(*args, **kwargs):
-                    kwargs['app_id'] = app_id
-                    kwargs['user_id'] = user_id
-                    return original_run(*args, **kwargs)
-                tool._run = new_run
-        
         super().__init__(
             tools=tools,
             system_message=SYSTEM_MESSAGE,
-            temperature=0.7
+            temperature=0.7,
+            memory_namespace=f"{app_id}:{user_id}"
         )
     
-    async def process_dental_query(self, message: str) -> str:
-        """Processa uma consulta odontológica específica"""
+    def format_input(self, message: str) -> str:
+        """Identifica a mensagem do paciente (as instruções ficam no SYSTEM_MESSAGE)
+
+        Este texto se repete em toda chamada à LLM do turno, então fica curto.
+        """
+        return f"Mensagem do paciente: {message}"
+    
+    async def last_reply(self, conversation_id: str) -> Optional[str]:
+        """Última resposta do assistente na janela de histórico (None em conversa nova)"""
+        window = await asyncio.to_thread(get_memory_store().load, self.memory_namespace, conversation_id)
+        for role, content in reversed(window.messages):
+            if role != HUMAN:
+                return content
+        # Só o resumo restou: há contexto, mas não é uma resposta do atalho
+        return window.summary
+    
+    async def process_dental_query(self, message: str, conversation_id: Optional[str] = None) -> str:
+        """Processa uma consulta odontológica específica
+        
+        O conversation_id é o número do WhatsApp do paciente; com ele, as
+        intenções frequentes são atendidas direto pelo IntentRouter e apenas
+        as mensagens ambíguas seguem para a LLM.
+        """
         try:
-            # Adiciona contexto odontológico à mensagem
-            enhanced_message = f"""
-            Contexto: Consulta odontológica
-            Mensagem do usuário: {message}
+            if conversation_id and get_settings().intent_fast_path_enabled:
+                with span("intent_router"):
+                    reply = await self.intent_router.handle(
+                        message,
+                        phone=conversation_id,
+                        last_reply=lambda: self.last_reply(conversation_id)
+                    )
+                if reply is not None:
+                    await self.remember(conversation_id, message, reply)
+                    return reply
             
-            Por favor, analise a mensagem e:
-            1. Identifique a intenção do usuário
-            2. Use as ferramentas apropriadas para atender à solicitação
-            3. Forneça uma resposta clara e profissional
-            """
+            return await self.process_message(message, conversation_id=conversation_id)
+        except Exception as e:
+            log.error("Erro ao processar consulta odontológica", error=str(e))
+            return "Desculpe, ocorreu um erro ao processar sua consulta. Por favor, tente novamente."
+    
+    async def stream_dental_query(
+        self,
+        message: str,
+        on_chunk: Callable[[str], Awaitable[None]],
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """Como process_dental_query, mas entrega a resposta em trechos via on_chunk"""
+        try:
+            if conversation_id and get_settings().intent_fast_path_enabled:
+                with span("intent_router"):
+                    reply = await self.intent_router.handle(
+                        message,
+                        phone=conversation_id,
+                        last_reply=lambda: self.last_reply(conversation_id)
+                    )
+                if reply is not None:
+                    await on_chunk(reply)
+                    await self.remember(conversation_id, message, reply)
+                    return reply
             
-            return await self.process_message(enhanced_message)
+            return await self.stream_message(message, on_chunk, conversation_id=conversation_id)
         except Exception as e:
-            print(f"Erro ao processar consulta odontológica: {str(e)}")
-            return "Desculpe, ocorreu um erro ao processar sua consulta. Por favor, tente novamente." 
\ No newline at end of file
+            log.error("Erro ao processar consulta odontológica", error=str(e))
+            error = "Desculpe, ocorreu um erro ao processar sua consulta. Por favor, tente novamente."
+            await on_chunk(error)
+            return error
@@ -0,0 +1,154 @@
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+from collections import deque
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from .memory_store import count_tokens
+
+# Mensagem com "ID <paciente>" faz o modelo pedir a ferramenta de próxima consulta
+PATIENT_ID = re.compile(r"\bID[:\s]+([\w-]+)", re.IGNORECASE)
+TOOL_NAME = "get_next_appointment"
+
+REPLIES = [
+    "Olá! Recebi sua mensagem sobre \"{topic}\". Nossa equipe está à disposição para ajudar. "
+    "Posso verificar horários livres, consultas agendadas e pagamentos para você.",
+    "Entendi sua dúvida sobre \"{topic}\". Cada caso é avaliado pelo dentista na consulta. "
+    "Se quiser, posso sugerir os próximos horários livres da agenda.",
+    "Obrigado pelo contato! Sobre \"{topic}\", recomendamos agendar uma avaliação. "
+    "Assim o dentista indica o tratamento mais adequado para você.",
+]
+
+_stats_lock = threading.Lock()
+_latencies: Deque[float] = deque(maxlen=10000)
+_calls = {"calls": 0, "tool_calls": 0}
+
+def get_fake_llm_stats() -> Dict[str, Any]:
+    """Chamadas ao modelo falso e as durações (ms) das mais recentes"""
+    with _stats_lock:
+        return {**_calls, "durations_ms": list(_latencies)}
+
+class FakeChatModel(BaseChatModel):
+    """Modelo de chat determinístico para testes de carga (sem rede)
+
+    A resposta depende só da última mensagem do paciente. Quando a mensagem
+    traz "ID <paciente>" e a ferramenta get_next_appointment foi oferecida, o
+    primeiro passo pede a ferramenta e o segundo resume o resultado, exercitando
+    o caminho completo do agente. latency_ms (+ jitter_ms) simula o tempo até o
+    primeiro token; tokens_per_second controla o ritmo do streaming.
+    """
+    
+    latency_ms: float = 300.0
+    jitter_ms: float = 0.0
+    tokens_per_second: float = 0.0
+    model_name: str = "fake-chat"
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+    
+    def _delay(self, seed: str) -> float:
+        jitter = random.Random(seed).uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        return (self.latency_ms + jitter) / 1000
+    
+    def _reply(self, messages: List[BaseMessage], tools: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        human = next((message for message in reversed(messages) if isinstance(message, HumanMessage)), None)
+        text = str(human.content) if human is not None else ""
+        last = messages[-1] if messages else None
+        
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Encontrei as informações solicitadas: {str(last.content)[:160]}. Posso ajudar em algo mais?")
+        
+        offered = {tool.get("function", {}).get("name") for tool in tools or []}
+        match = PATIENT_ID.search(text)
+        if match and TOOL_NAME in offered:
+            call_id = "call_" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+            return AIMessage(content="", additional_kwargs={"tool_calls": [{
+                "id": call_id,
+                "type": "function",
+                "function": {"name": TOOL_NAME, "arguments": json.dumps({"patient_id": match.group(1)})}
+            }]})
+        
+        # O texto enviado ao agente pode trazer um prefixo ("Mensagem do paciente: ...")
+        topic = text.split(":", 1)[-1].strip()[:60] or "sua solicitação"
+        digest = int(hashlib.sha1(topic.encode("utf-8")).hexdigest(), 16)
+        return AIMessage(content=REPLIES[digest % len(REPLIES)].format(topic=topic))
+    
+    def _result(self, messages: List[BaseMessage], message: AIMessage, started_at: float) -> ChatResult:
+        prompt_tokens = sum(count_tokens(str(item.content)) for item in messages)
+        completion_tokens = count_tokens(str(message.content) or json.dumps(message.additional_kwargs))
+        self._record(message, started_at)
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "model_name": self.model_name,
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            }
+        )
+    
+    def _record(self, message: AIMessage, started_at: float) -> None:
+        with _stats_lock:
+            _calls["calls"] += 1
+            if message.additional_kwargs.get("tool_calls"):
+                _calls["tool_calls"] += 1
+            _latencies.append((time.perf_counter() - started_at) * 1000)
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        started_at = time.perf_counter()
+        message = self._reply(messages, kwargs.get("tools"))
+        time.sleep(self._delay(str(message.content)))
+        return self._result(messages, message, started_at)
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        started_at = time.perf_counter()
+        message = self._reply(messages, kwargs.get("tools"))
+        await asyncio.sleep(self._delay(str(message.content)))
+        return self._result(messages, message, started_at)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        started_at = time.perf_counter()
+        message = self._reply(messages, kwargs.get("tools"))
+        await asyncio.sleep(self._delay(str(message.content)))
+        if message.additional_kwargs.get("tool_calls"):
+            tool_calls = [{**call, "index": index} for index, call in enumerate(message.additional_kwargs["tool_calls"])]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs={"tool_calls": tool_calls}))
+        else:
+            words = str(message.content).split(" ")
+            for index, word in enumerate(words):
+                token = word if index == len(words) - 1 else word + " "
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+                if self.tokens_per_second:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+        self._record(message, started_at)
@@ -0,0 +1,302 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from ..config import get_settings
+from ..services.agenda_index import clinic_timezone, parse_event_datetime
+from ..services.metrics import span
+from ..services.phone_index import get_phone_index
+from ..services.structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Corpus rotulado usado para medir a precisão do classificador
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "intent_corpus.json")
+
+GREETING = "saudacao"
+THANKS = "agradecimento"
+CONFIRM = "confirmar"
+CANCEL = "cancelar"
+NEXT_APPOINTMENT = "consultar_horario"
+# Intenções que alteram a consulta (dependem do contexto da conversa)
+ACTION_INTENTS = (CONFIRM, CANCEL)
+
+# Fechamento das respostas do próprio atalho que convidam a confirmar ou cancelar
+ROUTER_PROMPT = "Posso informar, confirmar ou cancelar a sua próxima consulta. Como posso ajudar?"
+NEXT_APPOINTMENT_REPLY = "Sua próxima consulta ("
+
+# (intenção, padrão sobre o texto normalizado, padrão já trata negação)
+_RULES: List[Tuple[str, "re.Pattern[str]", bool]] = [
+    (GREETING, re.compile(
+        r"^(oi+|ola|opa|e ai|bom dia|boa tarde|boa noite)( (doutora?|dra?|pessoal|tudo bem|tudo bom|td bem))*$"
+    ), False),
+    (THANKS, re.compile(
+        r"^(muito )?(obrigad[oa]|obg|grat[oa]|valeu)( (viu|mesmo|demais|doutora?|dra?|pela atencao|pela ajuda|por tudo))*$"
+    ), False),
+    (CONFIRM, re.compile(r"\b(confirm(o|ad[oa]|ar|ando|a)|estarei la|vou sim|pode contar comigo)\b"), False),
+    (CANCEL, re.compile(r"\b(cancel\w*|desmarc\w*)\b"), False),
+    (CANCEL, re.compile(r"\bnao (vou|vai|irei) (poder|conseguir) (ir|comparecer)\b"), True),
+    (NEXT_APPOINTMENT, re.compile(
+        r"\b(qual|quando|que (dia|horas?))\b.*\b(meu|minha) (proxima )?(horario|consulta|agendamento)\b"
+    ), False),
+    (NEXT_APPOINTMENT, re.compile(
+        r"\b(meu|minha) (proxima )?(horario|consulta|agendamento)\b.*\b(quando|que (dia|horas?))\b"
+    ), False),
+]
+
+_NEGATION = re.compile(r"\b(nao|nem|nunca)\b")
+# Termos que indicam pedidos que o atalho não resolve (remarcar, dúvidas)
+_AMBIGUOUS = re.compile(r"\b(remarc\w*|marc\w*|agendar|mudar|trocar|adiar|antecipar|como|porque|por que|quanto)\b")
+# Confirmar/cancelar alteram a consulta: só valem como pedido direto. Passado ou
+# estado ("foi cancelada", "cancelaram", "está confirmada") e condicionais ("se
+# eu cancelar", "confirmo, mas...") seguem para a LLM, assim como perguntas.
+_NOT_A_REQUEST = re.compile(
+    r"\b(se|caso|mas|porem|foi|foram|esta|ta|estava|"
+    r"cancelaram|cancelou|cancelad[oa]|desmarcaram|desmarcou|desmarcad[oa]|confirmaram|confirmou)\b"
+)
+
+def fold_text(text: str) -> str:
+    """Normaliza o texto: minúsculas, sem acentos, sem pontuação e espaços simples"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^a-z0-9 ]+", " ", text)
+    return " ".join(text.split())
+
+def classify(message: str, max_words: Optional[int] = None) -> Optional[str]:
+    """Classifica a mensagem em uma intenção frequente
+
+    Retorna None quando nenhuma regra casa ou quando a mensagem é ambígua
+    (mais de uma intenção, negação, pedido de remarcação etc.); nesses casos
+    a mensagem deve seguir para a LLM.
+    """
+    if max_words is None:
+        max_words = get_settings().intent_fast_path_max_words
+    
+    text = fold_text(message)
+    if not text or len(text.split()) > max_words:
+        return None
+    
+    negated = bool(_NEGATION.search(text))
+    ambiguous = bool(_AMBIGUOUS.search(text))
+    # A pontuação some na normalização, então a pergunta é vista no texto original
+    not_a_request = "?" in message or bool(_NOT_A_REQUEST.search(text))
+    
+    # intenção -> se alguma regra que casou já considera a negação
+    matches: Dict[str, bool] = {}
+    for intent, pattern, handles_negation in _RULES:
+        if pattern.search(text):
+            matches[intent] = matches.get(intent, False) or handles_negation
+    
+    if len(matches) != 1:
+        return None
+    intent, handles_negation = matches.popitem()
+    if intent in (CONFIRM, CANCEL, NEXT_APPOINTMENT):
+        if ambiguous or (negated and not handles_negation):
+            return None
+    if intent in (CONFIRM, CANCEL) and not_a_request:
+        return None
+    return intent
+
+def is_router_prompt(text: str) -> bool:
+    """Indica se a resposta do assistente foi dada pelo atalho (saudação ou próxima consulta)"""
+    return text.endswith(ROUTER_PROMPT) or text.startswith(NEXT_APPOINTMENT_REPLY)
+
+def _format_datetime(value: Any) -> str:
+    return parse_event_datetime(value).astimezone(clinic_timezone()).strftime("%d/%m/%Y às %H:%M")
+
+class IntentStats:
+    """Contadores de acerto e latência por intenção do atalho determinístico"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits: Dict[str, int] = {}
+        self._latency_ms: Dict[str, float] = {}
+        self._max_latency_ms: Dict[str, float] = {}
+        self._fallbacks = 0
+    
+    def record_hit(self, intent: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self._hits[intent] = self._hits.get(intent, 0) + 1
+            self._latency_ms[intent] = self._latency_ms.get(intent, 0.0) + elapsed_ms
+            self._max_latency_ms[intent] = max(self._max_latency_ms.get(intent, 0.0), elapsed_ms)
+    
+    def record_fallback(self) -> None:
+        with self._lock:
+            self._fallbacks += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = sum(self._hits.values())
+            total = hits + self._fallbacks
+            return {
+                "total": total,
+                "fast_path_hits": hits,
+                "llm_fallbacks": self._fallbacks,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "intents": {
+                    intent: {
+                        "hits": count,
+                        "avg_latency_ms": round(self._latency_ms[intent] / count, 2),
+                        "max_latency_ms": round(self._max_latency_ms[intent], 2)
+                    }
+                    for intent, count in self._hits.items()
+                }
+            }
+
+_stats = IntentStats()
+
+def get_intent_stats() -> IntentStats:
+    """Retorna as estatísticas do atalho de intenções do processo"""
+    return _stats
+
+class IntentRouter:
+    """Atende intenções frequentes de um tenant sem passar pela LLM
+
+    Saudações e agradecimentos são respondidos na hora; consultar, confirmar
+    e cancelar a próxima consulta são executados direto pelas ferramentas do
+    Firestore, identificando o paciente pelo número do WhatsApp.
+    """
+    
+    def __init__(self, app_id: str, user_id: str):
+        # As ferramentas dependem do LangChain: importadas só com o agente
+        from .tools.firebase_tools import GetNextAppointmentTool, UpdateAppointmentStatusTool
+        self.app_id = app_id
+        self.user_id = user_id
+        self.next_appointment_tool = GetNextAppointmentTool(app_id=app_id, user_id=user_id)
+        self.update_status_tool = UpdateAppointmentStatusTool(app_id=app_id, user_id=user_id)
+    
+    async def _find_patients(self, phone: Optional[str]) -> List[Dict[str, Any]]:
+        """Pacientes cadastrados com o número (pode haver mais de um, ex.: família)"""
+        if not phone:
+            return []
+        with span("patient_lookup"):
+            return await get_phone_index(self.app_id, self.user_id).lookup_all(phone)
+    
+    async def _next_appointment(self, patient_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Retorna (sucesso, próxima consulta) usando a ferramenta do Firestore"""
+        result = await self.next_appointment_tool._arun(patient_id=patient_id)
+        try:
+            return True, json.loads(result)
+        except ValueError:
+            log.warning("Próxima consulta indisponível no atalho", patient_id=patient_id, result=result)
+            return False, None
+    
+    async def _update_status(self, event_id: str, action: str) -> bool:
+        result = await self.update_status_tool._arun(event_id=event_id, action=action)
+        if result.startswith("Erro") or result.startswith("Ação inválida"):
+            log.warning("Falha ao atualizar status pelo atalho", event_id=event_id, action=action, result=result)
+            return False
+        return True
+    
+    async def _answer(self, intent: str, phone: Optional[str]) -> Optional[str]:
+        if intent == THANKS:
+            return "Por nada! Se precisar de algo, é só chamar."
+        
+        patients = await self._find_patients(phone)
+        # Com o número compartilhado não dá para saber de quem é a consulta
+        patient = patients[0] if len(patients) == 1 else None
+        if intent == GREETING:
+            first_name = (patient.get("nome") or "").split(" ")[0] if patient else ""
+            greeting = f"Olá, {first_name}!" if first_name else "Olá!"
+            return f"{greeting} Sou o assistente virtual do consultório. {ROUTER_PROMPT}"
+        
+        # As demais intenções dependem do paciente e da agenda; sem eles, a LLM conduz
+        if patient is None:
+            return None
+        ok, event = await self._next_appointment(patient["id"])
+        if not ok:
+            return None
+        if event is None:
+            return "Não encontrei consultas agendadas para você. Deseja marcar um horário?"
+        
+        when = _format_datetime(event["startDateTime"])
+        if intent == NEXT_APPOINTMENT:
+            titulo = event.get("titulo") or event.get("tipo") or "Consulta"
+            return f"{NEXT_APPOINTMENT_REPLY}{titulo}) está marcada para {when}."
+        if intent == CONFIRM:
+            if not await self._update_status(event["id"], "confirmar"):
+                return None
+            return f"Consulta de {when} confirmada! Até lá."
+        if intent == CANCEL:
+            if not await self._update_status(event["id"], "cancelar"):
+                return None
+            return f"Sua consulta de {when} foi cancelada. Se quiser, posso ajudar a marcar um novo horário."
+        return None
+    
+    async def handle(
+        self,
+        message: str,
+        phone: Optional[str] = None,
+        last_reply: Optional[Callable[[], Awaitable[Optional[str]]]] = None
+    ) -> Optional[str]:
+        """Responde a mensagem pelo atalho, ou retorna None para seguir para a LLM
+
+        last_reply carrega a última resposta do assistente na conversa. Um
+        "confirmo" ou "cancela" só é executado direto quando não há pergunta
+        pendente: conversa nova ou última resposta dada pelo próprio atalho.
+        Depois de uma pergunta da LLM ("confirmo o pagamento de R$ 200?"), a
+        resposta depende do contexto e segue para a LLM.
+        """
+        start = time.perf_counter()
+        intent = classify(message)
+        if intent in ACTION_INTENTS and last_reply is not None:
+            previous = await last_reply()
+            if previous is not None and not is_router_prompt(previous):
+                intent = None
+        reply = None
+        if intent is not None:
+            try:
+                reply = await self._answer(intent, phone)
+            except Exception as e:
+                log.error("Erro no atalho de intenção", intent=intent, error=str(e))
+        
+        if reply is None:
+            _stats.record_fallback()
+        else:
+            _stats.record_hit(intent, (time.perf_counter() - start) * 1000)
+        return reply
+
+def evaluate_corpus(path: str = CORPUS_PATH) -> Dict[str, Any]:
+    """Mede acurácia, cobertura e latência do classificador no corpus rotulado
+
+    Cada item do corpus tem "text" e "intent" (null para mensagens que devem
+    seguir para a LLM). Rodar com: python -m app.agents.intent_router
+    """
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    
+    max_words = get_settings().intent_fast_path_max_words
+    per_intent: Dict[str, Dict[str, int]] = {}
+    errors = []
+    correct = 0
+    start = time.perf_counter()
+    for item in corpus:
+        expected = item["intent"] or "llm"
+        predicted = classify(item["text"], max_words=max_words) or "llm"
+        counts = per_intent.setdefault(expected, {"total": 0, "correct": 0})
+        counts["total"] += 1
+        if predicted == expected:
+            counts["correct"] += 1
+            correct += 1
+        else:
+            errors.append({"text": item["text"], "expected": expected, "predicted": predicted})
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    fast_path = sum(1 for item in corpus if item["intent"])
+    return {
+        "total": len(corpus),
+        "accuracy": round(correct / len(corpus), 4) if corpus else 0.0,
+        "fast_path_share": round(fast_path / len(corpus), 4) if corpus else 0.0,
+        "avg_classify_us": round(elapsed_ms * 1000 / len(corpus), 2) if corpus else 0.0,
+        "per_intent": {
+            intent: {**counts, "recall": round(counts["correct"] / counts["total"], 4)}
+            for intent, counts in per_intent.items()
+        },
+        "errors": errors
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(evaluate_corpus(), ensure_ascii=False, indent=2))
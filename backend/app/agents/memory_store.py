@@ -0,0 +1,191 @@
+from typing import Any, List, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+from ..config import get_settings
+
+# Codificação do tiktoken, carregada na primeira contagem (o tiktoken é opcional)
+_encoding: Any = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def _get_encoding() -> Any:
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_messages
+    ON conversation_messages (namespace, conversation, id);
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    namespace TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    summarized_upto INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, conversation)
+);
+"""
+
+# Papéis das mensagens; a resposta de um turno que usou ferramentas fica
+# marcada, para o cache saber que há uma ação em andamento na conversa
+HUMAN = "human"
+AI = "ai"
+AI_TOOLS = "ai_tools"
+
+def count_tokens(text: str) -> int:
+    """Conta tokens com o tiktoken, ou estima (~4 caracteres por token) sem ele"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+class ConversationWindow:
+    """Trecho do histórico que cabe no orçamento de tokens do prompt"""
+    
+    def __init__(
+        self,
+        summary: Optional[str],
+        messages: List[Tuple[str, str]],
+        overflow: List[Tuple[int, str, str]],
+        overflow_tokens: int
+    ):
+        self.summary = summary
+        # (role, content) das mensagens mais recentes, em ordem cronológica
+        self.messages = messages
+        # Mensagens fora da janela que ainda não entraram no resumo
+        self.overflow = overflow
+        self.overflow_tokens = overflow_tokens
+    
+    def recent_tool_turn(self, turns: int) -> bool:
+        """Indica se alguma das últimas respostas do assistente veio de um turno com ferramentas"""
+        replies = [role for role, _ in self.messages if role != HUMAN]
+        return AI_TOOLS in replies[-turns:] if turns > 0 else False
+
+class ConversationMemoryStore:
+    """Histórico persistente (SQLite) por tenant e número de WhatsApp
+
+    Cada turno carrega apenas as mensagens mais recentes que cabem no orçamento
+    de tokens; as mais antigas são incorporadas a um resumo incremental, de
+    forma que o tamanho do prompt não cresce com a duração da conversa.
+    """
+    
+    def __init__(self, path: str, token_budget: int = 1500, summary_trigger_tokens: int = 400):
+        self.path = path
+        self.token_budget = token_budget
+        self.summary_trigger_tokens = summary_trigger_tokens
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+    
+    def load(self, namespace: str, conversation: str) -> ConversationWindow:
+        """Carrega o resumo e a janela de mensagens recentes da conversa"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summarized_upto FROM conversation_summaries "
+                "WHERE namespace = ? AND conversation = ?",
+                (namespace, conversation)
+            ).fetchone()
+            summary, summarized_upto = row if row else (None, 0)
+            
+            cursor = self._conn.execute(
+                "SELECT id, role, content, tokens FROM conversation_messages "
+                "WHERE namespace = ? AND conversation = ? AND id > ? ORDER BY id DESC",
+                (namespace, conversation, summarized_upto)
+            )
+            
+            budget = self.token_budget - (count_tokens(summary) if summary else 0)
+            window: List[Tuple[str, str]] = []
+            overflow: List[Tuple[int, str, str]] = []
+            overflow_tokens = 0
+            for message_id, role, content, tokens in cursor:
+                if not overflow and tokens <= budget:
+                    window.append((role, content))
+                    budget -= tokens
+                else:
+                    overflow.append((message_id, role, content))
+                    overflow_tokens += tokens
+        
+        window.reverse()
+        overflow.reverse()
+        return ConversationWindow(summary, window, overflow, overflow_tokens)
+    
+    def append(self, namespace: str, conversation: str, messages: List[Tuple[str, str]]) -> None:
+        """Grava as mensagens (role, content) de um turno"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO conversation_messages "
+                "(namespace, conversation, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(namespace, conversation, role, content, count_tokens(content), now) for role, content in messages]
+            )
+    
+    def save_summary(self, namespace: str, conversation: str, summary: str, summarized_upto: int) -> None:
+        """Atualiza o resumo incremental até a mensagem indicada"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversation_summaries (namespace, conversation, summary, summarized_upto, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, conversation) DO UPDATE SET "
+                "summary = excluded.summary, summarized_upto = excluded.summarized_upto, "
+                "updated_at = excluded.updated_at "
+                "WHERE excluded.summarized_upto > conversation_summaries.summarized_upto",
+                (namespace, conversation, summary, summarized_upto, time.time())
+            )
+    
+    def needs_summary(self, window: ConversationWindow) -> bool:
+        return window.overflow_tokens >= self.summary_trigger_tokens
+    
+    def clear(self, namespace: str, conversation: str) -> None:
+        """Apaga o histórico da conversa"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM conversation_messages WHERE namespace = ? AND conversation = ?",
+                (namespace, conversation)
+            )
+            self._conn.execute(
+                "DELETE FROM conversation_summaries WHERE namespace = ? AND conversation = ?",
+                (namespace, conversation)
+            )
+
+_store: Optional[ConversationMemoryStore] = None
+_store_lock = threading.Lock()
+
+def get_memory_store() -> ConversationMemoryStore:
+    """Retorna o armazenamento de conversas do processo"""
+    global _store
+    
+    with _store_lock:
+        if _store is None:
+            settings = get_settings()
+            _store = ConversationMemoryStore(
+                path=settings.memory_store_path,
+                token_budget=settings.memory_token_budget,
+                summary_trigger_tokens=settings.memory_summary_trigger_tokens
+            )
+        return _store
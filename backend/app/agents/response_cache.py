@@ -0,0 +1,239 @@
+from typing import Any, Dict, FrozenSet, Optional, Set, Tuple
+from collections import Counter, OrderedDict
+import hashlib
+import math
+import threading
+import time
+from ..config import get_settings
+from .intent_router import fold_text
+
+# (namespace do tenant, texto normalizado)
+CacheKey = Tuple[str, str]
+
+# Palavras que não mudam a pergunta (saudação, cortesia); as demais palavras
+# longas e os números (procedimento, valor, quantidade) precisam ser iguais
+# para uma pergunta parecida reaproveitar a resposta
+_FILLER_WORDS = frozenset({
+    "bom", "boa", "dia", "tarde", "noite", "ola", "tudo", "bem", "por", "favor",
+    "gostaria", "queria", "quero", "saber", "poderia", "pode", "voces", "doutor",
+    "doutora", "obrigado", "obrigada", "entao", "aqui", "para", "sobre"
+})
+
+def prompt_fingerprint(*parts: Any) -> str:
+    """Gera a impressão digital do prompt (modelo, system message, ferramentas)"""
+    raw = "|".join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Trigramas de caracteres do texto normalizado (para a busca por similaridade)"""
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def anchor_tokens(text: str) -> FrozenSet[str]:
+    """Números e palavras de conteúdo (4+ letras, fora as de cortesia) do texto normalizado"""
+    return frozenset(
+        word for word in text.split()
+        if word.isdigit() or (len(word) >= 4 and word not in _FILLER_WORDS)
+    )
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class _Entry:
+    __slots__ = ("response", "grams", "anchors", "expires_at", "hits")
+    
+    def __init__(self, response: str, grams: FrozenSet[str], anchors: FrozenSet[str], expires_at: float):
+        self.response = response
+        self.grams = grams
+        self.anchors = anchors
+        self.expires_at = expires_at
+        self.hits = 0
+
+class ResponseCache:
+    """Cache de respostas da LLM para perguntas frequentes (FAQ) por tenant
+
+    A chave é o texto normalizado (minúsculas, sem acentos e pontuação) dentro
+    do namespace do tenant. Opcionalmente (similaridade > 0), uma pergunta
+    parecida reaproveita a resposta: os trigramas precisam passar do limiar e
+    os números e palavras de conteúdo (procedimento, valor) precisam ser os
+    mesmos, para "quanto custa a limpeza" não responder "quanto custa o
+    clareamento". Os trigramas ficam em um índice invertido, então a busca
+    só olha as entradas que compartilham trigramas com a pergunta. As entradas expiram
+    por TTL, as menos usadas são descartadas ao atingir o tamanho máximo e o
+    cache do tenant é limpo quando o prompt do agente muda.
+    """
+    
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl_seconds: float = 21600,
+        similarity_threshold: float = 0.0,
+        min_words: int = 3
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.min_words = min_words
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._by_namespace: Dict[str, Set[CacheKey]] = {}
+        # (namespace, trigrama) -> chaves que contêm o trigrama
+        self._by_gram: Dict[Tuple[str, str], Set[CacheKey]] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._exact_hits = 0
+        self._similar_hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._invalidations = 0
+    
+    def normalize(self, message: str) -> Optional[str]:
+        """Retorna o texto normalizado, ou None se a mensagem for curta demais
+
+        Mensagens muito curtas ("e quanto custa?") dependem do histórico da
+        conversa e não podem ser respondidas fora de contexto.
+        """
+        text = fold_text(message)
+        if len(text.split()) < self.min_words:
+            return None
+        return text
+    
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for gram in entry.grams:
+                posting = self._by_gram.get((key[0], gram))
+                if posting is not None:
+                    posting.discard(key)
+                    if not posting:
+                        del self._by_gram[(key[0], gram)]
+        keys = self._by_namespace.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_namespace[key[0]]
+    
+    def _check_fingerprint(self, namespace: str, fingerprint: str) -> None:
+        """Descarta as respostas do tenant geradas com outro prompt"""
+        previous = self._fingerprints.get(namespace)
+        if previous != fingerprint:
+            if previous is not None:
+                for key in list(self._by_namespace.get(namespace, ())):
+                    self._drop(key)
+                self._invalidations += 1
+            self._fingerprints[namespace] = fingerprint
+    
+    def _find_similar(self, namespace: str, text: str, now: float) -> Optional[CacheKey]:
+        grams = trigrams(text)
+        anchors = anchor_tokens(text)
+        # Jaccard >= limiar exige ao menos limiar * |trigramas da pergunta| em comum
+        shared: "Counter[CacheKey]" = Counter()
+        for gram in grams:
+            shared.update(self._by_gram.get((namespace, gram), ()))
+        min_shared = math.ceil(self.similarity_threshold * len(grams))
+        
+        best_key, best_score = None, self.similarity_threshold
+        for key, count in shared.items():
+            if count < min_shared:
+                continue
+            entry = self._entries[key]
+            if entry.expires_at <= now or entry.anchors != anchors:
+                continue
+            score = _jaccard(grams, entry.grams)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+    
+    def get(self, namespace: str, fingerprint: str, message: str) -> Optional[str]:
+        """Busca a resposta em cache para a mensagem do tenant"""
+        text = self.normalize(message)
+        if text is None:
+            return None
+        
+        now = time.monotonic()
+        with self._lock:
+            self._check_fingerprint(namespace, fingerprint)
+            key = (namespace, text)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._drop(key)
+                entry = None
+            
+            if entry is not None:
+                self._exact_hits += 1
+            elif self.similarity_threshold > 0:
+                key = self._find_similar(namespace, text, now)
+                if key is not None:
+                    entry = self._entries[key]
+                    self._similar_hits += 1
+            
+            if entry is None:
+                self._misses += 1
+                return None
+            
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            return entry.response
+    
+    def put(self, namespace: str, fingerprint: str, message: str, response: str) -> None:
+        """Guarda a resposta de um turno sem chamadas de ferramentas"""
+        text = self.normalize(message)
+        if text is None:
+            return
+        
+        key = (namespace, text)
+        with self._lock:
+            self._check_fingerprint(namespace, fingerprint)
+            self._drop(key)
+            grams = trigrams(text)
+            self._entries[key] = _Entry(response, grams, anchor_tokens(text), time.monotonic() + self.ttl_seconds)
+            self._by_namespace.setdefault(namespace, set()).add(key)
+            for gram in grams:
+                self._by_gram.setdefault((namespace, gram), set()).add(key)
+            self._stores += 1
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+    
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """Remove as respostas de um tenant (ou de todos)"""
+        with self._lock:
+            keys = list(self._entries) if namespace is None else list(self._by_namespace.get(namespace, ()))
+            for key in keys:
+                self._drop(key)
+            self._invalidations += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._exact_hits + self._similar_hits
+            lookups = hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "tenants": len(self._by_namespace),
+                "exact_hits": self._exact_hits,
+                "similar_hits": self._similar_hits,
+                "misses": self._misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "stores": self._stores,
+                "invalidations": self._invalidations
+            }
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    """Retorna o cache de respostas do processo"""
+    global _cache
+    
+    with _cache_lock:
+        if _cache is None:
+            settings = get_settings()
+            _cache = ResponseCache(
+                max_size=settings.response_cache_max_size,
+                ttl_seconds=settings.response_cache_ttl_seconds,
+                similarity_threshold=settings.response_cache_similarity,
+                min_words=settings.response_cache_min_words
+            )
+        return _cache
@@ -0,0 +1,188 @@
+from typing import Any, Deque, Dict, List, Optional
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import threading
+import time
+from langchain.callbacks.base import AsyncCallbackHandler
+from ..services.metrics import record_span
+from .memory_store import count_tokens
+
+_current_usage: ContextVar[Optional["TurnUsage"]] = ContextVar("agent_turn_usage", default=None)
+
+class TokenBudgetExceeded(Exception):
+    """O turno do agente passou do orçamento de tokens"""
+
+def _message_text(message: Any) -> str:
+    content = getattr(message, "content", message)
+    if isinstance(content, str):
+        text = content
+    else:
+        text = json.dumps(content, ensure_ascii=False, default=str)
+    # Chamadas de ferramentas também ocupam o prompt
+    tool_calls = getattr(message, "additional_kwargs", {}).get("tool_calls")
+    if tool_calls:
+        text += json.dumps(tool_calls, ensure_ascii=False, default=str)
+    return text
+
+def _reported_usage(response: Any) -> Optional[Dict[str, int]]:
+    """Tokens informados pela API (llm_output ou usage_metadata da mensagem)"""
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if usage.get("prompt_tokens") is not None:
+        return {"prompt": usage["prompt_tokens"], "completion": usage.get("completion_tokens", 0)}
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return {"prompt": metadata.get("input_tokens", 0), "completion": metadata.get("output_tokens", 0)}
+    return None
+
+class TurnUsage(AsyncCallbackHandler):
+    """Conta os tokens de um turno do agente e aplica o orçamento
+
+    Usa a contagem devolvida pela API quando existe (respostas em streaming
+    normalmente não trazem) e, na falta dela, a estimativa do count_tokens. A
+    primeira chamada à LLM sempre acontece; as seguintes (novos passos com
+    ferramentas) são interrompidas se o turno passar do orçamento.
+    """
+    
+    raise_error = True
+    
+    def __init__(self, budget: int = 0):
+        self.budget = budget
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.tool_tokens_raw = 0
+        self.tool_tokens_sent = 0
+        self.started_at = time.perf_counter()
+        self._estimate = 0
+        self._llm_started: Dict[Any, float] = {}
+    
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+    
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+        self._llm_started[kwargs.get("run_id")] = time.perf_counter()
+        self._estimate = sum(count_tokens(_message_text(message)) for batch in messages for message in batch)
+        if self.budget and self.llm_calls and self.total_tokens + self._estimate > self.budget:
+            raise TokenBudgetExceeded(
+                f"Orçamento de {self.budget} tokens esgotado ({self.total_tokens} usados, "
+                f"próxima chamada ~{self._estimate})"
+            )
+    
+    async def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self.llm_calls += 1
+        started_at = self._llm_started.pop(kwargs.get("run_id"), None)
+        if started_at is not None:
+            record_span("llm", (time.perf_counter() - started_at) * 1000)
+        usage = _reported_usage(response)
+        if usage is None:
+            text = "".join(
+                _message_text(getattr(generation, "message", None) or generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+            usage = {"prompt": self._estimate, "completion": count_tokens(text)}
+        self.prompt_tokens += usage["prompt"]
+        self.completion_tokens += usage["completion"]
+    
+    async def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        started_at = self._llm_started.pop(kwargs.get("run_id"), None)
+        if started_at is not None:
+            record_span("llm", (time.perf_counter() - started_at) * 1000, error=error.__class__.__name__)
+    
+    def record_tool_output(self, raw_tokens: int, sent_tokens: int) -> None:
+        self.tool_tokens_raw += raw_tokens
+        self.tool_tokens_sent += sent_tokens
+
+@contextmanager
+def turn_usage(budget: int):
+    """Contagem de tokens do turno, visível para as ferramentas chamadas dentro do bloco"""
+    usage = TurnUsage(budget)
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+def trim_tool_output(text: str, max_tokens: int) -> str:
+    """Limita o retorno de uma ferramenta ao orçamento de tokens por chamada"""
+    raw_tokens = count_tokens(text)
+    sent = text
+    if max_tokens and raw_tokens > max_tokens:
+        # Proporcional ao número de caracteres (count_tokens pode ser só uma estimativa)
+        keep = max(1, int(len(text) * max_tokens / raw_tokens))
+        sent = text[:keep] + " …[resultado truncado]"
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.record_tool_output(raw_tokens, count_tokens(sent) if sent is not text else raw_tokens)
+    return sent
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+class TokenStats:
+    """Tokens e latência por turno de cada tenant (janela dos turnos mais recentes)"""
+    
+    def __init__(self, window: int = 500):
+        self._window = window
+        self._turns: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, namespace: str, usage: TurnUsage, status: str = "ok") -> None:
+        turn = {
+            "prompt": usage.prompt_tokens,
+            "completion": usage.completion_tokens,
+            "llm_calls": usage.llm_calls,
+            "tool_raw": usage.tool_tokens_raw,
+            "tool_sent": usage.tool_tokens_sent,
+            "latency_ms": (time.perf_counter() - usage.started_at) * 1000
+        }
+        with self._lock:
+            self._turns.setdefault(namespace, deque(maxlen=self._window)).append(turn)
+            totals = self._totals.setdefault(namespace, {"turns": 0, "prompt": 0, "completion": 0, "budget_exceeded": 0})
+            totals["turns"] += 1
+            totals["prompt"] += usage.prompt_tokens
+            totals["completion"] += usage.completion_tokens
+            if status == "budget_exceeded":
+                totals["budget_exceeded"] += 1
+    
+    def _summary(self, namespace: str) -> Dict[str, Any]:
+        turns = list(self._turns.get(namespace, []))
+        count = len(turns) or 1
+        
+        def mean(key: str) -> float:
+            return round(sum(turn[key] for turn in turns) / count, 1)
+        
+        tool_raw = sum(turn["tool_raw"] for turn in turns)
+        tool_sent = sum(turn["tool_sent"] for turn in turns)
+        return {
+            **self._totals.get(namespace, {}),
+            "window_turns": len(turns),
+            "prompt_tokens_per_turn": mean("prompt"),
+            "completion_tokens_per_turn": mean("completion"),
+            "llm_calls_per_turn": mean("llm_calls"),
+            "tool_output_tokens_saved": tool_raw - tool_sent,
+            "latency_ms": {
+                "p50": _percentile([turn["latency_ms"] for turn in turns], 0.5),
+                "p95": _percentile([turn["latency_ms"] for turn in turns], 0.95)
+            }
+        }
+    
+    def snapshot(self, namespace: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            if namespace is not None:
+                return {namespace: self._summary(namespace)}
+            return {name: self._summary(name) for name in self._turns}
+
+_stats = TokenStats()
+
+def get_token_stats() -> TokenStats:
+    return _stats
@@ -1,117 +1,288 @@
-from typing import Optional, List, Dict, Any
+from typing import List, Dict, Any
 from langchain.tools import BaseTool
-from firebase_admin import firestore, initialize_app, credentials
-from datetime import datetime, timedelta
+from firebase_admin import firestore
+from datetime import datetime, timedelta, timezone
 import json
+from ..token_budget import trim_tool_output
+from ...config import get_settings
+from ...services.agenda_index import clinic_timezone, get_agenda_index, parse_event_datetime, to_utc_iso
+from ...services.financial_rollups import create_transacao
+from ...services.firebase_client import get_firestore_client
+from ...services.firestore_async import current_writes, run_firestore, write_update
+from ...services.metrics import count_error, span
+from ...services.odontogram import apply_patch, merge_updates, replacement_fields
+
+# Campos devolvidos à LLM (o documento completo inclui odontograma e prontuário)
+PATIENT_FIELDS = ["nome", "telefone", "email", "dataNascimento", "anamnese.alergias", "anamnese.medicacoesUsoContinuo"]
+EVENT_FIELDS = ["titulo", "tipo", "startDateTime", "endDateTime", "status", "confirmado"]
+
+def _project(data: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Mantém só os campos (caminhos com ".") presentes no documento"""
+    projected: Dict[str, Any] = {}
+    for path in fields:
+        value: Any = data
+        for key in path.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value in (None, "", [], {}):
+            continue
+        target = projected
+        *parents, leaf = path.split(".")
+        for key in parents:
+            target = target.setdefault(key, {})
+        target[leaf] = value
+    return projected
 
 class FirebaseTool(BaseTool):
-    """Classe base para ferramentas que interagem com o Firebase"""
+    """Classe base para ferramentas que interagem com o Firebase
+
+    O tenant (app_id/user_id) é fixado na criação da ferramenta e não faz parte
+    dos argumentos que a LLM preenche.
+    """
+    
+    app_id: str
+    user_id: str
     
-    def __init__(self):
-        # Inicializa o Firebase Admin SDK
-        cred = credentials.Certificate("path/to/serviceAccountKey.json")
-        initialize_app(cred)
-        self.db = firestore.client()
+    @property
+    def db(self):
+        """Cliente Firestore compartilhado por todas as ferramentas"""
+        return get_firestore_client()
     
-    def _get_collection_path(self, app_id: str, user_id: str, collection: str) -> str:
-        """Retorna o caminho da coleção no Firestore"""
-        return f"artifacts/{app_id}/users/{user_id}/{collection}"
+    def _get_collection_path(self, collection: str) -> str:
+        """Retorna o caminho da coleção do tenant no Firestore"""
+        return f"artifacts/{self.app_id}/users/{self.user_id}/{collection}"
+    
+    async def _arun(self, *args: Any, **kwargs: Any) -> str:
+        """Executa a ferramenta no pool do Firestore, sem bloquear o event loop
+
+        Chamadas de ferramentas independentes emitidas pela LLM no mesmo passo
+        rodam em paralelo, cada uma em uma thread do pool.
+        """
+        kwargs.pop("run_manager", None)
+        with span("tool", self.name) as current:
+            result = await run_firestore(self._run, *args, **kwargs)
+            # As ferramentas devolvem o erro como texto para a LLM, sem exceção
+            if result.startswith("Erro"):
+                count_error("tool", self.name)
+                if current is not None:
+                    current.error = "error"
+        return trim_tool_output(result, get_settings().agent_tool_output_max_tokens)
 
 class GetPatientTool(FirebaseTool):
     name = "get_patient"
     description = "Busca informações de um paciente pelo nome ou ID"
     
-    def _run(self, query: str, app_id: str, user_id: str) -> str:
+    def _run(self, query: str) -> str:
         try:
-            collection_path = self._get_collection_path(app_id, user_id, "pacientes")
+            collection_path = self._get_collection_path("pacientes")
             patients_ref = self.db.collection(collection_path)
             
             # Tenta buscar por ID primeiro
-            doc = patients_ref.document(query).get()
+            doc = patients_ref.document(query).get(field_paths=PATIENT_FIELDS)
             if doc.exists:
-                return json.dumps(doc.to_dict(), ensure_ascii=False)
+                return json.dumps({"id": doc.id, **_project(doc.to_dict() or {}, PATIENT_FIELDS)}, ensure_ascii=False, default=str)
             
-            # Se não encontrou por ID, busca por nome
+            # Se não encontrou por ID, busca por nome (só os campos projetados)
             query = patients_ref.where("nome", ">=", query).where("nome", "<=", query + "\uf8ff")
-            docs = query.limit(5).get()
+            docs = query.select(PATIENT_FIELDS).limit(5).get()
             
-            results = [doc.to_dict() for doc in docs]
-            return json.dumps(results, ensure_ascii=False)
+            results = [{"id": doc.id, **_project(doc.to_dict() or {}, PATIENT_FIELDS)} for doc in docs]
+            return json.dumps(results, ensure_ascii=False, default=str)
         except Exception as e:
             return f"Erro ao buscar paciente: {str(e)}"
 
+def _format_slots(slots) -> str:
+    tz = clinic_timezone()
+    return ", ".join(start.astimezone(tz).strftime("%d/%m/%Y %H:%M") for start, _ in slots)
+
+def _busy_reply(index, start: datetime, duration: timedelta) -> str:
+    slots = index.free_slots(start, duration, count=3)
+    if not slots:
+        return "Já existe um evento neste horário e não há horários livres próximos"
+    return f"Já existe um evento neste horário. Próximos horários livres: {_format_slots(slots)}"
+
+def _cancel_booking(db, collection_path: str, index, event_id: str) -> None:
+    try:
+        db.collection(collection_path).document(event_id).delete()
+    finally:
+        index.remove(event_id)
+
 class ScheduleAppointmentTool(FirebaseTool):
     name = "schedule_appointment"
-    description = "Agenda uma consulta para um paciente"
+    description = (
+        "Agenda uma consulta para um paciente (date: AAAA-MM-DD, time: HH:MM). "
+        "Se o horário estiver ocupado, retorna os próximos horários livres"
+    )
     
-    def _run(self, patient_id: str, date: str, time: str, procedure: str, app_id: str, user_id: str) -> str:
+    def _run(
+        self,
+        patient_id: str,
+        date: str,
+        time: str,
+        procedure: str,
+        duration_minutes: int = 60
+    ) -> str:
         try:
-            collection_path = self._get_collection_path(app_id, user_id, "agendaEvents")
-            events_ref = self.db.collection(collection_path)
+            collection_path = self._get_collection_path("agendaEvents")
             
-            # Converte a data e hora para datetime
+            # Data e hora informadas no horário da clínica
             datetime_str = f"{date} {time}"
-            start_time = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M")
-            end_time = start_time + timedelta(hours=1)  # Consulta padrão de 1 hora
+            start_time = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M").replace(tzinfo=clinic_timezone())
+            duration = timedelta(minutes=int(duration_minutes))
+            end_time = start_time + duration
             
-            # Verifica se já existe consulta no horário
-            query = events_ref.where("start", ">=", start_time).where("start", "<=", end_time)
-            existing = query.get()
+            index = get_agenda_index(self.app_id, self.user_id)
+            if not index.wait_ready():
+                return "A agenda ainda está carregando. Tente novamente em instantes."
             
-            if len(existing) > 0:
-                return "Já existe uma consulta agendada neste horário"
+            patient_path = self._get_collection_path("pacientes")
+            patient = self.db.collection(patient_path).document(patient_id).get(field_paths=["nome"])
+            patient_name = (patient.to_dict() or {}).get("nome", "") if patient.exists else ""
             
-            # Cria o evento
+            # Considera qualquer sobreposição, inclusive bloqueios e eventos já em andamento
+            if not index.is_free(start_time, end_time):
+                return _busy_reply(index, start_time, duration)
+            
+            # Cria o evento no mesmo formato gravado pelo frontend
             event_data = {
-                "patientId": patient_id,
-                "start": start_time,
-                "end": end_time,
-                "title": f"Consulta: {procedure}",
-                "type": "CONSULTA",
-                "status": "AGENDADO"
+                "tipo": "Avaliação" if "avalia" in procedure.lower() else "Agendamento de Tratamento",
+                "titulo": f"{procedure} - {patient_name}" if patient_name else procedure,
+                "startDateTime": to_utc_iso(start_time),
+                "endDateTime": to_utc_iso(end_time),
+                "pacienteId": patient_id,
+                "pacienteNome": patient_name,
+                "status": "Agendado"
             }
             
-            doc_ref = events_ref.add(event_data)
-            return f"Consulta agendada com sucesso. ID: {doc_ref[1].id}"
+            # Verificação e gravação numa transação do Firestore (vale entre
+            # processos); o evento é gravado na hora, e não no commit do turno
+            event_id = index.book(event_data, start_time, end_time)
+            if event_id is None:
+                return _busy_reply(index, start_time, duration)
+            writes = current_writes()
+            if writes is not None:
+                # Se o turno falhar, desfaz o agendamento junto com o resto
+                writes.on_failure(lambda: _cancel_booking(self.db, collection_path, index, event_id))
+            return f"Consulta agendada com sucesso. ID: {event_id}"
         except Exception as e:
             return f"Erro ao agendar consulta: {str(e)}"
 
+class FindFreeSlotsTool(FirebaseTool):
+    name = "find_free_slots"
+    description = (
+        "Lista os próximos horários livres na agenda a partir de uma data "
+        "(date: AAAA-MM-DD ou AAAA-MM-DD HH:MM), para oferecer alternativas ao paciente"
+    )
+    
+    def _run(self, date: str, duration_minutes: int = 60, count: int = 3) -> str:
+        try:
+            fmt = "%Y-%m-%d %H:%M" if " " in date.strip() else "%Y-%m-%d"
+            after = datetime.strptime(date.strip(), fmt).replace(tzinfo=clinic_timezone())
+            after = max(after, datetime.now(timezone.utc))
+            
+            index = get_agenda_index(self.app_id, self.user_id)
+            if not index.wait_ready():
+                return "A agenda ainda está carregando. Tente novamente em instantes."
+            
+            slots = index.free_slots(after, timedelta(minutes=int(duration_minutes)), count=int(count))
+            if not slots:
+                return "Não há horários livres no período pesquisado"
+            return f"Horários livres: {_format_slots(slots)}"
+        except Exception as e:
+            return f"Erro ao buscar horários livres: {str(e)}"
+
 class ProcessPaymentTool(FirebaseTool):
     name = "process_payment"
     description = "Registra um pagamento para um paciente"
     
-    def _run(self, patient_id: str, amount: float, method: str, description: str, app_id: str, user_id: str) -> str:
+    def _run(self, patient_id: str, amount: float, method: str, description: str) -> str:
         try:
-            collection_path = self._get_collection_path(app_id, user_id, "transacoesFinanceiras")
-            transactions_ref = self.db.collection(collection_path)
-            
+            # Mesmo formato das transações do frontend (tipo Entrada, data AAAA-MM-DD)
             transaction_data = {
-                "patientId": patient_id,
+                "pacienteId": patient_id,
                 "valor": amount,
-                "tipo": "RECEITA",
+                "tipo": "Entrada",
+                "categoria": "Procedimento Odontológico",
                 "metodoPagamento": method,
                 "descricao": description,
-                "data": firestore.SERVER_TIMESTAMP
+                "data": datetime.now(clinic_timezone()).date().isoformat()
             }
             
-            doc_ref = transactions_ref.add(transaction_data)
-            return f"Pagamento registrado com sucesso. ID: {doc_ref[1].id}"
+            transacao_id = create_transacao(self.app_id, self.user_id, transaction_data)
+            return f"Pagamento registrado com sucesso. ID: {transacao_id}"
         except Exception as e:
             return f"Erro ao registrar pagamento: {str(e)}"
 
 class UpdatePatientRecordTool(FirebaseTool):
     name = "update_patient_record"
-    description = "Atualiza o prontuário de um paciente (anamnese, exames, etc)"
+    description = (
+        "Atualiza o prontuário de um paciente (anamnese, exames, odontograma). "
+        "Para o odontograma envie data={\"operacoes\": [{\"dente\": 36, \"lista\": \"tratamentos\", "
+        "\"id\": \"...\", \"campos\": {\"status\": \"Executado\"}}]}"
+    )
     
-    def _run(self, patient_id: str, record_type: str, data: Dict[str, Any], app_id: str, user_id: str) -> str:
+    def _run(self, patient_id: str, record_type: str, data: Dict[str, Any]) -> str:
         try:
-            collection_path = self._get_collection_path(app_id, user_id, "pacientes")
+            collection_path = self._get_collection_path("pacientes")
             patient_ref = self.db.collection(collection_path).document(patient_id)
             
-            # Atualiza o campo específico do prontuário
-            update_data = {record_type: data}
-            patient_ref.update(update_data)
+            if record_type == "odontograma":
+                # Alterações pontuais por caminho; a lista completa é gravada no formato em uso
+                if isinstance(data, dict) and "operacoes" in data:
+                    apply_patch(patient_ref, data["operacoes"])
+                else:
+                    write_update(patient_ref, replacement_fields(data))
+            elif isinstance(data, dict):
+                # Grava só as chaves enviadas, sem reescrever a seção inteira
+                write_update(patient_ref, merge_updates(record_type, data))
+            else:
+                write_update(patient_ref, {record_type: data})
             
             return f"Prontuário atualizado com sucesso para o paciente {patient_id}"
         except Exception as e:
-            return f"Erro ao atualizar prontuário: {str(e)}" 
\ No newline at end of file
+            return f"Erro ao atualizar prontuário: {str(e)}" 
+
+class GetNextAppointmentTool(FirebaseTool):
+    name = "get_next_appointment"
+    description = "Busca a próxima consulta agendada de um paciente pelo ID do paciente"
+    
+    def _run(self, patient_id: str) -> str:
+        try:
+            collection_path = self._get_collection_path("agendaEvents")
+            events_ref = self.db.collection(collection_path)
+            
+            # Filtra por paciente no Firestore e pela data aqui (evita índice composto)
+            now = datetime.now(timezone.utc)
+            upcoming = []
+            for doc in events_ref.where("pacienteId", "==", patient_id).stream():
+                event = doc.to_dict()
+                start = parse_event_datetime(event.get("startDateTime"))
+                if start is not None and start >= now and event.get("status") == "Agendado":
+                    upcoming.append((start, {"id": doc.id, **_project(event, EVENT_FIELDS)}))
+            
+            if not upcoming:
+                return json.dumps(None)
+            
+            _, next_event = min(upcoming, key=lambda item: item[0])
+            return json.dumps(next_event, ensure_ascii=False, default=str)
+        except Exception as e:
+            return f"Erro ao buscar próxima consulta: {str(e)}"
+
+class UpdateAppointmentStatusTool(FirebaseTool):
+    name = "update_appointment_status"
+    description = "Confirma ou cancela uma consulta (action: 'confirmar' ou 'cancelar')"
+    
+    def _run(self, event_id: str, action: str) -> str:
+        try:
+            collection_path = self._get_collection_path("agendaEvents")
+            event_ref = self.db.collection(collection_path).document(event_id)
+            
+            if action == "confirmar":
+                write_update(event_ref, {"confirmado": True, "confirmadoEm": firestore.SERVER_TIMESTAMP})
+                return f"Consulta {event_id} confirmada com sucesso"
+            if action == "cancelar":
+                write_update(event_ref, {"status": "Cancelado", "canceladoEm": firestore.SERVER_TIMESTAMP})
+                return f"Consulta {event_id} cancelada com sucesso"
+            
+            return f"Ação inválida: {action}"
+        except Exception as e:
+            return f"Erro ao atualizar consulta: {str(e)}"
@@ -11,18 +11,118 @@ class Settings(BaseSettings):
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     openai_model_name: str = os.getenv("OPENAI_MODEL_NAME", "gpt-4-turbo-preview")
     
+    # Registro de agentes (cache por tenant)
+    agent_registry_max_size: int = int(os.getenv("AGENT_REGISTRY_MAX_SIZE", "256"))
+    agent_registry_ttl_seconds: int = int(os.getenv("AGENT_REGISTRY_TTL_SECONDS", "1800"))
+    
+    # Histórico persistente das conversas do agente
+    memory_store_path: str = os.getenv("MEMORY_STORE_PATH", "data/conversations.db")
+    memory_token_budget: int = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+    memory_summary_trigger_tokens: int = int(os.getenv("MEMORY_SUMMARY_TRIGGER_TOKENS", "400"))
+    memory_summary_max_words: int = int(os.getenv("MEMORY_SUMMARY_MAX_WORDS", "150"))
+    
+    # Atalho determinístico para intenções frequentes (sem passar pela LLM)
+    intent_fast_path_enabled: bool = os.getenv("INTENT_FAST_PATH_ENABLED", "true").lower() == "true"
+    intent_fast_path_max_words: int = int(os.getenv("INTENT_FAST_PATH_MAX_WORDS", "12"))
+    
+    # Cache de respostas de perguntas frequentes (por padrão só o texto normalizado
+    # idêntico; similaridade > 0 ativa a busca aproximada por trigramas)
+    response_cache_enabled: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    response_cache_max_size: int = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "1024"))
+    response_cache_ttl_seconds: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "21600"))
+    response_cache_similarity: float = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+    response_cache_min_words: int = int(os.getenv("RESPONSE_CACHE_MIN_WORDS", "3"))
+    # Respostas recentes do assistente em que um turno com ferramentas deixa a conversa "em andamento"
+    response_cache_context_turns: int = int(os.getenv("RESPONSE_CACHE_CONTEXT_TURNS", "2"))
+    
+    # Resposta do agente em streaming, enviada ao WhatsApp em trechos (frases/parágrafos)
+    agent_streaming_enabled: bool = os.getenv("AGENT_STREAMING_ENABLED", "true").lower() == "true"
+    stream_min_chunk_chars: int = int(os.getenv("STREAM_MIN_CHUNK_CHARS", "60"))
+    stream_max_chunk_chars: int = int(os.getenv("STREAM_MAX_CHUNK_CHARS", "600"))
+    whatsapp_presence_interval_seconds: float = float(os.getenv("WHATSAPP_PRESENCE_INTERVAL_SECONDS", "8"))
+    
+    # Orçamento de tokens por turno do agente (0 desativa o limite)
+    agent_turn_token_budget: int = int(os.getenv("AGENT_TURN_TOKEN_BUDGET", "6000"))
+    agent_tool_output_max_tokens: int = int(os.getenv("AGENT_TOOL_OUTPUT_MAX_TOKENS", "600"))
+    
+    # Métricas por etapa (/metrics) e traces das mensagens mais recentes
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    metrics_trace_buffer: int = int(os.getenv("METRICS_TRACE_BUFFER", "200"))
+    
+    # Agenda (horário da clínica usado para interpretar datas e buscar horários livres)
+    clinic_timezone: str = os.getenv("CLINIC_TIMEZONE", "America/Sao_Paulo")
+    agenda_opening_hour: int = int(os.getenv("AGENDA_OPENING_HOUR", "8"))
+    agenda_closing_hour: int = int(os.getenv("AGENDA_CLOSING_HOUR", "18"))
+    agenda_working_days: str = os.getenv("AGENDA_WORKING_DAYS", "0,1,2,3,4")  # 0 = segunda-feira
+    agenda_slot_step_minutes: int = int(os.getenv("AGENDA_SLOT_STEP_MINUTES", "30"))
+    agenda_search_horizon_days: int = int(os.getenv("AGENDA_SEARCH_HORIZON_DAYS", "14"))
+    agenda_chairs: str = os.getenv("AGENDA_CHAIRS", "1")  # ids das cadeiras (campo "cadeira" do evento)
+    
     # Evolution API
     evolution_api_url: str = os.getenv("EVOLUTION_API_URL", "http://localhost:8080")
     evolution_api_key: str = os.getenv("EVOLUTION_API_KEY", "")
+    evolution_http_timeout: float = float(os.getenv("EVOLUTION_HTTP_TIMEOUT", "10"))
+    evolution_http_connect_timeout: float = float(os.getenv("EVOLUTION_HTTP_CONNECT_TIMEOUT", "5"))
+    evolution_http_max_connections: int = int(os.getenv("EVOLUTION_HTTP_MAX_CONNECTIONS", "100"))
+    evolution_http_max_keepalive: int = int(os.getenv("EVOLUTION_HTTP_MAX_KEEPALIVE", "20"))
+    evolution_http_keepalive_expiry: float = float(os.getenv("EVOLUTION_HTTP_KEEPALIVE_EXPIRY", "30"))
+    evolution_http_retries: int = int(os.getenv("EVOLUTION_HTTP_RETRIES", "3"))
+    evolution_http_backoff_base: float = float(os.getenv("EVOLUTION_HTTP_BACKOFF_BASE", "0.5"))
+    evolution_http_backoff_max: float = float(os.getenv("EVOLUTION_HTTP_BACKOFF_MAX", "8"))
+    
+    # Lembretes em lote: enviados pela fila de saída, no ritmo por instância da Evolution
+    # (80/s é a vazão padrão de um número no WhatsApp Business)
+    reminder_rate_per_second: float = float(os.getenv("REMINDER_RATE_PER_SECOND", "80"))
+    reminder_burst: int = int(os.getenv("REMINDER_BURST", "80"))
+    
+    # Fila persistente de mensagens de saída
+    outbound_queue_path: str = os.getenv("OUTBOUND_QUEUE_PATH", "data/outbound_queue.db")
+    outbound_queue_workers: int = int(os.getenv("OUTBOUND_QUEUE_WORKERS", "4"))
+    outbound_queue_batch_size: int = int(os.getenv("OUTBOUND_QUEUE_BATCH_SIZE", "20"))
+    outbound_queue_max_attempts: int = int(os.getenv("OUTBOUND_QUEUE_MAX_ATTEMPTS", "5"))
+    outbound_queue_backoff_base: float = float(os.getenv("OUTBOUND_QUEUE_BACKOFF_BASE", "2"))
+    outbound_queue_backoff_max: float = float(os.getenv("OUTBOUND_QUEUE_BACKOFF_MAX", "300"))
+    
+    # Ingestão dos webhooks do WhatsApp ("async" responde na hora e processa em segundo plano)
+    webhook_ingestion_mode: str = os.getenv("WEBHOOK_INGESTION_MODE", "async")
+    inbound_queue_path: str = os.getenv("INBOUND_QUEUE_PATH", "data/inbound_queue.db")
+    inbound_queue_workers: int = int(os.getenv("INBOUND_QUEUE_WORKERS", "8"))
+    inbound_queue_max_pending: int = int(os.getenv("INBOUND_QUEUE_MAX_PENDING", "1000"))
+    inbound_queue_max_per_conversation: int = int(os.getenv("INBOUND_QUEUE_MAX_PER_CONVERSATION", "20"))
     
     # Firebase (se estiver usando)
     firebase_project_id: str = os.getenv("FIREBASE_PROJECT_ID", "")
     firebase_private_key: str = os.getenv("FIREBASE_PRIVATE_KEY", "")
     firebase_client_email: str = os.getenv("FIREBASE_CLIENT_EMAIL", "")
+    # Pool de threads das chamadas bloqueantes ao Firestore e escritas do turno em um único commit
+    firestore_executor_workers: int = int(os.getenv("FIRESTORE_EXECUTOR_WORKERS", "16"))
+    firestore_turn_batching_enabled: bool = os.getenv("FIRESTORE_TURN_BATCHING_ENABLED", "true").lower() == "true"
+    # Odontograma no formato compacto (edições por caminho). Deixe desligado enquanto
+    # o frontend ler e gravar o array "odontograma" direto no Firestore
+    odontogram_compact_enabled: bool = os.getenv("ODONTOGRAM_COMPACT_ENABLED", "false").lower() == "true"
+    
+    # Tenant (app_id/user_id) atendido pelo número de WhatsApp da clínica
+    whatsapp_app_id: str = os.getenv("WHATSAPP_APP_ID", "")
+    whatsapp_user_id: str = os.getenv("WHATSAPP_USER_ID", "")
+    # Tenants ("appId:userId", separados por vírgula) cujos rollups financeiros o
+    # processo principal mantém em dia com o frontend (vazio: o tenant do WhatsApp)
+    rollup_sync_tenants: str = os.getenv("ROLLUP_SYNC_TENANTS", "")
+    
+    # Logs estruturados (JSON em uma thread própria)
+    log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    log_payload_sample_rate: float = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+    log_redaction_enabled: bool = os.getenv("LOG_REDACTION_ENABLED", "true").lower() == "true"
+    log_queue_max_size: int = int(os.getenv("LOG_QUEUE_MAX_SIZE", "10000"))
     
     # Server
     port: int = int(os.getenv("PORT", "8000"))
     host: str = os.getenv("HOST", "127.0.0.1")
+    server_mode: str = os.getenv("SERVER_MODE", "dev")  # dev (reload, 1 processo) ou prod
+    server_workers: int = int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1)))
+    server_graceful_timeout: float = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+    # blocking: aquece antes de aceitar conexões; background: aceita na hora e aquece em paralelo; off
+    server_warmup: str = os.getenv("SERVER_WARMUP", "blocking")
+    server_lock_path: str = os.getenv("SERVER_LOCK_PATH", "data/server.lock")
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Tuple
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Orçamento da importação a frio de app.main (o que todo worker paga ao subir).
+# Roda `python -X importtime -c "import app.main"` em processos novos e falha
+# (código 1) se o tempo passar do orçamento ou se algum SDK pesado que deve ser
+# carregado sob demanda aparecer na importação. A partir de backend/:
+#
+#     python -m app.import_budget
+#     python -m app.import_budget --budget-ms 800 --execucoes 5 --json
+
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1000"))
+
+# Carregados só no primeiro uso do agente/Firestore/relatórios (ver services/lazy_import.py)
+LAZY_PACKAGES = (
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "tiktoken",
+    "firebase_admin",
+    "google.cloud",
+    "google.api_core",
+    "grpc",
+    "numpy",
+)
+
+TARGET = "app.main"
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Linhas do -X importtime: (módulo, self µs, acumulado µs)"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        modules.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return modules
+
+def measure_import(target: str = TARGET) -> Dict[str, Any]:
+    """Importa o módulo em um processo novo e retorna o tempo e os módulos carregados"""
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=backend_dir,
+        capture_output=True,
+        text=True
+    )
+    modules = _parse_importtime(result.stderr)
+    if result.returncode != 0:
+        error = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Falha ao importar {target}: {' '.join(error[-3:])}")
+    
+    total_us = next((cumulative for name, _, cumulative in reversed(modules) if name == target), 0)
+    return {"total_ms": round(total_us / 1000, 1), "modules": modules}
+
+def check_import_budget(budget_ms: float = DEFAULT_BUDGET_MS, runs: int = 3, top: int = 10) -> Dict[str, Any]:
+    """Mede a importação `runs` vezes (vale a mais rápida) e compara com o orçamento"""
+    measurements = [measure_import() for _ in range(max(1, runs))]
+    best = min(measurements, key=lambda item: item["total_ms"])
+    names = {name for name, _, _ in best["modules"]}
+    eager = sorted(
+        name for name in names
+        if any(name == package or name.startswith(package + ".") for package in LAZY_PACKAGES)
+    )
+    slowest = sorted(best["modules"], key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "target": TARGET,
+        "budget_ms": budget_ms,
+        "total_ms": best["total_ms"],
+        "runs_ms": [item["total_ms"] for item in measurements],
+        "modules": len(names),
+        "eager_lazy_packages": eager,
+        "slowest_self_ms": [{"module": name, "self_ms": round(self_us / 1000, 1)} for name, self_us, _ in slowest],
+        "ok": best["total_ms"] <= budget_ms and not eager
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verifica o tempo de importação a frio de app.main")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="orçamento (IMPORT_BUDGET_MS)")
+    parser.add_argument("--execucoes", type=int, default=3, help="importações medidas (vale a mais rápida)")
+    parser.add_argument("--top", type=int, default=10, help="módulos mais lentos listados")
+    parser.add_argument("--json", action="store_true", help="imprime o resultado em JSON")
+    options = parser.parse_args()
+    
+    try:
+        report = check_import_budget(options.budget_ms, options.execucoes, options.top)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+    
+    if options.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{report['target']}: {report['total_ms']} ms (orçamento {report['budget_ms']} ms, {report['modules']} módulos)")
+        for item in report["slowest_self_ms"]:
+            print(f"  {item['self_ms']:>8} ms  {item['module']}")
+        if report["eager_lazy_packages"]:
+            print(f"Importados na inicialização (deveriam ser sob demanda): {', '.join(report['eager_lazy_packages'])}")
+    sys.exit(0 if report["ok"] else 1)
+
+if __name__ == "__main__":
+    main()
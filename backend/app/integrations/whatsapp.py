@@ -1,14 +1,20 @@
 from typing import Dict, Any, Optional, List
 import httpx
 from datetime import datetime
-import json
 import os
 from dotenv import load_dotenv
+from ..services.http_transport import get_http_transport
+from ..services.structured_log import get_logger
+
+log = get_logger(__name__)
 
 load_dotenv()
 
 class WhatsAppIntegration:
-    def __init__(self):
+    def __init__(self, retry_server_errors: bool = True):
+        # False quando quem chama já repete o envio (fila de saída), para um 5xx
+        # não virar duas mensagens iguais para o paciente
+        self.retry_server_errors = retry_server_errors
         self.base_url = os.getenv("EVOLUTION_API_URL", "http://localhost:8080")
         self.api_key = os.getenv("EVOLUTION_API_KEY")
         self.instance_name = os.getenv("EVOLUTION_INSTANCE_NAME", "bm-odonto")
@@ -30,20 +36,22 @@ class WhatsAppIntegration:
         
         url = f"{self.base_url}/{endpoint}"
         
-        async with httpx.AsyncClient() as client:
-            try:
-                if method == "GET":
-                    response = await client.get(url, headers=headers)
-                elif method == "POST":
-                    response = await client.post(url, headers=headers, json=data)
-                else:
-                    raise ValueError(f"Método HTTP não suportado: {method}")
-                
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                print(f"Erro na requisição HTTP: {str(e)}")
-                raise
+        if method not in ("GET", "POST"):
+            raise ValueError(f"Método HTTP não suportado: {method}")
+        
+        try:
+            response = await get_http_transport().request(
+                method,
+                url,
+                headers=headers,
+                json=data if method == "POST" else None,
+                retry_server_errors=self.retry_server_errors or method == "GET"
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            log.error("Erro na requisição HTTP", error=str(e))
+            raise
     
     async def send_message(self, to: str, message: str) -> Dict[str, Any]:
         """Envia uma mensagem de texto via WhatsApp"""
@@ -55,6 +63,17 @@ class WhatsAppIntegration:
         
         return await self._make_request("POST", endpoint, data)
     
+    async def send_presence(self, to: str, presence: str = "composing", delay_ms: int = 3000) -> Dict[str, Any]:
+        """Mostra "digitando..." (composing) ou "gravando áudio..." (recording) para o contato"""
+        endpoint = f"chat/sendPresence/{self.instance_name}"
+        data = {
+            "number": to,
+            "presence": presence,
+            "delay": delay_ms
+        }
+        
+        return await self._make_request("POST", endpoint, data)
+    
     async def send_template(
         self,
         to: str,
@@ -1,19 +1,82 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-import os
+from contextlib import asynccontextmanager
+import asyncio
+import time
 from dotenv import load_dotenv
 
-from .agents.dental_agent import DentalAgent
-from .integrations.whatsapp import WhatsAppIntegration
+from .agents.agent_registry import get_agent_registry
+from .agents.intent_router import evaluate_corpus, get_intent_stats
+from .agents.response_cache import get_response_cache
+from .services.financial_rollups import start_rollup_syncs, stop_rollup_syncs
+from .services.firestore_async import get_write_stats, run_firestore, shutdown_firestore_executor
+from .services.structured_log import get_log_stats, get_logger, setup_logging, shutdown_logging
+from .services.http_transport import get_http_transport, close_http_transport
+from .services.metrics import get_metrics, span
+from .services.reminder_dispatcher import get_reminder_dispatcher, reminder_dedup_key
+from .services.server_lifecycle import get_server_state, run_warm_up
+from .services.reply_streamer import StreamedReply, get_reply_stats, record_buffered_reply
+from .services.outbound_queue import get_outbound_queue
+from .services.webhook_ingestor import BackpressureError, build_message_id, get_webhook_ingestor
+from .config import get_settings
+from .models.reminder import ReminderJobStatus
+from .routers import agenda, financeiro, pacientes, whatsapp
 
 load_dotenv()
 
+log = get_logger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Abre os recursos compartilhados na inicialização e os libera no encerramento"""
+    setup_logging()
+    settings = get_settings()
+    state = get_server_state()
+    # Com vários workers, só o principal recupera as mensagens pendentes das filas
+    primary = state.acquire_primary(settings.server_lock_path)
+    await get_http_transport().start()
+    warmup_task: Optional[asyncio.Task] = None
+    if settings.server_warmup == "blocking":
+        await run_warm_up(state)
+    elif settings.server_warmup == "background":
+        # Rotas sem agente respondem já; o agente e o Firestore carregam em paralelo
+        warmup_task = asyncio.create_task(run_warm_up(state))
+    await get_outbound_queue().start(recover=primary)
+    await get_webhook_ingestor().start(recover=primary)
+    rollup_task: Optional[asyncio.Task] = None
+    if primary:
+        # Um listener de rollups por tenant na implantação, não um por worker
+        rollup_task = asyncio.create_task(run_firestore(start_rollup_syncs))
+    state.ready = True
+    log.info("Servidor pronto", pid=state.pid, primary=primary, warmup=settings.server_warmup)
+    yield
+    # O uvicorn já parou de aceitar conexões e esperou as requisições em andamento;
+    # falta terminar os turnos recebidos pelo webhook e enviar as respostas
+    state.ready = False
+    state.draining = True
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    if rollup_task is not None and not rollup_task.done():
+        rollup_task.cancel()
+    started_at = time.perf_counter()
+    await get_webhook_ingestor().stop(timeout=settings.server_graceful_timeout)
+    await get_outbound_queue().stop(timeout=settings.server_graceful_timeout, drain=True)
+    state.drain_ms = round((time.perf_counter() - started_at) * 1000, 1)
+    log.info("Servidor encerrado", pid=state.pid, drain_ms=state.drain_ms)
+    await close_http_transport()
+    stop_rollup_syncs()
+    shutdown_firestore_executor()
+    state.release_primary()
+    shutdown_logging()
+
 app = FastAPI(
     title="BM Odonto CRM API",
     description="API para o sistema de CRM odontológico com integração WhatsApp",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuração CORS
@@ -25,11 +88,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Rotas de recursos do CRM
+app.include_router(pacientes.router)
+app.include_router(agenda.router)
+app.include_router(financeiro.router)
+app.include_router(whatsapp.router)
+
 # Modelos Pydantic
 class WhatsAppMessage(BaseModel):
     from_number: str
     message: str
     timestamp: Optional[str] = None
+    message_id: Optional[str] = None
 
 class AgentResponse(BaseModel):
     response: str
@@ -53,38 +123,109 @@ async def root():
     return APIStatus()
 
 # Dependências
-async def get_whatsapp():
-    try:
-        whatsapp = WhatsAppIntegration()
-        return whatsapp
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao inicializar WhatsApp: {str(e)}")
-
 async def get_agent(app_id: str = Header(...), user_id: str = Header(...)):
     try:
-        agent = DentalAgent(app_id=app_id, user_id=user_id)
-        return agent
+        # Reutiliza o agente do tenant em vez de reconstruí-lo a cada requisição
+        return get_agent_registry().get(app_id, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao inicializar agente: {str(e)}")
 
+async def process_webhook_message(payload: Dict[str, Any]) -> None:
+    """Processa em segundo plano uma mensagem recebida pelo webhook"""
+    with span("webhook", "webhook", trace_id=payload["message_id"]):
+        await _process_webhook_message(payload)
+
+async def _process_webhook_message(payload: Dict[str, Any]) -> None:
+    started_at = time.perf_counter()
+    agent = get_agent_registry().get(payload["app_id"], payload["user_id"])
+    
+    if get_settings().agent_streaming_enabled:
+        # Cada frase/parágrafo vai para o paciente assim que fica pronto
+        with span("agent"):
+            async with StreamedReply(
+                payload["from_number"],
+                dedup_prefix=f"reply:{payload['message_id']}",
+                started_at=started_at
+            ) as reply:
+                await agent.stream_dental_query(
+                    payload["message"],
+                    reply.send,
+                    conversation_id=payload["from_number"]
+                )
+        return
+    
+    with span("agent"):
+        response = await agent.process_dental_query(
+            payload["message"],
+            conversation_id=payload["from_number"]
+        )
+    
+    await get_outbound_queue().enqueue(
+        "text",
+        {"to": payload["from_number"], "message": response},
+        dedup_key=f"reply:{payload['message_id']}"
+    )
+    record_buffered_reply((time.perf_counter() - started_at) * 1000)
+
+get_webhook_ingestor().register_handler("webhook", process_webhook_message)
+
 # Rotas
 @app.post("/webhook/whatsapp", response_model=AgentResponse)
 async def whatsapp_webhook(
     message: WhatsAppMessage,
-    whatsapp: WhatsAppIntegration = Depends(get_whatsapp),
-    agent: DentalAgent = Depends(get_agent)
+    app_id: str = Header(...),
+    user_id: str = Header(...)
 ):
     """
     Webhook para receber mensagens do WhatsApp e processá-las com o agente
     """
+    # Mensagens do assistente do sistema precisam da resposta no corpo da requisição
+    if get_settings().webhook_ingestion_mode == "async" and message.from_number != "system":
+        message_id = message.message_id or build_message_id(
+            message.timestamp, app_id, user_id, message.from_number, message.message
+        )
+        try:
+            accepted = await get_webhook_ingestor().ingest(
+                "webhook",
+                message_id=message_id,
+                conversation_key=f"{app_id}:{user_id}:{message.from_number}",
+                payload={
+                    "app_id": app_id,
+                    "user_id": user_id,
+                    "from_number": message.from_number,
+                    "message": message.message,
+                    "timestamp": message.timestamp,
+                    "message_id": message_id
+                }
+            )
+        except BackpressureError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        
+        return AgentResponse(
+            response="",
+            action_taken="message_queued" if accepted else "duplicate_ignored",
+            metadata={
+                "from_number": message.from_number,
+                "timestamp": message.timestamp,
+                "message_id": message_id
+            }
+        )
+    
+    agent = await get_agent(app_id=app_id, user_id=user_id)
     try:
         # Processa a mensagem com o agente
-        response = await agent.process_dental_query(message.message)
+        with span("agent", trace_id=message.message_id or build_message_id(
+            message.timestamp, app_id, user_id, message.from_number, message.message
+        )):
+            response = await agent.process_dental_query(
+                message.message,
+                conversation_id=message.from_number
+            )
         
-        # Envia a resposta de volta pelo WhatsApp
-        await whatsapp.send_message(
-            to=message.from_number,
-            message=response
+        # Coloca a resposta na fila de saída do WhatsApp
+        await get_outbound_queue().enqueue(
+            "text",
+            {"to": message.from_number, "message": response}
         )
         
         return AgentResponse(
@@ -107,63 +248,184 @@ async def send_appointment_reminder(
     patient_name: str,
     date: str,
     procedure: str,
-    whatsapp: WhatsAppIntegration = Depends(get_whatsapp)
+    event_id: Optional[str] = None,
+    resend: bool = False
 ):
     """
     Envia um lembrete de consulta via WhatsApp
+
+    Chamadas repetidas para a mesma consulta não duplicam o lembrete; use
+    resend=true para reenviar de propósito.
     """
     try:
         from datetime import datetime
         appointment_date = datetime.strptime(date, "%Y-%m-%d %H:%M")
         
-        response = await whatsapp.send_reminder(
-            to=to,
-            patient_name=patient_name,
-            date=appointment_date,
-            procedure=procedure
+        queue_id = await get_outbound_queue().enqueue(
+            "reminder",
+            {
+                "to": to,
+                "patient_name": patient_name,
+                "date": appointment_date.isoformat(),
+                "procedure": procedure
+            },
+            dedup_key=None if resend else (
+                reminder_dedup_key(event_id, appointment_date) if event_id
+                else f"reminder:{to}:{appointment_date.isoformat()}"
+            )
         )
         
-        return {"status": "success", "message_id": response.get("messageId")}
+        return {"status": "queued", "queue_id": queue_id}
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao enviar lembrete: {str(e)}"
         )
 
+@app.post("/send/reminders/bulk", response_model=ReminderJobStatus)
+async def send_bulk_reminders(
+    date: Optional[str] = None,
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Coloca na fila de saída os lembretes de todas as consultas do dia (padrão: amanhã)
+    """
+    try:
+        from datetime import date as date_type
+        day = date_type.fromisoformat(date) if date else None
+        
+        job = get_reminder_dispatcher().start(app_id=app_id, user_id=user_id, day=day)
+        return job
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao agendar lembretes: {str(e)}"
+        )
+
+@app.get("/send/reminders/bulk/{job_id}", response_model=ReminderJobStatus)
+async def get_bulk_reminders_status(job_id: str):
+    """
+    Consulta o andamento de um envio de lembretes em lote
+    """
+    job = await get_reminder_dispatcher().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job de lembretes não encontrado")
+    return job
+
 @app.post("/send/payment-confirmation")
 async def send_payment_confirmation(
     to: str,
     patient_name: str,
     amount: float,
     date: str,
-    whatsapp: WhatsAppIntegration = Depends(get_whatsapp)
+    transaction_id: Optional[str] = None
 ):
     """
     Envia uma confirmação de pagamento via WhatsApp
+
+    Com transaction_id (id da transação em transacoesFinanceiras), a
+    confirmação é enviada uma vez por transação.
     """
     try:
         from datetime import datetime
         payment_date = datetime.strptime(date, "%Y-%m-%d")
         
-        response = await whatsapp.send_payment_confirmation(
-            to=to,
-            patient_name=patient_name,
-            amount=amount,
-            date=payment_date
+        queue_id = await get_outbound_queue().enqueue(
+            "payment_confirmation",
+            {
+                "to": to,
+                "patient_name": patient_name,
+                "amount": amount,
+                "date": payment_date.isoformat()
+            },
+            dedup_key=f"payment:{transaction_id}" if transaction_id else None
         )
         
-        return {"status": "success", "message_id": response.get("messageId")}
+        return {"status": "queued", "queue_id": queue_id}
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao enviar confirmação de pagamento: {str(e)}"
         )
 
+@app.get("/webhook/metrics")
+async def get_webhook_metrics():
+    """
+    Retorna o estado da fila de mensagens recebidas
+    """
+    return get_webhook_ingestor().stats()
+
+@app.get("/agent/intents/metrics")
+async def get_intent_metrics():
+    """
+    Retorna a taxa de acerto e a latência por intenção do atalho sem LLM
+    """
+    return get_intent_stats().snapshot()
+
+@app.get("/agent/intents/benchmark")
+async def get_intent_benchmark():
+    """
+    Avalia o classificador de intenções no corpus rotulado
+    """
+    return evaluate_corpus()
+
+@app.get("/agent/cache/metrics")
+async def get_response_cache_metrics():
+    """
+    Retorna o estado do cache de respostas do agente
+    """
+    return get_response_cache().stats()
+
+@app.get("/agent/writes/metrics")
+async def get_agent_write_metrics():
+    """
+    Retorna quantos turnos do agente gravaram no Firestore e quantas escritas por commit
+    """
+    return get_write_stats()
+
+@app.get("/agent/stream/metrics")
+async def get_agent_stream_metrics():
+    """
+    Retorna o tempo até a primeira mensagem e a latência total das respostas (streaming x inteira)
+    """
+    return get_reply_stats()
+
+@app.get("/agent/tokens/metrics")
+async def get_agent_token_metrics(app_id: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    Retorna tokens de prompt/resposta e latência por turno do agente, por tenant
+    """
+    namespace = f"{app_id}:{user_id}" if app_id and user_id else None
+    # Importado aqui: token_budget depende do LangChain, carregado só com o agente
+    from .agents.token_budget import get_token_stats
+    return get_token_stats().snapshot(namespace)
+
+@app.get("/metrics")
+async def get_pipeline_metrics(formato: str = "prometheus"):
+    """
+    Retorna a latência por etapa (parse, busca do paciente, agente, ferramentas, LLM, envio),
+    os erros e as novas tentativas; formato=json inclui os traces mais recentes
+    """
+    metrics = get_metrics()
+    if formato == "json":
+        return {**metrics.snapshot(), "logs": get_log_stats(), "traces": metrics.traces()}
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/outbound/metrics")
+async def get_outbound_metrics():
+    """
+    Retorna profundidade e taxa de envio da fila de mensagens de saída
+    """
+    return await get_outbound_queue().metrics()
+
+@app.get("/server/metrics")
+async def get_server_metrics():
+    """
+    Retorna o estado deste processo do servidor (aquecimento, papel e drenagem)
+    """
+    return {**get_server_state().stats(), "ingestor": get_webhook_ingestor().stats()}
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    ) 
\ No newline at end of file
+    from .server import run_server
+    run_server() 
\ No newline at end of file
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List
+
+class AvailabilitySlot(BaseModel):
+    chair: str
+    start: datetime
+    end: datetime
+
+class AvailabilityResponse(BaseModel):
+    duration: int
+    slot_minutes: int
+    slots: List[AvailabilitySlot] = []
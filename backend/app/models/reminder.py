@@ -0,0 +1,34 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+class Reminder(BaseModel):
+    event_id: str
+    paciente_id: str
+    patient_name: str
+    to: str
+    date: datetime
+    procedure: str
+
+class ReminderResult(BaseModel):
+    event_id: str
+    to: str
+    status: str = "pending"
+    queue_id: Optional[int] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+class ReminderJobStatus(BaseModel):
+    job_id: str
+    app_id: str
+    user_id: str
+    date: str
+    status: str = "pending"
+    total: int = 0
+    queued: int = 0
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    results: List[ReminderResult] = []
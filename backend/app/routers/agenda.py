@@ -0,0 +1,154 @@
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Request
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Optional
+import asyncio
+from ..services.agenda_index import clinic_timezone, get_agenda_index, to_utc_iso
+from ..services.availability import get_availability_engine
+from ..services.firebase_client import get_firestore_client
+from ..services.firestore_async import run_firestore
+from ..services.pagination import collection_path, etag_response, fetch_page, parse_fields
+from ..models.agenda import AvailabilityResponse
+
+router = APIRouter(prefix="/agenda", tags=["agenda"])
+
+LIST_FIELDS = ("tipo", "titulo", "startDateTime", "endDateTime", "pacienteId", "pacienteNome", "status")
+REQUIRED_FIELDS = ("tipo", "titulo", "startDateTime", "endDateTime", "status")
+
+def _collection(app_id: str, user_id: str):
+    return get_firestore_client().collection(collection_path(app_id, user_id, "agendaEvents"))
+
+def _day_start(day: date) -> str:
+    """Início do dia no horário da clínica, no formato gravado em startDateTime"""
+    return to_utc_iso(datetime.combine(day, time(0), clinic_timezone()))
+
+@router.get("")
+async def list_eventos(
+    request: Request,
+    from_date: Optional[date] = Query(None, alias="from", description="Primeiro dia (AAAA-MM-DD)"),
+    to_date: Optional[date] = Query(None, alias="to", description="Último dia, inclusive (AAAA-MM-DD)"),
+    paciente_id: Optional[str] = Query(None, alias="pacienteId"),
+    status: Optional[str] = None,
+    tipo: Optional[str] = None,
+    limit: int = Query(100, gt=0, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula"),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Lista os eventos da agenda por período, paginados por data de início
+    """
+    collection = _collection(app_id, user_id)
+    query = collection
+    if from_date:
+        query = query.where("startDateTime", ">=", _day_start(from_date))
+    if to_date:
+        query = query.where("startDateTime", "<", _day_start(to_date + timedelta(days=1)))
+    # Filtros de igualdade combinados com o período usam índices compostos do Firestore
+    if paciente_id:
+        query = query.where("pacienteId", "==", paciente_id)
+    if status:
+        query = query.where("status", "==", status)
+    if tipo:
+        query = query.where("tipo", "==", tipo)
+    
+    items, next_cursor = await run_firestore(
+        fetch_page,
+        collection,
+        query,
+        order_by="startDateTime",
+        limit=limit,
+        cursor=cursor,
+        fields=parse_fields(fields, LIST_FIELDS)
+    )
+    return etag_response(request, {"items": items, "next_cursor": next_cursor})
+
+@router.post("", status_code=201)
+async def create_evento(
+    evento: Dict[str, Any] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Cria um evento na agenda
+    """
+    missing = [field for field in REQUIRED_FIELDS if not evento.get(field)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Campos obrigatórios: {', '.join(missing)}")
+    evento.pop("id", None)
+    _, doc_ref = await run_firestore(_collection(app_id, user_id).add, evento)
+    # Atualiza o índice da agenda na hora, sem esperar o listener
+    get_agenda_index(app_id, user_id).upsert(doc_ref.id, evento)
+    return {"id": doc_ref.id}
+
+@router.put("/{evento_id}")
+async def update_evento(
+    evento_id: str,
+    evento: Dict[str, Any] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Atualiza os campos enviados do evento
+    """
+    evento.pop("id", None)
+    doc_ref = _collection(app_id, user_id).document(evento_id)
+    
+    def write():
+        doc_ref.set(evento, merge=True)
+        # Documento completo depois do merge, para o índice (disponibilidade e horários)
+        return doc_ref.get().to_dict() or {}
+    
+    data = await run_firestore(write)
+    # Atualiza o índice da agenda na hora, sem esperar o listener
+    get_agenda_index(app_id, user_id).upsert(evento_id, data)
+    return {"id": evento_id}
+
+@router.delete("/{evento_id}")
+async def delete_evento(
+    evento_id: str,
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Remove um evento da agenda
+    """
+    await run_firestore(_collection(app_id, user_id).document(evento_id).delete)
+    get_agenda_index(app_id, user_id).remove(evento_id)
+    return {"id": evento_id}
+
+@router.get("/availability", response_model=AvailabilityResponse)
+async def get_availability(
+    from_date: date = Query(..., alias="from", description="Primeiro dia (AAAA-MM-DD)"),
+    to_date: date = Query(..., alias="to", description="Último dia, inclusive (AAAA-MM-DD)"),
+    duration: int = Query(60, gt=0, le=720, description="Duração em minutos"),
+    chair: Optional[str] = Query(None, description="Filtra por cadeira"),
+    limit: int = Query(50, gt=0, le=500),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Lista os horários livres da agenda a partir dos bitmaps de disponibilidade
+    """
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' deve ser maior ou igual a 'from'")
+    if (to_date - from_date).days > 366:
+        raise HTTPException(status_code=400, detail="Intervalo máximo de um ano")
+    
+    engine = get_availability_engine(app_id, user_id)
+    if chair is not None and chair not in engine.chairs:
+        raise HTTPException(status_code=404, detail=f"Cadeira não encontrada: {chair}")
+    
+    # Só na primeira consulta do tenant, enquanto o listener carrega a agenda
+    if not await asyncio.to_thread(get_agenda_index(app_id, user_id).wait_ready):
+        raise HTTPException(status_code=503, detail="Agenda ainda carregando, tente novamente")
+    
+    slots = engine.search(
+        from_date,
+        to_date,
+        duration,
+        chair=chair,
+        limit=limit,
+        not_before=datetime.now(timezone.utc)
+    )
+    return AvailabilityResponse(duration=duration, slot_minutes=engine.slot_minutes, slots=slots)
@@ -0,0 +1,232 @@
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from datetime import date
+from typing import Any, Dict, Optional
+from ..services.financial_rollups import (
+    TIPOS,
+    create_transacao as create_transacao_with_rollups,
+    daily_ids,
+    delete_transacao as delete_transacao_with_rollups,
+    get_kpis,
+    get_rollups,
+    monthly_ids,
+    normalize_transacao,
+    rebuild_rollups,
+    update_transacao as update_transacao_with_rollups
+)
+from ..services.financial_report import generate_report, stream_csv, stream_json
+from ..services.firebase_client import get_firestore_client
+from ..services.firestore_async import run_firestore
+from ..services.pagination import collection_path, etag_response, fetch_page, parse_fields
+
+router = APIRouter(prefix="/financeiro", tags=["financeiro"])
+
+def _validate(transacao: Dict[str, Any]) -> Dict[str, Any]:
+    transacao = normalize_transacao(transacao)
+    if transacao.get("tipo") not in TIPOS:
+        raise HTTPException(status_code=400, detail="tipo deve ser 'Entrada' ou 'Saída'")
+    try:
+        date.fromisoformat(str(transacao.get("data")))
+        transacao["valor"] = float(transacao["valor"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Informe data (AAAA-MM-DD) e valor numérico")
+    return transacao
+
+def _collection(app_id: str, user_id: str):
+    return get_firestore_client().collection(collection_path(app_id, user_id, "transacoesFinanceiras"))
+
+async def _list(
+    request: Request,
+    app_id: str,
+    user_id: str,
+    from_date: Optional[date],
+    to_date: Optional[date],
+    tipo: Optional[str],
+    categoria: Optional[str],
+    paciente_id: Optional[str],
+    limit: int,
+    cursor: Optional[str],
+    fields: Optional[str]
+):
+    collection = _collection(app_id, user_id)
+    query = collection
+    # "data" é gravada como AAAA-MM-DD, então a comparação de strings respeita a ordem
+    if from_date:
+        query = query.where("data", ">=", from_date.isoformat())
+    if to_date:
+        query = query.where("data", "<=", to_date.isoformat())
+    if tipo:
+        query = query.where("tipo", "==", tipo)
+    if categoria:
+        query = query.where("categoria", "==", categoria)
+    if paciente_id:
+        query = query.where("pacienteId", "==", paciente_id)
+    
+    items, next_cursor = await run_firestore(
+        fetch_page,
+        collection,
+        query,
+        order_by="data",
+        limit=limit,
+        cursor=cursor,
+        fields=parse_fields(fields, ()) or None,
+        descending=True
+    )
+    return etag_response(request, {"items": items, "next_cursor": next_cursor})
+
+@router.get("")
+async def list_transacoes(
+    request: Request,
+    from_date: Optional[date] = Query(None, alias="from", description="Primeiro dia (AAAA-MM-DD)"),
+    to_date: Optional[date] = Query(None, alias="to", description="Último dia, inclusive (AAAA-MM-DD)"),
+    tipo: Optional[str] = None,
+    categoria: Optional[str] = None,
+    paciente_id: Optional[str] = Query(None, alias="pacienteId"),
+    limit: int = Query(100, gt=0, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula"),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Lista as transações financeiras, das mais recentes para as mais antigas
+    """
+    return await _list(
+        request, app_id, user_id, from_date, to_date, tipo, categoria, paciente_id, limit, cursor, fields
+    )
+
+@router.get("/paciente/{paciente_id}")
+async def list_transacoes_paciente(
+    paciente_id: str,
+    request: Request,
+    limit: int = Query(100, gt=0, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula"),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Lista as transações de um paciente
+    """
+    return await _list(request, app_id, user_id, None, None, None, None, paciente_id, limit, cursor, fields)
+
+@router.post("", status_code=201)
+async def create_transacao(
+    transacao: Dict[str, Any] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Registra uma transação financeira e atualiza os rollups do painel
+    """
+    transacao = _validate(transacao)
+    transacao_id = await run_firestore(create_transacao_with_rollups, app_id, user_id, transacao)
+    return {"id": transacao_id}
+
+@router.put("/{transacao_id}")
+async def update_transacao(
+    transacao_id: str,
+    transacao: Dict[str, Any] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Atualiza uma transação, aplicando a diferença nos rollups
+    """
+    found = await run_firestore(update_transacao_with_rollups, app_id, user_id, transacao_id, transacao)
+    if not found:
+        raise HTTPException(status_code=404, detail="Transação não encontrada")
+    return {"id": transacao_id}
+
+@router.delete("/{transacao_id}")
+async def delete_transacao(
+    transacao_id: str,
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Remove uma transação e desconta seus valores dos rollups
+    """
+    found = await run_firestore(delete_transacao_with_rollups, app_id, user_id, transacao_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Transação não encontrada")
+    return {"id": transacao_id}
+
+@router.get("/kpis")
+async def get_dashboard_kpis(
+    request: Request,
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    KPIs financeiros do painel (hoje, mês atual e anterior) lidos dos rollups
+    """
+    return etag_response(request, await run_firestore(get_kpis, app_id, user_id))
+
+@router.get("/rollups")
+async def list_rollups(
+    request: Request,
+    from_date: date = Query(..., alias="from", description="Primeiro dia (AAAA-MM-DD)"),
+    to_date: date = Query(..., alias="to", description="Último dia, inclusive (AAAA-MM-DD)"),
+    escala: str = Query("dia", pattern="^(dia|mes)$"),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Totais por dia ou por mês no período, por tipo, categoria, método e tipo de gasto
+    """
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' deve ser maior ou igual a 'from'")
+    doc_ids = daily_ids(from_date, to_date) if escala == "dia" else monthly_ids(from_date, to_date)
+    if len(doc_ids) > 400:
+        raise HTTPException(status_code=400, detail="Período muito longo para esta escala")
+    items = await run_firestore(get_rollups, app_id, user_id, doc_ids)
+    return etag_response(request, {"escala": escala, "items": items})
+
+@router.post("/rollups/rebuild")
+async def rebuild_financeiro_rollups(
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Recalcula os rollups a partir de todas as transações (carga inicial ou correção)
+    """
+    return await run_firestore(rebuild_rollups, app_id, user_id)
+
+@router.get("/relatorio")
+async def get_relatorio(
+    from_date: date = Query(..., alias="from", description="Primeiro dia (AAAA-MM-DD)"),
+    to_date: date = Query(..., alias="to", description="Último dia, inclusive (AAAA-MM-DD)"),
+    formato: str = Query("json", pattern="^(json|csv)$"),
+    projecao_meses: int = Query(3, ge=1, le=12, description="Meses projetados"),
+    base_meses: int = Query(3, ge=1, le=12, description="Meses usados na média das despesas fixas"),
+    recebiveis: bool = Query(True, description="Inclui o saldo a receber por paciente"),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Relatório financeiro: comparação com o período anterior, categorias, recebíveis e projeção
+    """
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' deve ser maior ou igual a 'from'")
+    if (to_date - from_date).days > 366:
+        raise HTTPException(status_code=400, detail="Intervalo máximo de um ano")
+    
+    report = await run_firestore(
+        generate_report,
+        app_id,
+        user_id,
+        from_date,
+        to_date,
+        horizon_months=projecao_meses,
+        lookback_months=base_meses,
+        include_receivables=recebiveis
+    )
+    if formato == "csv":
+        filename = f"relatorio-{from_date.isoformat()}-{to_date.isoformat()}.csv"
+        return StreamingResponse(
+            stream_csv(report),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    return StreamingResponse(stream_json(report), media_type="application/json")
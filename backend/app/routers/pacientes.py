@@ -0,0 +1,200 @@
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Request
+from typing import Any, Dict, List, Optional
+from ..services.firebase_client import get_firestore_client
+from ..services.firestore_async import run_firestore
+from ..services.odontogram import (
+    COMPACT_FIELD,
+    LEGACY_FIELD,
+    VERSION_FIELD,
+    apply_patch,
+    expand_doc,
+    merge_updates,
+    migrate_collection,
+    replacement_fields
+)
+from ..services.pagination import collection_path, etag_response, fetch_page, parse_fields
+from ..services.lazy_import import lazy_import
+from ..services.phone_index import get_phone_index, normalize_phone
+
+router = APIRouter(prefix="/pacientes", tags=["pacientes"])
+google_exceptions = lazy_import("google.api_core.exceptions")
+
+# Campos da listagem (sem odontograma, anamnese e exames, que são os mais pesados)
+LIST_FIELDS = ("nome", "telefone", "email", "cpf", "dataNascimento", "endereco")
+PRONTUARIO_TIPOS = {"anamnese", "exameExtraoral", "exameIntraoral", "odontograma"}
+
+def _collection(app_id: str, user_id: str):
+    return get_firestore_client().collection(collection_path(app_id, user_id, "pacientes"))
+
+def _with_phone(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Mantém o telefone normalizado usado pelo índice de telefones"""
+    if "telefone" in data:
+        e164 = normalize_phone(data.get("telefone"))
+        if e164:
+            data["telefoneE164"] = e164
+    return data
+
+def _with_odontogram(data: Dict[str, Any], create: bool = False) -> Dict[str, Any]:
+    """Grava o odontograma recebido (lista de dentes) no formato em uso"""
+    if LEGACY_FIELD in data:
+        data.update(replacement_fields(data.pop(LEGACY_FIELD) or [], create=create))
+    return data
+
+@router.get("")
+async def list_pacientes(
+    request: Request,
+    limit: int = Query(50, gt=0, le=200),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula"),
+    nome: Optional[str] = Query(None, description="Prefixo do nome"),
+    telefone: Optional[str] = None,
+    cpf: Optional[str] = None,
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Lista pacientes paginados, sem o prontuário completo por padrão
+    """
+    if telefone:
+        # Busca exata pelo índice em memória, sem varrer a coleção; o número pode
+        # ser de mais de um paciente (ex.: família), então todos são retornados
+        pacientes = await get_phone_index(app_id, user_id).lookup_all(telefone)
+        return etag_response(request, {"items": pacientes, "next_cursor": None})
+    
+    collection = _collection(app_id, user_id)
+    query = collection
+    if nome:
+        query = query.where("nome", ">=", nome).where("nome", "<=", nome + "\uf8ff")
+    if cpf:
+        query = query.where("cpf", "==", cpf)
+    
+    items, next_cursor = await run_firestore(
+        fetch_page,
+        collection,
+        query,
+        order_by="nome",
+        limit=limit,
+        cursor=cursor,
+        fields=parse_fields(fields, LIST_FIELDS)
+    )
+    return etag_response(request, {"items": items, "next_cursor": next_cursor})
+
+@router.get("/{paciente_id}")
+async def get_paciente(
+    paciente_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula"),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Retorna um paciente (completo, ou apenas os campos pedidos)
+    """
+    field_paths = parse_fields(fields, ()) or None
+    if field_paths and LEGACY_FIELD in field_paths:
+        field_paths += [COMPACT_FIELD, VERSION_FIELD]
+    doc = await run_firestore(_collection(app_id, user_id).document(paciente_id).get, field_paths=field_paths)
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Paciente não encontrado")
+    return etag_response(request, {"id": doc.id, **expand_doc(doc.to_dict() or {})})
+
+@router.post("", status_code=201)
+async def create_paciente(
+    paciente: Dict[str, Any] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Cadastra um paciente
+    """
+    if not paciente.get("nome"):
+        raise HTTPException(status_code=400, detail="O nome do paciente é obrigatório")
+    paciente.pop("id", None)
+    paciente = _with_odontogram(_with_phone(paciente), create=True)
+    _, doc_ref = await run_firestore(_collection(app_id, user_id).add, paciente)
+    return {"id": doc_ref.id}
+
+@router.put("/{paciente_id}")
+async def update_paciente(
+    paciente_id: str,
+    paciente: Dict[str, Any] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Atualiza os campos enviados do paciente
+    """
+    paciente.pop("id", None)
+    doc_ref = _collection(app_id, user_id).document(paciente_id)
+    await run_firestore(doc_ref.set, _with_odontogram(_with_phone(paciente)), merge=True)
+    return {"id": paciente_id}
+
+@router.delete("/{paciente_id}")
+async def delete_paciente(
+    paciente_id: str,
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Remove um paciente
+    """
+    await run_firestore(_collection(app_id, user_id).document(paciente_id).delete)
+    return {"id": paciente_id}
+
+@router.put("/{paciente_id}/prontuario/{tipo}")
+async def update_prontuario(
+    paciente_id: str,
+    tipo: str,
+    dados: Any = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Atualiza uma seção do prontuário (anamnese, exames ou odontograma)
+    """
+    if tipo not in PRONTUARIO_TIPOS:
+        raise HTTPException(status_code=400, detail=f"Tipo de prontuário inválido: {tipo}")
+    doc_ref = _collection(app_id, user_id).document(paciente_id)
+    if tipo == LEGACY_FIELD:
+        if not isinstance(dados, list):
+            raise HTTPException(status_code=400, detail="O odontograma deve ser a lista de dentes")
+        changes = replacement_fields(dados)
+    elif isinstance(dados, dict):
+        # Grava só as chaves enviadas, sem reescrever a seção inteira
+        changes = merge_updates(tipo, dados)
+    else:
+        changes = {tipo: dados}
+    try:
+        await run_firestore(doc_ref.update, changes)
+    except google_exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="Paciente não encontrado")
+    return {"id": paciente_id, "tipo": tipo}
+
+@router.patch("/{paciente_id}/odontograma")
+async def patch_odontograma(
+    paciente_id: str,
+    operacoes: List[Dict[str, Any]] = Body(...),
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Aplica alterações pontuais no odontograma (dente, item de lista ou campo)
+    """
+    doc_ref = _collection(app_id, user_id).document(paciente_id)
+    try:
+        result = await run_firestore(apply_patch, doc_ref, operacoes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except google_exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="Paciente não encontrado")
+    return {"id": paciente_id, **result}
+
+@router.post("/odontograma/compactar")
+async def compactar_odontogramas(
+    app_id: str = Header(...),
+    user_id: str = Header(...)
+):
+    """
+    Converte os odontogramas do tenant para o formato em uso (ODONTOGRAM_COMPACT_ENABLED)
+    """
+    return await run_firestore(migrate_collection, _collection(app_id, user_id))
@@ -1,26 +1,25 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException
 from typing import Optional
 import os
+import time
 from ..services.ai_agent import AIAgent
-from ..services.evolution_api import EvolutionAPI
+from ..services.metrics import span
+from ..services.outbound_queue import get_outbound_queue
 from ..services.paciente_service import PacienteService
+from ..services.reply_streamer import StreamedReply, record_buffered_reply
+from ..services.structured_log import get_logger
+from ..services.webhook_ingestor import BackpressureError, build_message_id, get_webhook_ingestor
+from ..config import get_settings
 from ..models.whatsapp import WhatsAppMessage, WhatsAppResponse
 
 router = APIRouter(prefix="/whatsapp", tags=["whatsapp"])
+log = get_logger(__name__)
 
 # Configurações
 SUPERUSER_WHATSAPP_NUMBER = os.getenv("SUPERUSER_WHATSAPP_NUMBER")
-EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_KEY")
-EVOLUTION_INSTANCE_NAME = os.getenv("EVOLUTION_INSTANCE_NAME")
-EVOLUTION_API_URL = os.getenv("EVOLUTION_API_URL")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "http://192.168.2.52:8000/whatsapp/webhook")  # URL do webhook
 
 # Inicialização dos serviços
-evolution_api = EvolutionAPI(
-    api_key=EVOLUTION_API_KEY,
-    instance_name=EVOLUTION_INSTANCE_NAME,
-    base_url=EVOLUTION_API_URL
-)
 ai_agent = AIAgent()
 paciente_service = PacienteService()
 
@@ -28,67 +27,138 @@ async def get_paciente_by_phone(phone: str) -> Optional[dict]:
     """Busca paciente pelo número de telefone"""
     return await paciente_service.get_by_phone(phone)
 
+async def process_incoming_message(payload: dict) -> None:
+    """Identifica o remetente, processa a mensagem com o agente e enfileira a resposta"""
+    with span("webhook", "whatsapp", trace_id=payload.get("message_id")):
+        await _process_incoming_message(payload)
+
+async def _process_incoming_message(payload: dict) -> None:
+    started_at = time.perf_counter()
+    message = WhatsAppMessage(
+        from_number=payload["from_number"],
+        message=payload["message"],
+        timestamp=payload.get("timestamp")
+    )
+    
+    # Verifica se é superuser
+    is_superuser = (message.from_number == SUPERUSER_WHATSAPP_NUMBER)
+    
+    # Busca paciente pelo número (se não for superuser)
+    paciente = None
+    if not is_superuser:
+        with span("patient_lookup"):
+            paciente = await get_paciente_by_phone(message.from_number)
+    
+    dedup_prefix = f"reply:{payload['message_id']}" if payload.get("message_id") else None
+    if get_settings().agent_streaming_enabled:
+        # Cada frase/parágrafo vai para o paciente assim que fica pronto
+        with span("agent"):
+            async with StreamedReply(message.from_number, dedup_prefix=dedup_prefix, started_at=started_at) as reply:
+                response = await ai_agent.stream_message(
+                    message=message.message,
+                    user_phone=message.from_number,
+                    on_chunk=reply.send,
+                    is_superuser=is_superuser,
+                    paciente=paciente
+                )
+        queued = reply.chunks > 0
+    else:
+        # Processa a mensagem com o agente de IA
+        with span("agent"):
+            response = await ai_agent.process_message(
+                message=message.message,
+                user_phone=message.from_number,
+                is_superuser=is_superuser,
+                paciente=paciente
+            )
+        
+        # Coloca a resposta na fila de saída do WhatsApp
+        queued = bool(response)
+        if response:
+            await get_outbound_queue().enqueue(
+                "text",
+                {"to": message.from_number, "message": response},
+                dedup_key=dedup_prefix
+            )
+            record_buffered_reply((time.perf_counter() - started_at) * 1000)
+    
+    # Uma linha por mensagem (telefone e textos são mascarados na gravação)
+    log.info(
+        "Mensagem do WhatsApp processada",
+        from_number=message.from_number,
+        is_superuser=is_superuser,
+        patient_found=paciente is not None,
+        response=response or "",
+        queued=queued
+    )
+
+get_webhook_ingestor().register_handler("whatsapp", process_incoming_message)
+
+def _extract_message_id(payload: dict) -> Optional[str]:
+    """Obtém o id da mensagem enviado pela Evolution, se houver"""
+    data = payload.get("data") or {}
+    key = data.get("key") or payload.get("key") or {}
+    return payload.get("id") or payload.get("messageId") or key.get("id")
+
 @router.post("/webhook")
 async def whatsapp_webhook(request: Request):
     try:
-        # Log para debug
-        print(f"Webhook recebido em: {WEBHOOK_URL}")
-        
-        payload = await request.json()
-        print(f"Payload recebido: {payload}")  # Log do payload
+        with span("parse", "whatsapp"):
+            payload = await request.json()
+            log.sampled("Payload recebido", webhook_url=WEBHOOK_URL, payload=payload)
+            
+            # Extrai dados da mensagem
+            message = WhatsAppMessage(
+                from_number=payload.get("from"),
+                message=payload.get("body", ""),
+                timestamp=payload.get("timestamp")
+            )
         
-        # Extrai dados da mensagem
-        message = WhatsAppMessage(
-            from_number=payload.get("from"),
-            message=payload.get("body", ""),
-            timestamp=payload.get("timestamp")
-        )
-
         if not message.from_number or not message.message:
-            print("Erro: Dados da mensagem incompletos")  # Log de erro
+            log.warning("Dados da mensagem incompletos", from_number=message.from_number)
             raise HTTPException(status_code=400, detail="Dados da mensagem incompletos")
-
-        # Verifica se é superuser
-        is_superuser = (message.from_number == SUPERUSER_WHATSAPP_NUMBER)
-        print(f"É superuser? {is_superuser}")  # Log de superuser
         
-        # Busca paciente pelo número (se não for superuser)
-        paciente = None
-        if not is_superuser:
-            paciente = await get_paciente_by_phone(message.from_number)
-            print(f"Paciente encontrado: {paciente is not None}")  # Log de paciente
-
-        # Processa a mensagem com o agente de IA
-        response = await ai_agent.process_message(
-            message=message.message,
-            user_phone=message.from_number,
-            is_superuser=is_superuser,
-            paciente=paciente
+        message_id = _extract_message_id(payload) or build_message_id(
+            payload.get("timestamp"), message.from_number, message.message
         )
-        print(f"Resposta gerada: {response}")  # Log da resposta
-
-        # Envia resposta via WhatsApp
-        if response:
-            await evolution_api.send_message(
-                to_number=message.from_number,
-                message=response
-            )
-            print("Resposta enviada com sucesso")  # Log de envio
-
-        return {"status": "success", "message": "Mensagem processada"}
-
+        incoming = {
+            "from_number": message.from_number,
+            "message": message.message,
+            "timestamp": payload.get("timestamp"),
+            "message_id": message_id
+        }
+        
+        if get_settings().webhook_ingestion_mode != "async":
+            await process_incoming_message(incoming)
+            return {"status": "success", "message": "Mensagem processada"}
+        
+        # Persiste e responde na hora; o agente roda em segundo plano
+        accepted = await get_webhook_ingestor().ingest(
+            "whatsapp",
+            message_id=message_id,
+            conversation_key=message.from_number,
+            payload=incoming
+        )
+        if not accepted:
+            return {"status": "duplicate", "message": "Mensagem já recebida", "message_id": message_id}
+        return {"status": "accepted", "message": "Mensagem recebida", "message_id": message_id}
+    
+    except HTTPException:
+        raise
+    except BackpressureError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        print(f"Erro no webhook do WhatsApp: {str(e)}")  # Log de erro detalhado
+        log.exception("Erro no webhook do WhatsApp", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/send")
 async def send_message(message: WhatsAppResponse):
     """Endpoint para enviar mensagens via WhatsApp"""
     try:
-        await evolution_api.send_message(
-            to_number=message.to_number,
-            message=message.message
+        queue_id = await get_outbound_queue().enqueue(
+            "text",
+            {"to": message.to_number, "message": message.message}
         )
-        return {"status": "success", "message": "Mensagem enviada"}
+        return {"status": "queued", "message": "Mensagem enfileirada", "queue_id": queue_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
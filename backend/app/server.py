@@ -0,0 +1,57 @@
+from typing import Optional
+import argparse
+import os
+import uvicorn
+from .config import get_settings
+
+# Inicialização do servidor. A partir de backend/:
+#
+#     python main.py                       # desenvolvimento: reload, 1 processo
+#     python main.py --modo prod           # produção: SERVER_WORKERS processos
+#     python main.py --modo prod --workers 4
+#
+# Em produção não há observador de arquivos; cada worker aquece os clientes no
+# lifespan antes de aceitar conexões e, ao receber SIGTERM, para de aceitar,
+# espera as requisições em andamento e drena os turnos já recebidos (até
+# SERVER_GRACEFUL_TIMEOUT segundos).
+
+def run_server(
+    mode: Optional[str] = None,
+    workers: Optional[int] = None,
+    host: Optional[str] = None,
+    port: Optional[int] = None
+) -> None:
+    settings = get_settings()
+    mode = mode or settings.server_mode
+    host = host or os.getenv("API_HOST", settings.host)
+    port = port or int(os.getenv("API_PORT", str(settings.port)))
+    
+    if mode != "prod":
+        uvicorn.run("app.main:app", host=host, port=port, reload=True)
+        return
+    
+    workers = max(1, workers or settings.server_workers)
+    # Os processos filhos leem as configurações do ambiente
+    os.environ["SERVER_MODE"] = "prod"
+    os.environ["SERVER_WORKERS"] = str(workers)
+    uvicorn.run(
+        "app.main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        reload=False,
+        timeout_graceful_shutdown=int(settings.server_graceful_timeout),
+        log_level=settings.log_level.lower()
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor da API do BM Odonto CRM")
+    parser.add_argument("--modo", choices=["dev", "prod"], default=None, help="SERVER_MODE")
+    parser.add_argument("--workers", type=int, default=None, help="processos no modo prod (SERVER_WORKERS)")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    options = parser.parse_args()
+    run_server(options.modo, options.workers, options.host, options.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+import math
+import threading
+from ..config import get_settings
+from .firebase_client import get_firestore_client
+from .lazy_import import lazy_import
+from .structured_log import get_logger
+
+firestore = lazy_import("firebase_admin.firestore")
+
+log = get_logger(__name__)
+
+# Eventos que não ocupam a agenda
+FREE_EVENT_STATUS = {"Cancelado"}
+
+# Eventos encerrados há mais tempo que isso saem do índice
+HISTORY_SECONDS = 86400
+
+# Eventos sem cadeira (bloqueios, reuniões, agenda de cadeira única) ocupam todas
+ALL_CHAIRS = "*"
+
+# Na transação de agendamento, eventos que começam até isso antes do horário
+# pedido são relidos do Firestore; bloqueios mais longos vêm do índice
+BOOKING_LOOKBACK_SECONDS = 86400
+
+# (início, fim, tipo, cadeira) em segundos UTC; cadeira None ocupa todas
+Interval = Tuple[float, float, str, Optional[str]]
+# Notificado a cada mudança de evento (intervalo None quando o evento sai da agenda)
+Listener = Callable[[str, Optional[Interval]], None]
+
+def clinic_timezone() -> ZoneInfo:
+    """Fuso horário da clínica, usado para interpretar datas informadas pelo paciente"""
+    return ZoneInfo(get_settings().clinic_timezone)
+
+def parse_event_datetime(value: Any) -> Optional[datetime]:
+    """Converte startDateTime/endDateTime (ISO, com ou sem fuso) em datetime com fuso
+
+    O frontend grava em UTC (toISOString); valores sem fuso são interpretados
+    no horário da clínica.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=clinic_timezone())
+    return value
+
+def to_utc_iso(value: datetime) -> str:
+    """Formata no mesmo padrão do toISOString do frontend (2024-05-10T13:00:00.000Z)"""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+def configured_chairs() -> List[str]:
+    """Cadeiras da clínica (AGENDA_CHAIRS)"""
+    return [chair.strip() for chair in get_settings().agenda_chairs.split(",") if chair.strip()]
+
+def chair_scope(chair: Optional[str], chairs: List[str]) -> str:
+    """Cadeira ocupada pelo evento; sem cadeira (ou com uma desconhecida) ocupa todas"""
+    return chair if chair in chairs else ALL_CHAIRS
+
+def free_chair(
+    busy: Iterable[Optional[str]],
+    chairs: List[str],
+    wanted: Optional[str] = None
+) -> Optional[str]:
+    """Primeira cadeira livre, dadas as cadeiras dos eventos sobrepostos ao horário
+
+    Regra de capacidade comum ao AgendaIndex e ao AvailabilityEngine: o
+    horário está livre se alguma cadeira (ou a cadeira pedida) não tem evento.
+    """
+    taken = set()
+    for chair in busy:
+        scope = chair_scope(chair, chairs)
+        if scope == ALL_CHAIRS:
+            return None
+        taken.add(scope)
+    candidates = [wanted] if wanted else chairs
+    return next((chair for chair in candidates if chair in chairs and chair not in taken), None)
+
+class AgendaIndex:
+    """Índice em memória dos eventos da agenda de um tenant
+
+    Mantido atualizado por um listener do Firestore. Os intervalos ficam em
+    arrays ordenados pelo início, com o máximo acumulado dos fins, o que
+    permite verificar sobreposição em O(log n) e buscar horários livres sem
+    ir ao Firestore a cada tentativa.
+    """
+    
+    def __init__(self, app_id: str, user_id: str):
+        self.app_id = app_id
+        self.user_id = user_id
+        self._events: Dict[str, Interval] = {}
+        self._listeners: List[Listener] = []
+        self._starts: List[float] = []
+        self._ends: List[float] = []
+        self._ids: List[str] = []
+        self._max_ends: List[float] = []
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self._watch = None
+    
+    @property
+    def collection_path(self) -> str:
+        return f"artifacts/{self.app_id}/users/{self.user_id}/agendaEvents"
+    
+    @property
+    def locks_path(self) -> str:
+        return f"artifacts/{self.app_id}/users/{self.user_id}/agendaLocks"
+    
+    @staticmethod
+    def _interval(data: Dict[str, Any]) -> Optional[Interval]:
+        if data.get("status") in FREE_EVENT_STATUS:
+            return None
+        start = parse_event_datetime(data.get("startDateTime"))
+        end = parse_event_datetime(data.get("endDateTime"))
+        if start is None or end is None or end <= start:
+            return None
+        chair = data.get("cadeira")
+        return start.timestamp(), end.timestamp(), data.get("tipo") or "", str(chair) if chair else None
+    
+    def add_listener(self, listener: Listener) -> None:
+        """Registra um consumidor das mudanças, reenviando os eventos já carregados"""
+        with self._lock:
+            self._listeners.append(listener)
+            for event_id, interval in self._events.items():
+                listener(event_id, interval)
+    
+    def _notify(self, event_id: str, interval: Optional[Interval]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event_id, interval)
+            except Exception as e:
+                log.error("Erro ao notificar mudança na agenda", error=str(e))
+    
+    def upsert(self, event_id: str, data: Dict[str, Any]) -> None:
+        """Atualiza um evento no índice (também usado logo após gravar um evento)"""
+        interval = self._interval(data)
+        with self._lock:
+            if interval is None:
+                self._events.pop(event_id, None)
+            else:
+                self._events[event_id] = interval
+            self._dirty = True
+            self._notify(event_id, interval)
+    
+    def remove(self, event_id: str) -> None:
+        with self._lock:
+            if self._events.pop(event_id, None) is not None:
+                self._dirty = True
+                self._notify(event_id, None)
+    
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        with self._lock:
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    self.remove(change.document.id)
+                else:
+                    self.upsert(change.document.id, change.document.to_dict() or {})
+        self._ready.set()
+    
+    def _rebuild(self) -> None:
+        """Reordena os arrays após mudanças (chamado com o lock)"""
+        cutoff = datetime.now(timezone.utc).timestamp() - HISTORY_SECONDS
+        for event_id in [event_id for event_id, interval in self._events.items() if interval[1] < cutoff]:
+            del self._events[event_id]
+            self._notify(event_id, None)
+        
+        ordered = sorted(self._events.items(), key=lambda item: item[1][0])
+        self._ids = [event_id for event_id, _ in ordered]
+        self._starts = [interval[0] for _, interval in ordered]
+        self._ends = [interval[1] for _, interval in ordered]
+        self._max_ends = []
+        running = -math.inf
+        for end in self._ends:
+            running = max(running, end)
+            self._max_ends.append(running)
+        self._dirty = False
+    
+    def start(self) -> None:
+        """Inicia o listener dos eventos que terminam a partir de ontem (idempotente)
+
+        O filtro é pelo fim: bloqueios de vários dias e consultas em andamento
+        que começaram antes da janela também entram no índice.
+        """
+        if self._watch is None:
+            since = to_utc_iso(datetime.now(timezone.utc) - timedelta(seconds=HISTORY_SECONDS))
+            query = get_firestore_client().collection(self.collection_path).where("endDateTime", ">=", since)
+            self._watch = query.on_snapshot(self._on_snapshot)
+    
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self._ready.clear()
+    
+    def wait_ready(self, timeout: float = 10.0) -> bool:
+        """Aguarda o carregamento inicial do listener"""
+        return self._ready.wait(timeout)
+    
+    def _candidates(self, start: float, end: float) -> range:
+        """Faixa dos eventos que podem sobrepor [start, end) (chamado com o lock)"""
+        if self._dirty:
+            self._rebuild()
+        # Eventos que começam antes do fim do intervalo...
+        upper = bisect_left(self._starts, end)
+        # ...a partir do primeiro cujo máximo acumulado de fim passa do início
+        lower = bisect_right(self._max_ends, start, 0, upper)
+        return range(lower, upper)
+    
+    def overlapping(self, start: datetime, end: datetime) -> List[str]:
+        """Retorna os ids dos eventos que se sobrepõem ao intervalo"""
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        with self._lock:
+            return [self._ids[i] for i in self._candidates(start_ts, end_ts) if self._ends[i] > start_ts]
+    
+    def _overlapping_chairs(self, start_ts: float, end_ts: float) -> Dict[str, Optional[str]]:
+        """Cadeira de cada evento que se sobrepõe a [start_ts, end_ts) (chamado com o lock)"""
+        return {
+            self._ids[i]: self._events[self._ids[i]][3]
+            for i in self._candidates(start_ts, end_ts) if self._ends[i] > start_ts
+        }
+    
+    def _blocked_until(self, start_ts: float, end_ts: float, chairs: List[str]) -> Optional[float]:
+        """None se há cadeira livre; senão, o primeiro instante em que algum evento
+        sobreposto termina (antes disso qualquer horário continua bloqueado)"""
+        overlapping = [i for i in self._candidates(start_ts, end_ts) if self._ends[i] > start_ts]
+        if free_chair((self._events[self._ids[i]][3] for i in overlapping), chairs) is not None:
+            return None
+        return min(self._ends[i] for i in overlapping)
+    
+    def free_chair(self, start: datetime, end: datetime, chair: Optional[str] = None) -> Optional[str]:
+        """Cadeira livre no intervalo (a pedida, se informada), ou None se está ocupado"""
+        with self._lock:
+            busy = self._overlapping_chairs(start.timestamp(), end.timestamp())
+        return free_chair(busy.values(), configured_chairs(), chair)
+    
+    def is_free(self, start: datetime, end: datetime, chair: Optional[str] = None) -> bool:
+        return self.free_chair(start, end, chair) is not None
+    
+    def book(
+        self,
+        event_data: Dict[str, Any],
+        start: datetime,
+        end: datetime,
+        chair: Optional[str] = None
+    ) -> Optional[str]:
+        """Grava o evento se ainda houver cadeira livre; retorna o id ou None se ocupado
+
+        A verificação e a gravação rodam numa transação do Firestore que lê o
+        documento de trava do dia (agendaLocks/AAAA-MM-DD) e os eventos que
+        começam nas últimas 24h antes do horário: dois processos agendando o
+        mesmo dia são serializados pelo Firestore, que repete a transação de
+        quem perdeu. Com mais de uma cadeira, a escolhida é gravada em
+        "cadeira". O evento é gravado na hora (fora do commit do turno).
+        """
+        db = get_firestore_client()
+        events_ref = db.collection(self.collection_path)
+        doc_ref = events_ref.document()
+        lock_ref = db.collection(self.locks_path).document(start.astimezone(clinic_timezone()).date().isoformat())
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        chairs = configured_chairs()
+        since = datetime.fromtimestamp(start_ts - BOOKING_LOOKBACK_SECONDS, timezone.utc)
+        query = (
+            events_ref
+            .where("startDateTime", ">=", to_utc_iso(since))
+            .where("startDateTime", "<", to_utc_iso(end))
+        )
+        
+        @firestore.transactional
+        def run(transaction) -> Optional[Dict[str, Any]]:
+            lock_ref.get(transaction=transaction)
+            # Índice (bloqueios longos) + o que está no Firestore agora, que prevalece
+            with self._lock:
+                busy = self._overlapping_chairs(start_ts, end_ts)
+            for doc in query.stream(transaction=transaction):
+                interval = self._interval(doc.to_dict() or {})
+                if interval is not None and interval[1] > start_ts:
+                    busy[doc.id] = interval[3]
+                else:
+                    busy.pop(doc.id, None)
+            selected = free_chair(busy.values(), chairs, chair)
+            if selected is None:
+                return None
+            data = {**event_data, "cadeira": selected} if len(chairs) > 1 else dict(event_data)
+            transaction.set(doc_ref, data)
+            transaction.set(lock_ref, {"atualizadoEm": firestore.SERVER_TIMESTAMP}, merge=True)
+            return data
+        
+        data = run(db.transaction())
+        if data is None:
+            return None
+        # Atualiza o índice na hora, sem esperar o listener
+        self.upsert(doc_ref.id, data)
+        return doc_ref.id
+    
+    def free_slots(
+        self,
+        after: datetime,
+        duration: timedelta,
+        count: int = 3,
+        horizon_days: Optional[int] = None
+    ) -> List[Tuple[datetime, datetime]]:
+        """Busca os próximos horários livres dentro do expediente da clínica"""
+        settings = get_settings()
+        tz = clinic_timezone()
+        step = timedelta(minutes=settings.agenda_slot_step_minutes)
+        working_days = {int(day) for day in settings.agenda_working_days.split(",") if day.strip()}
+        horizon_days = horizon_days or settings.agenda_search_horizon_days
+        
+        chairs = configured_chairs()
+        
+        after = after.astimezone(tz)
+        slots: List[Tuple[datetime, datetime]] = []
+        with self._lock:
+            for offset in range(horizon_days + 1):
+                day = after.date() + timedelta(days=offset)
+                if day.weekday() not in working_days:
+                    continue
+                opening = datetime.combine(day, time(settings.agenda_opening_hour), tz)
+                closing = datetime.combine(day, time(settings.agenda_closing_hour), tz)
+                
+                candidate = opening
+                if candidate < after:
+                    # Alinha ao próximo múltiplo do passo depois de "after"
+                    steps = math.ceil((after - opening) / step)
+                    candidate = opening + steps * step
+                
+                while candidate + duration <= closing:
+                    slot_end = candidate + duration
+                    blocked_until = self._blocked_until(candidate.timestamp(), slot_end.timestamp(), chairs)
+                    if blocked_until is None:
+                        slots.append((candidate, slot_end))
+                        if len(slots) >= count:
+                            return slots
+                        candidate = slot_end
+                        continue
+                    # Pula direto para quando algum evento sobreposto termina, alinhado ao passo
+                    released = datetime.fromtimestamp(blocked_until, tz)
+                    candidate = opening + math.ceil((released - opening) / step) * step
+        return slots
+    
+    def __len__(self) -> int:
+        return len(self._events)
+
+_indexes: Dict[Tuple[str, str], AgendaIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_agenda_index(app_id: str, user_id: str) -> AgendaIndex:
+    """Retorna o índice da agenda do tenant, iniciando o listener na primeira chamada"""
+    key = (app_id, user_id)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = AgendaIndex(app_id, user_id)
+            index.start()
+            _indexes[key] = index
+        return index
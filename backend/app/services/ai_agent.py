@@ -0,0 +1,44 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+from ..agents.agent_registry import get_agent_registry
+from ..config import get_settings
+
+class AIAgent:
+    """Atende as mensagens do número de WhatsApp da clínica com o agente do tenant
+
+    O tenant vem de WHATSAPP_APP_ID/WHATSAPP_USER_ID; o agente é obtido do
+    registro (compartilhado com o /webhook/whatsapp) a cada mensagem.
+    """
+    
+    def _get_agent(self):
+        settings = get_settings()
+        if not settings.whatsapp_app_id or not settings.whatsapp_user_id:
+            raise ValueError("WHATSAPP_APP_ID/WHATSAPP_USER_ID não configurados no ambiente")
+        return get_agent_registry().get(settings.whatsapp_app_id, settings.whatsapp_user_id)
+    
+    async def process_message(
+        self,
+        message: str,
+        user_phone: str,
+        is_superuser: bool = False,
+        paciente: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Processa a mensagem e retorna a resposta (o histórico é separado por telefone)"""
+        agent = self._get_agent()
+        if is_superuser:
+            # Equipe da clínica: vai direto para a LLM, sem as intenções do paciente
+            return await agent.process_message(message, conversation_id=user_phone)
+        return await agent.process_dental_query(message, conversation_id=user_phone)
+    
+    async def stream_message(
+        self,
+        message: str,
+        user_phone: str,
+        on_chunk: Callable[[str], Awaitable[None]],
+        is_superuser: bool = False,
+        paciente: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Como process_message, mas entrega a resposta em trechos via on_chunk"""
+        agent = self._get_agent()
+        if is_superuser:
+            return await agent.stream_message(message, on_chunk, conversation_id=user_phone)
+        return await agent.stream_dental_query(message, on_chunk, conversation_id=user_phone)
@@ -0,0 +1,249 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from datetime import date, datetime, time, timedelta
+import math
+import random
+import threading
+from ..config import get_settings
+from .agenda_index import ALL_CHAIRS, Interval, chair_scope, clinic_timezone, configured_chairs, get_agenda_index
+
+class AvailabilityEngine:
+    """Disponibilidade da agenda de um tenant em bitmaps diários por cadeira
+
+    Cada dia é um inteiro em que o bit i representa o slot i a partir da
+    meia-noite (horário da clínica). Os bitmaps são atualizados de forma
+    incremental a cada mudança do AgendaIndex, e a busca por horários livres
+    combina o expediente com os slots ocupados usando apenas operações de bits.
+    """
+    
+    def __init__(
+        self,
+        chairs: List[str],
+        slot_minutes: int = 30,
+        opening_hour: int = 8,
+        closing_hour: int = 18,
+        working_days: Optional[Set[int]] = None
+    ):
+        self.chairs = chairs
+        self.slot_minutes = slot_minutes
+        self.slots_per_day = (24 * 60) // slot_minutes
+        self.working_days = working_days if working_days is not None else {0, 1, 2, 3, 4}
+        first = (opening_hour * 60) // slot_minutes
+        last = (closing_hour * 60) // slot_minutes
+        self.working_mask = ((1 << (last - first)) - 1) << first
+        
+        # (cadeira, dia) -> {evento: máscara de slots ocupados}
+        self._day_events: Dict[Tuple[str, date], Dict[str, int]] = {}
+        # evento -> [(cadeira, dia)] em que ele aparece
+        self._event_days: Dict[str, List[Tuple[str, date]]] = {}
+        # (cadeira, dia) -> bitmap de slots ocupados (só dias com eventos)
+        self._occupied: Dict[Tuple[str, date], int] = {}
+        self._lock = threading.Lock()
+    
+    def _masks(self, start: datetime, end: datetime) -> List[Tuple[date, int]]:
+        """Divide o intervalo por dia, arredondando para os slots que ele toca"""
+        tz = clinic_timezone()
+        start, end = start.astimezone(tz), end.astimezone(tz)
+        result = []
+        day = start.date()
+        while True:
+            midnight = datetime.combine(day, time(0), tz)
+            first = max(0, math.floor((start - midnight).total_seconds() / 60 / self.slot_minutes))
+            last = min(self.slots_per_day, math.ceil((end - midnight).total_seconds() / 60 / self.slot_minutes))
+            if last > first:
+                result.append((day, ((1 << (last - first)) - 1) << first))
+            day += timedelta(days=1)
+            if datetime.combine(day, time(0), tz) >= end:
+                return result
+    
+    def _recompute(self, chair: str, day: date) -> None:
+        if chair == ALL_CHAIRS:
+            for each in self.chairs:
+                self._recompute(each, day)
+            return
+        occupied = 0
+        for mask in self._day_events.get((chair, day), {}).values():
+            occupied |= mask
+        for mask in self._day_events.get((ALL_CHAIRS, day), {}).values():
+            occupied |= mask
+        if occupied:
+            self._occupied[(chair, day)] = occupied
+        else:
+            self._occupied.pop((chair, day), None)
+    
+    def apply(self, event_id: str, interval: Optional[Interval]) -> None:
+        """Atualiza os bitmaps afetados por um evento (listener do AgendaIndex)"""
+        with self._lock:
+            affected = set(self._event_days.pop(event_id, ()))
+            for key in affected:
+                events = self._day_events.get(key)
+                if events is not None:
+                    events.pop(event_id, None)
+                    if not events:
+                        del self._day_events[key]
+            
+            if interval is not None:
+                start_ts, end_ts, _, chair = interval
+                chair = chair_scope(chair, self.chairs)
+                tz = clinic_timezone()
+                keys = []
+                for day, mask in self._masks(datetime.fromtimestamp(start_ts, tz), datetime.fromtimestamp(end_ts, tz)):
+                    key = (chair, day)
+                    self._day_events.setdefault(key, {})[event_id] = mask
+                    keys.append(key)
+                self._event_days[event_id] = keys
+                affected.update(keys)
+            
+            for chair, day in affected:
+                self._recompute(chair, day)
+    
+    def _starts(self, free: int, length: int) -> int:
+        """Bitmap das posições em que começam `length` slots livres consecutivos"""
+        result = free
+        span = 1
+        # Dobra o tamanho da sequência a cada passo (log2(length) operações)
+        while span * 2 <= length:
+            result &= result >> span
+            span *= 2
+        if span < length:
+            result &= result >> (length - span)
+        return result
+    
+    def search(
+        self,
+        start_day: date,
+        end_day: date,
+        duration_minutes: int,
+        chair: Optional[str] = None,
+        limit: int = 50,
+        not_before: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """Lista os horários livres entre os dias informados (inclusive)"""
+        tz = clinic_timezone()
+        length = max(1, math.ceil(duration_minutes / self.slot_minutes))
+        chairs = [chair] if chair else self.chairs
+        step = timedelta(minutes=self.slot_minutes)
+        not_before = not_before.astimezone(tz) if not_before else None
+        
+        slots: List[Dict[str, Any]] = []
+        day = start_day
+        with self._lock:
+            while day <= end_day and len(slots) < limit:
+                if day.weekday() in self.working_days:
+                    midnight = datetime.combine(day, time(0), tz)
+                    window = self.working_mask
+                    if not_before is not None and not_before.date() >= day:
+                        if not_before.date() > day:
+                            window = 0
+                        else:
+                            elapsed = math.ceil((not_before - midnight).total_seconds() / 60 / self.slot_minutes)
+                            window &= ~((1 << elapsed) - 1)
+                    
+                    day_slots = []
+                    for each in chairs:
+                        free = window & ~self._occupied.get((each, day), 0)
+                        starts = self._starts(free, length)
+                        while starts:
+                            lowest = starts & -starts
+                            starts ^= lowest
+                            day_slots.append((lowest.bit_length() - 1, each))
+                    
+                    day_slots.sort()
+                    for index, each in day_slots[:limit - len(slots)]:
+                        slot_start = midnight + index * step
+                        slots.append({
+                            "chair": each,
+                            "start": slot_start,
+                            "end": slot_start + timedelta(minutes=duration_minutes)
+                        })
+                day += timedelta(days=1)
+        return slots
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chairs": self.chairs,
+                "slot_minutes": self.slot_minutes,
+                "events": len(self._event_days),
+                "occupied_days": len(self._occupied)
+            }
+
+def _build_engine() -> AvailabilityEngine:
+    settings = get_settings()
+    return AvailabilityEngine(
+        chairs=configured_chairs(),
+        slot_minutes=settings.agenda_slot_step_minutes,
+        opening_hour=settings.agenda_opening_hour,
+        closing_hour=settings.agenda_closing_hour,
+        working_days={int(day) for day in settings.agenda_working_days.split(",") if day.strip()}
+    )
+
+_engines: Dict[Tuple[str, str], AvailabilityEngine] = {}
+_engines_lock = threading.Lock()
+
+def get_availability_engine(app_id: str, user_id: str) -> AvailabilityEngine:
+    """Retorna o motor de disponibilidade do tenant, ligado ao índice da agenda"""
+    key = (app_id, user_id)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _build_engine()
+            get_agenda_index(app_id, user_id).add_listener(engine.apply)
+            _engines[key] = engine
+        return engine
+
+def benchmark_availability(days: int = 365, queries: int = 2000, seed: int = 42) -> Dict[str, Any]:
+    """Mede atualização e consulta dos bitmaps com um ano de agenda lotada
+
+    Gera consultas de 30 a 90 minutos preenchendo ~85% do expediente de cada
+    cadeira e mede buscas de uma semana. Rodar com:
+    python -m app.services.availability
+    """
+    import time as timer
+    
+    rng = random.Random(seed)
+    engine = _build_engine()
+    tz = clinic_timezone()
+    today = datetime.now(tz).date()
+    settings = get_settings()
+    
+    events = 0
+    started = timer.perf_counter()
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        if day.weekday() not in engine.working_days:
+            continue
+        for chair in engine.chairs:
+            cursor = datetime.combine(day, time(settings.agenda_opening_hour), tz)
+            closing = datetime.combine(day, time(settings.agenda_closing_hour), tz)
+            while True:
+                length = timedelta(minutes=rng.choice((30, 60, 90)))
+                if cursor + length > closing:
+                    break
+                if rng.random() < 0.85:
+                    events += 1
+                    engine.apply(f"e{events}", (cursor.timestamp(), (cursor + length).timestamp(), "", chair))
+                cursor += length
+    load_seconds = timer.perf_counter() - started
+    
+    samples = []
+    for _ in range(queries):
+        start_day = today + timedelta(days=rng.randrange(days - 7))
+        duration = rng.choice((30, 60, 90))
+        began = timer.perf_counter()
+        engine.search(start_day, start_day + timedelta(days=6), duration, limit=20)
+        samples.append((timer.perf_counter() - began) * 1e6)
+    samples.sort()
+    
+    return {
+        "days": days,
+        "chairs": len(engine.chairs),
+        "events": events,
+        "load_us_per_event": round(load_seconds * 1e6 / max(events, 1), 2),
+        "query_window_days": 7,
+        "query_p50_us": round(samples[len(samples) // 2], 2),
+        "query_p99_us": round(samples[int(len(samples) * 0.99)], 2)
+    }
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(benchmark_availability(), indent=2))
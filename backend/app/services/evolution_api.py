@@ -1,6 +1,5 @@
-import aiohttp
-from typing import Optional
-import json
+from typing import Any, Dict, Optional
+from .http_transport import get_http_transport
 
 class EvolutionAPI:
     def __init__(self, api_key: str, instance_name: str, base_url: str):
@@ -11,7 +10,31 @@ class EvolutionAPI:
             "apikey": api_key,
             "Content-Type": "application/json"
         }
+    
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        error_message: str,
+        payload: Optional[Dict[str, Any]] = None
+    ) -> dict:
+        """Faz uma requisição usando o pool de conexões compartilhado
 
+        Só GETs são repetidos depois de um 5xx: um POST pode ter sido processado
+        mesmo assim (mensagem duplicada para o paciente, instância criada duas vezes).
+        """
+        response = await get_http_transport().request(
+            method,
+            url,
+            headers=self.headers,
+            json=payload,
+            retry_server_errors=method == "GET"
+        )
+        if response.status_code != 200:
+            raise Exception(f"{error_message}: {response.text}")
+        
+        return response.json()
+    
     async def send_message(self, to_number: str, message: str) -> dict:
         """Envia mensagem via WhatsApp usando a Evolution API"""
         url = f"{self.base_url}/message/sendText/{self.instance_name}"
@@ -20,27 +43,15 @@ class EvolutionAPI:
             "number": to_number,
             "text": message
         }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=self.headers, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Erro ao enviar mensagem: {error_text}")
-                
-                return await response.json()
-
+        
+        return await self._request("POST", url, "Erro ao enviar mensagem", payload)
+    
     async def get_instance_status(self) -> dict:
         """Verifica o status da instância do WhatsApp"""
         url = f"{self.base_url}/instance/connectionState/{self.instance_name}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Erro ao verificar status: {error_text}")
-                
-                return await response.json()
-
+        return await self._request("GET", url, "Erro ao verificar status")
+    
     async def create_instance(self) -> dict:
         """Cria uma nova instância do WhatsApp"""
         url = f"{self.base_url}/instance/create"
@@ -50,35 +61,17 @@ class EvolutionAPI:
             "token": self.api_key,
             "qrcode": True
         }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=self.headers, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Erro ao criar instância: {error_text}")
-                
-                return await response.json()
-
+        
+        return await self._request("POST", url, "Erro ao criar instância", payload)
+    
     async def delete_instance(self) -> dict:
         """Deleta a instância do WhatsApp"""
         url = f"{self.base_url}/instance/delete/{self.instance_name}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.delete(url, headers=self.headers) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Erro ao deletar instância: {error_text}")
-                
-                return await response.json()
-
+        return await self._request("DELETE", url, "Erro ao deletar instância")
+    
     async def get_qrcode(self) -> dict:
         """Obtém o QR Code para conexão do WhatsApp"""
         url = f"{self.base_url}/instance/qrcode/{self.instance_name}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Erro ao obter QR Code: {error_text}")
-                
-                return await response.json() 
\ No newline at end of file
+        return await self._request("GET", url, "Erro ao obter QR Code") 
\ No newline at end of file
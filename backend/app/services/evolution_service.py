@@ -1,6 +1,6 @@
-import httpx
-from typing import Dict, Any, Optional
+from typing import Dict, Any
 from ..config import get_settings
+from .http_transport import get_http_transport
 
 class EvolutionService:
     def __init__(self):
@@ -23,10 +23,9 @@ class EvolutionService:
             "text": message
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
+        response = await get_http_transport().request("POST", url, headers=self.headers, json=payload)
+        response.raise_for_status()
+        return response.json()
     
     async def get_instance_status(self, instance: str) -> Dict[str, Any]:
         """Obtém o status de uma instância do WhatsApp"""
@@ -35,10 +34,9 @@ class EvolutionService:
             
         url = f"{self.base_url}/instance/connectionState/{instance}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
+        response = await get_http_transport().request("GET", url, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
     
     async def create_instance(self, instance_name: str) -> Dict[str, Any]:
         """Cria uma nova instância do WhatsApp"""
@@ -52,10 +50,9 @@ class EvolutionService:
             "qrcode": True
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
+        response = await get_http_transport().request("POST", url, headers=self.headers, json=payload)
+        response.raise_for_status()
+        return response.json()
     
     async def delete_instance(self, instance: str) -> Dict[str, Any]:
         """Deleta uma instância do WhatsApp"""
@@ -64,7 +61,6 @@ class EvolutionService:
             
         url = f"{self.base_url}/instance/delete/{instance}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(url, headers=self.headers)
-            response.raise_for_status()
-            return response.json() 
\ No newline at end of file
+        response = await get_http_transport().request("DELETE", url, headers=self.headers)
+        response.raise_for_status()
+        return response.json() 
\ No newline at end of file
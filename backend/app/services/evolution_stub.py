@@ -0,0 +1,117 @@
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import random
+import socket
+import time
+import uuid
+from aiohttp import web
+
+class EvolutionStub:
+    """Servidor local que imita os endpoints da Evolution API usados pelo backend
+
+    Responde a sendText, sendPresence e sendTemplate com a latência e a taxa de
+    falhas (HTTP 500) configuradas e guarda as mensagens recebidas por número,
+    para o teste de carga medir quando a resposta chega ao "paciente". Uso:
+
+        stub = EvolutionStub(latency_ms=80, failure_rate=0.01)
+        base_url = await stub.start()   # EVOLUTION_API_URL
+        ...
+        await stub.stop()
+    """
+    
+    def __init__(self, latency_ms: float = 50.0, failure_rate: float = 0.0, api_key: str = "loadtest", seed: int = 0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.api_key = api_key
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self._messages: Dict[str, List[Tuple[float, str]]] = {}
+        self._arrivals: Dict[str, asyncio.Condition] = {}
+        self.counts: Dict[str, int] = {"sendText": 0, "sendPresence": 0, "sendTemplate": 0, "failures": 0, "unauthorized": 0}
+        self.durations_ms: Deque[float] = deque(maxlen=10000)
+    
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/message/sendText/{instance}", self._send_text)
+        app.router.add_post("/chat/sendPresence/{instance}", self._send_presence)
+        app.router.add_post("/message/sendTemplate/{instance}", self._send_template)
+        return app
+    
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Sobe o servidor (porta livre por padrão) e retorna a URL base"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        await web.SockSite(self._runner, sock).start()
+        return f"http://{host}:{sock.getsockname()[1]}"
+    
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def _handle(self, request: web.Request, kind: str) -> Tuple[Optional[Dict[str, Any]], Optional[web.Response]]:
+        """Valida a chave, aplica latência/falhas e retorna o corpo da requisição"""
+        started_at = time.perf_counter()
+        if request.headers.get("apikey") != self.api_key:
+            self.counts["unauthorized"] += 1
+            return None, web.json_response({"error": "Unauthorized"}, status=401)
+        
+        payload = await request.json()
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        self.durations_ms.append((time.perf_counter() - started_at) * 1000)
+        self.counts[kind] += 1
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.counts["failures"] += 1
+            return None, web.json_response({"error": "Internal Server Error"}, status=500)
+        return payload, None
+    
+    def _accepted(self, number: str) -> web.Response:
+        return web.json_response({
+            "key": {"remoteJid": f"{number}@s.whatsapp.net", "fromMe": True, "id": uuid.uuid4().hex[:20].upper()},
+            "status": "PENDING"
+        }, status=201)
+    
+    async def _send_text(self, request: web.Request) -> web.Response:
+        payload, error = await self._handle(request, "sendText")
+        if error is not None:
+            return error
+        number = str(payload.get("number"))
+        self._messages.setdefault(number, []).append((time.perf_counter(), payload.get("text", "")))
+        condition = self._arrivals.setdefault(number, asyncio.Condition())
+        async with condition:
+            condition.notify_all()
+        return self._accepted(number)
+    
+    async def _send_presence(self, request: web.Request) -> web.Response:
+        payload, error = await self._handle(request, "sendPresence")
+        return error or self._accepted(str(payload.get("number")))
+    
+    async def _send_template(self, request: web.Request) -> web.Response:
+        payload, error = await self._handle(request, "sendTemplate")
+        return error or self._accepted(str(payload.get("number")))
+    
+    def messages(self, number: str) -> List[Tuple[float, str]]:
+        """Mensagens de texto recebidas para o número (perf_counter, texto)"""
+        return list(self._messages.get(number, []))
+    
+    async def wait_message(self, number: str, after: float, timeout: float = 30.0) -> Optional[float]:
+        """Aguarda a primeira mensagem para o número depois de `after` (perf_counter)
+
+        Retorna o instante de chegada, ou None se estourar o timeout.
+        """
+        condition = self._arrivals.setdefault(number, asyncio.Condition())
+        
+        def arrived() -> Optional[float]:
+            return next((at for at, _ in self._messages.get(number, []) if at >= after), None)
+        
+        async with condition:
+            try:
+                await asyncio.wait_for(condition.wait_for(lambda: arrived() is not None), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return arrived()
@@ -0,0 +1,402 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from datetime import date, datetime, timedelta
+import csv
+import io
+import json
+from .agenda_index import clinic_timezone
+from .financial_rollups import normalize_transacao
+from .firebase_client import get_firestore_client
+from .lazy_import import lazy_import
+from .odontogram import COMPACT_FIELD, LEGACY_FIELD, VERSION_FIELD, iter_treatments
+
+# Só os relatórios usam o NumPy (~100 ms de importação)
+np = lazy_import("numpy")
+
+TRANSACTION_FIELDS = ["tipo", "data", "valor", "categoria", "pacienteId", "pacienteNome", "tipoGasto"]
+# Tratamentos que já geram cobrança para o paciente
+BILLABLE_STATUS = {"Executado", "Concluído"}
+
+def _collection_path(app_id: str, user_id: str, collection: str) -> str:
+    """Retorna o caminho da coleção no Firestore"""
+    return f"artifacts/{app_id}/users/{user_id}/{collection}"
+
+def _month_index(day: date) -> int:
+    return day.year * 12 + day.month - 1
+
+def _month_label(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def _encode(values: Sequence[Any]) -> Tuple["np.ndarray", List[str]]:
+    """Codifica uma coluna categórica em inteiros (para group-by com bincount)"""
+    labels, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int32), [str(label) for label in labels]
+
+class TransactionColumns:
+    """Transações de um tenant em arrays colunares (uma posição por transação)"""
+    
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.size = len(records)
+        self.day = np.array([record["data"] for record in records], dtype="datetime64[D]")
+        years = self.day.astype("datetime64[Y]").astype(np.int64) + 1970
+        months = self.day.astype("datetime64[M]").astype(np.int64) % 12
+        self.month = (years * 12 + months).astype(np.int64)
+        self.entrada = np.array([record["tipo"] == "Entrada" for record in records], dtype=bool)
+        self.valor = np.array([record["valor"] for record in records], dtype=np.float64)
+        self.categoria, self.categorias = _encode([record.get("categoria") or "Sem categoria" for record in records])
+        self.tipo_gasto, self.tipos_gasto = _encode([record.get("tipoGasto") or "N/A" for record in records])
+        self.paciente, self.pacientes = _encode([record.get("pacienteId") or "" for record in records])
+        self.nomes: Dict[str, str] = {}
+        for record in records:
+            if record.get("pacienteId") and record.get("pacienteNome"):
+                self.nomes[record["pacienteId"]] = record["pacienteNome"]
+    
+    def between(self, start: date, end: date) -> "np.ndarray":
+        """Máscara das transações entre as datas (inclusive)"""
+        return (self.day >= np.datetime64(start, "D")) & (self.day <= np.datetime64(end, "D"))
+
+def load_columns(app_id: str, user_id: str, start: date, end: date) -> TransactionColumns:
+    """Carrega do Firestore apenas os campos e o período usados no relatório"""
+    query = (
+        get_firestore_client()
+        .collection(_collection_path(app_id, user_id, "transacoesFinanceiras"))
+        .where("data", ">=", start.isoformat())
+        .where("data", "<=", end.isoformat())
+        .select(TRANSACTION_FIELDS)
+    )
+    records = []
+    for doc in query.stream():
+        record = normalize_transacao(doc.to_dict() or {})
+        if record.get("tipo") in ("Entrada", "Saída") and record.get("valor") is not None:
+            records.append(record)
+    return TransactionColumns(records)
+
+def load_billed_treatments(app_id: str, user_id: str) -> List[Tuple[str, str, float]]:
+    """Lista (paciente, nome, valor) dos tratamentos executados/concluídos cobráveis"""
+    collection = get_firestore_client().collection(_collection_path(app_id, user_id, "pacientes"))
+    treatments = []
+    fields = ["nome", LEGACY_FIELD, COMPACT_FIELD, VERSION_FIELD]
+    for doc in collection.select(fields).stream():
+        data = doc.to_dict() or {}
+        for tratamento in iter_treatments(data):
+            if (
+                tratamento.get("status") in BILLABLE_STATUS
+                and tratamento.get("valor")
+                and not tratamento.get("isAcaoSocial")
+            ):
+                treatments.append((doc.id, data.get("nome") or "", float(tratamento["valor"])))
+    return treatments
+
+def _totals(cols: TransactionColumns, mask: "np.ndarray") -> Dict[str, float]:
+    entradas = float(cols.valor[mask & cols.entrada].sum())
+    saidas = float(cols.valor[mask & ~cols.entrada].sum())
+    return {"entradas": round(entradas, 2), "saidas": round(saidas, 2), "saldo": round(entradas - saidas, 2)}
+
+def _by_category(cols: TransactionColumns, mask: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Soma por categoria para entradas e saídas (vetores do tamanho de cols.categorias)"""
+    size = len(cols.categorias)
+    entradas = np.bincount(cols.categoria[mask & cols.entrada], cols.valor[mask & cols.entrada], minlength=size)
+    saidas = np.bincount(cols.categoria[mask & ~cols.entrada], cols.valor[mask & ~cols.entrada], minlength=size)
+    return entradas, saidas
+
+def _pct(current: float, previous: float) -> Optional[float]:
+    return round((current - previous) / previous * 100, 2) if previous else None
+
+def period_comparison(cols: TransactionColumns, start: date, end: date) -> Dict[str, Any]:
+    """Compara o período com o período anterior de mesmo tamanho"""
+    length = (end - start).days + 1
+    previous_start, previous_end = start - timedelta(days=length), start - timedelta(days=1)
+    current_mask, previous_mask = cols.between(start, end), cols.between(previous_start, previous_end)
+    
+    current, previous = _totals(cols, current_mask), _totals(cols, previous_mask)
+    current_in, current_out = _by_category(cols, current_mask)
+    previous_in, previous_out = _by_category(cols, previous_mask)
+    
+    categorias = []
+    for index in np.flatnonzero(current_in + current_out + previous_in + previous_out):
+        categorias.append({
+            "categoria": cols.categorias[index],
+            "entradas": round(float(current_in[index]), 2),
+            "saidas": round(float(current_out[index]), 2),
+            "entradasAnterior": round(float(previous_in[index]), 2),
+            "saidasAnterior": round(float(previous_out[index]), 2)
+        })
+    
+    return {
+        "periodo": {"from": start.isoformat(), "to": end.isoformat(), **current},
+        "periodoAnterior": {"from": previous_start.isoformat(), "to": previous_end.isoformat(), **previous},
+        "variacao": {key: _pct(current[key], previous[key]) for key in current},
+        "categorias": categorias
+    }
+
+def monthly_series(cols: TransactionColumns, start: date, end: date) -> List[Dict[str, Any]]:
+    """Entradas, saídas e saldo de cada mês do período"""
+    first, last = _month_index(start), _month_index(end)
+    mask = cols.between(start, end)
+    offsets = cols.month[mask] - first
+    entrada = cols.entrada[mask]
+    valor = cols.valor[mask]
+    size = last - first + 1
+    entradas = np.bincount(offsets[entrada], valor[entrada], minlength=size)
+    saidas = np.bincount(offsets[~entrada], valor[~entrada], minlength=size)
+    return [
+        {
+            "mes": _month_label(first + offset),
+            "entradas": round(float(entradas[offset]), 2),
+            "saidas": round(float(saidas[offset]), 2),
+            "saldo": round(float(entradas[offset] - saidas[offset]), 2)
+        }
+        for offset in range(size)
+    ]
+
+def category_breakdown(cols: TransactionColumns, start: date, end: date) -> List[Dict[str, Any]]:
+    """Total, quantidade e participação de cada categoria por tipo"""
+    mask = cols.between(start, end)
+    size = len(cols.categorias)
+    result = []
+    for tipo, tipo_mask in (("Entrada", mask & cols.entrada), ("Saída", mask & ~cols.entrada)):
+        totals = np.bincount(cols.categoria[tipo_mask], cols.valor[tipo_mask], minlength=size)
+        counts = np.bincount(cols.categoria[tipo_mask], minlength=size)
+        grand_total = totals.sum()
+        for index in np.argsort(-totals):
+            if counts[index] == 0:
+                continue
+            result.append({
+                "tipo": tipo,
+                "categoria": cols.categorias[index],
+                "total": round(float(totals[index]), 2),
+                "quantidade": int(counts[index]),
+                "participacao": round(float(totals[index] / grand_total * 100), 2) if grand_total else 0.0
+            })
+    return result
+
+def receivables(cols: TransactionColumns, treatments: List[Tuple[str, str, float]]) -> List[Dict[str, Any]]:
+    """Saldo a receber por paciente: tratamentos cobráveis menos entradas registradas"""
+    if not treatments:
+        return []
+    ids = [patient_id for patient_id, _, _ in treatments]
+    labels, codes = np.unique(np.asarray(ids, dtype=object).astype(str), return_inverse=True)
+    billed = np.bincount(codes, np.array([valor for _, _, valor in treatments]), minlength=len(labels))
+    
+    # Pagamentos dos mesmos pacientes, alinhados por busca binária nos ids ordenados
+    paid_mask = cols.entrada & (cols.valor > 0)
+    payer_ids = np.asarray(cols.pacientes, dtype=object).astype(str)[cols.paciente[paid_mask]]
+    positions = np.searchsorted(labels, payer_ids)
+    positions = np.clip(positions, 0, len(labels) - 1)
+    matched = labels[positions] == payer_ids
+    paid = np.bincount(positions[matched], cols.valor[paid_mask][matched], minlength=len(labels))
+    
+    balance = billed - paid
+    names = {patient_id: nome for patient_id, nome, _ in treatments}
+    return [
+        {
+            "pacienteId": str(labels[index]),
+            "pacienteNome": names.get(str(labels[index])) or cols.nomes.get(str(labels[index]), ""),
+            "tratamentos": round(float(billed[index]), 2),
+            "pago": round(float(paid[index]), 2),
+            "aReceber": round(float(balance[index]), 2)
+        }
+        for index in np.argsort(-balance)
+        if balance[index] > 0.005
+    ]
+
+def project_cash_flow(
+    cols: TransactionColumns,
+    today: date,
+    horizon_months: int = 3,
+    lookback_months: int = 3
+) -> Dict[str, Any]:
+    """Projeta os próximos meses com despesas fixas (média recente) e programadas (já lançadas)"""
+    current = _month_index(today)
+    first_lookback = current - lookback_months
+    lookback = (cols.month >= first_lookback) & (cols.month < current)
+    
+    fixo_code = cols.tipos_gasto.index("Fixo") if "Fixo" in cols.tipos_gasto else -1
+    programado_code = cols.tipos_gasto.index("Programado") if "Programado" in cols.tipos_gasto else -1
+    saida = ~cols.entrada
+    
+    # Média mensal das despesas fixas por categoria e das entradas
+    size = len(cols.categorias)
+    fixo_mask = lookback & saida & (cols.tipo_gasto == fixo_code)
+    fixo_by_category = np.bincount(cols.categoria[fixo_mask], cols.valor[fixo_mask], minlength=size) / lookback_months
+    entradas_media = float(cols.valor[lookback & cols.entrada].sum()) / lookback_months
+    
+    # Despesas programadas já lançadas para os meses projetados
+    programado_mask = saida & (cols.tipo_gasto == programado_code) & (cols.month >= current)
+    programado_mask &= cols.month < current + horizon_months
+    programado = np.bincount(
+        cols.month[programado_mask] - current,
+        cols.valor[programado_mask],
+        minlength=horizon_months
+    )
+    
+    fixo_total = float(fixo_by_category.sum())
+    meses = []
+    for offset in range(horizon_months):
+        saidas = fixo_total + float(programado[offset])
+        meses.append({
+            "mes": _month_label(current + offset),
+            "entradasPrevistas": round(entradas_media, 2),
+            "despesasFixas": round(fixo_total, 2),
+            "despesasProgramadas": round(float(programado[offset]), 2),
+            "saldoPrevisto": round(entradas_media - saidas, 2)
+        })
+    
+    return {
+        "baseMeses": lookback_months,
+        "despesasFixasPorCategoria": [
+            {"categoria": cols.categorias[index], "mediaMensal": round(float(fixo_by_category[index]), 2)}
+            for index in np.flatnonzero(fixo_by_category)
+        ],
+        "meses": meses
+    }
+
+def build_report(
+    cols: TransactionColumns,
+    start: date,
+    end: date,
+    today: date,
+    treatments: Optional[List[Tuple[str, str, float]]] = None,
+    horizon_months: int = 3,
+    lookback_months: int = 3
+) -> Dict[str, Any]:
+    """Monta todas as seções do relatório a partir das colunas já carregadas"""
+    report = {
+        "comparacao": period_comparison(cols, start, end),
+        "mensal": monthly_series(cols, start, end),
+        "categorias": category_breakdown(cols, start, end),
+        "projecao": project_cash_flow(cols, today, horizon_months, lookback_months)
+    }
+    if treatments is not None:
+        report["recebiveis"] = receivables(cols, treatments)
+    return report
+
+def load_window(start: date, end: date, today: date, horizon_months: int, lookback_months: int) -> Tuple[date, date]:
+    """Período de transações necessário para comparação e projeção"""
+    length = (end - start).days + 1
+    lookback_index = _month_index(today) - lookback_months
+    lookback_start = date(lookback_index // 12, lookback_index % 12 + 1, 1)
+    horizon_index = _month_index(today) + horizon_months
+    horizon_end = date(horizon_index // 12, horizon_index % 12 + 1, 1) - timedelta(days=1)
+    return min(start - timedelta(days=length), lookback_start), max(end, horizon_end)
+
+def generate_report(
+    app_id: str,
+    user_id: str,
+    start: date,
+    end: date,
+    horizon_months: int = 3,
+    lookback_months: int = 3,
+    include_receivables: bool = True
+) -> Dict[str, Any]:
+    """Carrega as transações do tenant e calcula o relatório"""
+    today = datetime.now(clinic_timezone()).date()
+    load_start, load_end = load_window(start, end, today, horizon_months, lookback_months)
+    treatments = None
+    if include_receivables:
+        # Recebíveis consideram todo o histórico de pagamentos do paciente
+        load_start = date(1970, 1, 1)
+        treatments = load_billed_treatments(app_id, user_id)
+    cols = load_columns(app_id, user_id, load_start, load_end)
+    return build_report(cols, start, end, today, treatments, horizon_months, lookback_months)
+
+def stream_json(report: Dict[str, Any]) -> Iterator[str]:
+    """Serializa o relatório em JSON seção por seção"""
+    yield "{"
+    for position, (section, content) in enumerate(report.items()):
+        prefix = "," if position else ""
+        yield f"{prefix}{json.dumps(section)}:{json.dumps(content, ensure_ascii=False)}"
+    yield "}"
+
+def _rows(report: Dict[str, Any]) -> Iterator[List[Any]]:
+    comparacao = report["comparacao"]
+    for key in ("periodo", "periodoAnterior"):
+        for metric in ("entradas", "saidas", "saldo"):
+            yield ["comparacao", key, "", metric, comparacao[key][metric]]
+    for item in comparacao["categorias"]:
+        for metric in ("entradas", "saidas", "entradasAnterior", "saidasAnterior"):
+            yield ["comparacao_categoria", item["categoria"], "", metric, item[metric]]
+    for item in report["mensal"]:
+        for metric in ("entradas", "saidas", "saldo"):
+            yield ["mensal", item["mes"], "", metric, item[metric]]
+    for item in report["categorias"]:
+        yield ["categorias", item["categoria"], item["tipo"], "total", item["total"]]
+        yield ["categorias", item["categoria"], item["tipo"], "quantidade", item["quantidade"]]
+    for item in report.get("recebiveis", []):
+        yield ["recebiveis", item["pacienteId"], item["pacienteNome"], "aReceber", item["aReceber"]]
+    for item in report["projecao"]["meses"]:
+        for metric in ("entradasPrevistas", "despesasFixas", "despesasProgramadas", "saldoPrevisto"):
+            yield ["projecao", item["mes"], "", metric, item[metric]]
+
+def stream_csv(report: Dict[str, Any], chunk_rows: int = 500) -> Iterator[str]:
+    """Serializa o relatório em CSV (formato longo: seção, chave, detalhe, métrica, valor)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["secao", "chave", "detalhe", "metrica", "valor"])
+    for count, row in enumerate(_rows(report), start=1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def benchmark_report(transactions: int = 100_000, patients: int = 10_000, seed: int = 42) -> Dict[str, Any]:
+    """Mede o cálculo do relatório com um ano de transações sintéticas
+
+    O carregamento do Firestore não entra na medição (depende da rede); o
+    orçamento é para a montagem das colunas e o cálculo vetorizado. Rodar com:
+    python -m app.services.financial_report
+    """
+    import time as timer
+    
+    rng = np.random.default_rng(seed)
+    today = date.today()
+    start = today - timedelta(days=365)
+    categorias = ["Procedimento Odontológico", "Material de Consumo", "Salário", "Aluguel", "Laboratório", "Impostos"]
+    metodos = ["Dinheiro", "Pix", "Cartão de Crédito", "Cartão de Débito"]
+    offsets = rng.integers(0, 365 + 90, transactions)
+    entradas = rng.random(transactions) < 0.6
+    valores = np.round(rng.gamma(2.0, 150.0, transactions), 2)
+    category_index = rng.integers(0, len(categorias), transactions)
+    patient_index = rng.integers(0, patients, transactions)
+    gasto = rng.choice(["Fixo", "Programado", "Extra"], transactions)
+    
+    records = [
+        {
+            "tipo": "Entrada" if entradas[i] else "Saída",
+            "data": (start + timedelta(days=int(offsets[i]))).isoformat(),
+            "valor": float(valores[i]),
+            "categoria": categorias[category_index[i]],
+            "metodoPagamento": metodos[i % len(metodos)],
+            "pacienteId": f"p{patient_index[i]}" if entradas[i] else None,
+            "tipoGasto": None if entradas[i] else str(gasto[i])
+        }
+        for i in range(transactions)
+    ]
+    treatments = [
+        (f"p{index}", f"Paciente {index}", float(valor))
+        for index, valor in zip(rng.integers(0, patients, patients * 3), rng.gamma(2.0, 300.0, patients * 3))
+    ]
+    
+    began = timer.perf_counter()
+    cols = TransactionColumns(records)
+    built = timer.perf_counter()
+    build_report(cols, today - timedelta(days=30), today, today, treatments)
+    finished = timer.perf_counter()
+    
+    total = finished - began
+    return {
+        "transactions": transactions,
+        "treatments": len(treatments),
+        "columns_ms": round((built - began) * 1000, 1),
+        "compute_ms": round((finished - built) * 1000, 1),
+        "total_ms": round(total * 1000, 1),
+        "within_budget": total < 1.0
+    }
+
+if __name__ == "__main__":
+    import sys
+    
+    result = benchmark_report()
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["within_budget"] else 1)
@@ -0,0 +1,418 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import threading
+from ..config import get_settings
+from .agenda_index import clinic_timezone
+from .firebase_client import get_firestore_client
+from .firestore_async import current_writes
+from .lazy_import import lazy_import
+from .structured_log import get_logger
+
+firestore = lazy_import("firebase_admin.firestore")
+
+log = get_logger(__name__)
+
+# Os rollups (financeiroRollups) acompanham a coleção transacoesFinanceiras,
+# que o frontend também grava direto no Firestore. Para cada transação fica
+# registrado em financeiroRollupsAplicados o que já foi somado nos rollups;
+# toda atualização aplica a diferença entre esse registro e a transação, na
+# mesma escrita atômica que grava o novo registro. Assim a API, o agente e o
+# RollupSync (listener da coleção, que cobre as escritas do frontend e roda só
+# no processo principal) podem aplicar a mesma mudança sem contá-la duas vezes. O caminho autoritativo é a
+# coleção de transações: o listener converge os rollups para ela, e
+# rebuild_rollups os recalcula do zero.
+
+TIPOS = ("Entrada", "Saída")
+# Valores gravados por versões antigas do backend / ferramentas do agente
+TIPO_ALIASES = {
+    "ENTRADA": "Entrada",
+    "RECEITA": "Entrada",
+    "SAIDA": "Saída",
+    "SAÍDA": "Saída",
+    "DESPESA": "Saída"
+}
+# Dimensões acumuladas nos rollups (valores ausentes ou "N/A" são ignorados)
+DIMENSIONS = ("categoria", "metodoPagamento", "tipoGasto")
+SEM_CATEGORIA = "Sem categoria"
+# Campos da transação que entram nos rollups (os guardados no registro)
+COUNTED_FIELDS = ("tipo", "data", "valor") + DIMENSIONS
+
+def _collection_path(app_id: str, user_id: str, collection: str) -> str:
+    """Retorna o caminho da coleção no Firestore"""
+    return f"artifacts/{app_id}/users/{user_id}/{collection}"
+
+def normalize_transacao(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte a transação para o formato do frontend (tipo Entrada/Saída, data AAAA-MM-DD)"""
+    data = dict(data)
+    tipo = str(data.get("tipo") or "")
+    data["tipo"] = TIPO_ALIASES.get(tipo.upper(), tipo)
+    
+    value = data.get("data")
+    if isinstance(value, datetime):
+        data["data"] = value.astimezone(clinic_timezone()).date().isoformat()
+    elif isinstance(value, date):
+        data["data"] = value.isoformat()
+    elif isinstance(value, str) and len(value) > 10:
+        data["data"] = value[:10]
+    
+    if "patientId" in data and "pacienteId" not in data:
+        data["pacienteId"] = data.pop("patientId")
+    if data.get("valor") is not None:
+        data["valor"] = float(data["valor"])
+    return data
+
+def _counted(data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Parte da transação somada nos rollups (None para transação removida)"""
+    if not data:
+        return None
+    data = normalize_transacao(data)
+    return {field: data.get(field) for field in COUNTED_FIELDS}
+
+def _key(value: Any) -> str:
+    """Nome de campo seguro para o mapa do Firestore"""
+    return str(value).replace(".", "_").replace("`", "_").strip() or SEM_CATEGORIA
+
+def _add(tree: Dict[str, Any], path: Tuple[str, ...], amount: int) -> None:
+    for part in path[:-1]:
+        tree = tree.setdefault(part, {})
+    tree[path[-1]] = tree.get(path[-1], 0) + amount
+
+def _contributions(data: Optional[Dict[str, Any]], sign: int, deltas: Dict[str, Dict[str, Any]]) -> None:
+    """Soma (ou subtrai) a transação nos rollups do dia e do mês"""
+    if not data:
+        return
+    data = normalize_transacao(data)
+    tipo = data.get("tipo")
+    day = data.get("data")
+    if tipo not in TIPOS or not isinstance(day, str) or len(day) != 10 or data.get("valor") is None:
+        return
+    
+    # Valores em centavos (inteiros) para os incrementos não acumularem erro
+    cents = sign * int(round(data["valor"] * 100))
+    for doc_id in (f"dia-{day}", f"mes-{day[:7]}"):
+        tree = deltas.setdefault(doc_id, {})
+        _add(tree, ("totais", tipo), cents)
+        _add(tree, ("quantidade", tipo), sign)
+        for dimension in DIMENSIONS:
+            value = data.get(dimension)
+            if dimension == "categoria":
+                value = value or SEM_CATEGORIA
+            if not value or value == "N/A":
+                continue
+            _add(tree, (dimension, tipo, _key(value)), cents)
+
+def _as_increments(tree: Dict[str, Any]) -> Dict[str, Any]:
+    """Troca os números por firestore.Increment, descartando deltas zerados"""
+    result = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            nested = _as_increments(value)
+            if nested:
+                result[key] = nested
+        elif value:
+            result[key] = firestore.Increment(value)
+    return result
+
+def _rollup_writes(
+    app_id: str,
+    user_id: str,
+    old: Optional[Dict[str, Any]],
+    new: Optional[Dict[str, Any]]
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    """Lista (documento de rollup, payload com merge) para a mudança de old para new"""
+    deltas: Dict[str, Dict[str, Any]] = {}
+    _contributions(old, -1, deltas)
+    _contributions(new, 1, deltas)
+    
+    rollups = get_firestore_client().collection(_collection_path(app_id, user_id, "financeiroRollups"))
+    writes = []
+    for doc_id, tree in deltas.items():
+        payload = _as_increments(tree)
+        if not payload:
+            continue
+        escala, periodo = doc_id.split("-", 1)
+        payload.update({"escala": escala, "periodo": periodo, "atualizadoEm": firestore.SERVER_TIMESTAMP})
+        writes.append((rollups.document(doc_id), payload))
+    return writes
+
+def _transacoes(app_id: str, user_id: str):
+    return get_firestore_client().collection(_collection_path(app_id, user_id, "transacoesFinanceiras"))
+
+def _applied(app_id: str, user_id: str):
+    return get_firestore_client().collection(_collection_path(app_id, user_id, "financeiroRollupsAplicados"))
+
+def _apply_in_transaction(transaction, app_id: str, user_id: str, transacao_id: str, new: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Aplica nos rollups a diferença entre o que já foi somado e `new`
+
+    Deve ser chamada depois das leituras da transação (lê o registro e grava).
+    Retorna o que fica registrado como somado.
+    """
+    applied_ref = _applied(app_id, user_id).document(transacao_id)
+    snapshot = applied_ref.get(transaction=transaction)
+    old = snapshot.to_dict() if snapshot.exists else None
+    counted = _counted(new)
+    if old == counted:
+        return counted
+    for rollup_ref, payload in _rollup_writes(app_id, user_id, old, counted):
+        transaction.set(rollup_ref, payload, merge=True)
+    if counted is None:
+        transaction.delete(applied_ref)
+    else:
+        transaction.set(applied_ref, counted)
+    return counted
+
+def create_transacao(app_id: str, user_id: str, data: Dict[str, Any]) -> str:
+    """Grava a transação e atualiza os rollups na mesma escrita atômica
+
+    Dentro de um turno do agente, as escritas entram no commit do fim do turno.
+    """
+    data = normalize_transacao(data)
+    data.pop("id", None)
+    db = get_firestore_client()
+    doc_ref = _transacoes(app_id, user_id).document()
+    
+    # Sem "or": um TurnWrites ainda vazio é falso (define __len__)
+    writes = current_writes()
+    batch = writes if writes is not None else db.batch()
+    batch.set(doc_ref, data)
+    # Documento novo: nada somado ainda, o registro é gravado junto
+    for rollup_ref, payload in _rollup_writes(app_id, user_id, None, data):
+        batch.set(rollup_ref, payload, merge=True)
+    batch.set(_applied(app_id, user_id).document(doc_ref.id), _counted(data))
+    if writes is None:
+        batch.commit()
+    return doc_ref.id
+
+def update_transacao(app_id: str, user_id: str, transacao_id: str, changes: Dict[str, Any]) -> bool:
+    """Atualiza a transação, aplicando nos rollups apenas a diferença; False se não existe"""
+    db = get_firestore_client()
+    doc_ref = _transacoes(app_id, user_id).document(transacao_id)
+    changes = {key: value for key, value in changes.items() if key != "id"}
+    
+    @firestore.transactional
+    def run(transaction) -> bool:
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return False
+        new = normalize_transacao({**(snapshot.to_dict() or {}), **changes})
+        _apply_in_transaction(transaction, app_id, user_id, transacao_id, new)
+        transaction.set(doc_ref, new)
+        return True
+    
+    return run(db.transaction())
+
+def delete_transacao(app_id: str, user_id: str, transacao_id: str) -> bool:
+    """Remove a transação e desconta seus valores dos rollups; False se não existe"""
+    db = get_firestore_client()
+    doc_ref = _transacoes(app_id, user_id).document(transacao_id)
+    
+    @firestore.transactional
+    def run(transaction) -> bool:
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return False
+        _apply_in_transaction(transaction, app_id, user_id, transacao_id, None)
+        transaction.delete(doc_ref)
+        return True
+    
+    return run(db.transaction())
+
+def rebuild_rollups(app_id: str, user_id: str) -> Dict[str, int]:
+    """Recalcula todos os rollups a partir das transações
+
+    Usado na carga inicial (pelo RollupSync, quando ainda não há registro do
+    que foi somado) e para corrigir divergências. Regrava também o registro
+    de cada transação.
+    """
+    db = get_firestore_client()
+    deltas: Dict[str, Dict[str, Any]] = {}
+    counted: Dict[str, Dict[str, Any]] = {}
+    for doc in _transacoes(app_id, user_id).select(list(COUNTED_FIELDS)).stream():
+        data = _counted(doc.to_dict())
+        if data is not None:
+            counted[doc.id] = data
+            _contributions(data, 1, deltas)
+    
+    rollups = db.collection(_collection_path(app_id, user_id, "financeiroRollups"))
+    applied = _applied(app_id, user_id)
+    stale = [doc.reference for doc in rollups.select([]).stream() if doc.id not in deltas]
+    stale += [doc.reference for doc in applied.select([]).stream() if doc.id not in counted]
+    
+    writes: List[Tuple[str, Any, Optional[Dict[str, Any]]]] = [("delete", ref, None) for ref in stale]
+    writes += [("set", applied.document(transacao_id), data) for transacao_id, data in counted.items()]
+    for doc_id, tree in deltas.items():
+        escala, periodo = doc_id.split("-", 1)
+        writes.append(("set", rollups.document(doc_id), {
+            **tree,
+            "escala": escala,
+            "periodo": periodo,
+            "atualizadoEm": firestore.SERVER_TIMESTAMP
+        }))
+    
+    for start in range(0, len(writes), 500):
+        batch = db.batch()
+        for action, ref, payload in writes[start:start + 500]:
+            if action == "delete":
+                batch.delete(ref)
+            else:
+                batch.set(ref, payload)
+        batch.commit()
+    return {"transacoes": len(counted), "rollups": len(deltas), "removidos": len(stale)}
+
+class RollupSync:
+    """Listener da coleção transacoesFinanceiras que mantém os rollups do tenant
+
+    Cobre as transações gravadas direto no Firestore pelo frontend. Cada
+    mudança é aplicada numa transação do Firestore que relê a transação e o
+    registro do que já foi somado, então é idempotente: a própria API, que
+    grava o registro junto, pode aplicar a mesma mudança. Roda só no processo
+    principal (start_rollup_syncs), um listener por tenant na implantação.
+    Ao iniciar, compara todas as transações com o registro e aplica só as
+    divergências; sem nenhum registro (primeira execução), recalcula tudo.
+    """
+    
+    def __init__(self, app_id: str, user_id: str):
+        self.app_id = app_id
+        self.user_id = user_id
+        # transação -> o que já foi somado (cache do registro no Firestore)
+        self._applied: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+    
+    def start(self) -> None:
+        """Carrega o registro e inicia o listener (idempotente, chamada bloqueante)"""
+        if self._watch is None:
+            self._applied = {doc.id: doc.to_dict() for doc in _applied(self.app_id, self.user_id).stream()}
+            self._watch = _transacoes(self.app_id, self.user_id).on_snapshot(self._on_snapshot)
+    
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self._ready.clear()
+    
+    def _apply(self, transacao_id: str) -> Optional[Dict[str, Any]]:
+        db = get_firestore_client()
+        doc_ref = _transacoes(self.app_id, self.user_id).document(transacao_id)
+        
+        @firestore.transactional
+        def run(transaction) -> Optional[Dict[str, Any]]:
+            snapshot = doc_ref.get(transaction=transaction)
+            new = snapshot.to_dict() if snapshot.exists else None
+            return _apply_in_transaction(transaction, self.app_id, self.user_id, transacao_id, new)
+        
+        return run(db.transaction())
+    
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        with self._lock:
+            if not self._ready.is_set() and not self._applied and docs:
+                rebuild_rollups(self.app_id, self.user_id)
+                self._applied = {doc.id: _counted(doc.to_dict()) for doc in docs}
+            else:
+                for change in changes:
+                    transacao_id = change.document.id
+                    new = None if change.type.name == "REMOVED" else change.document.to_dict()
+                    if self._applied.get(transacao_id) == _counted(new):
+                        continue
+                    try:
+                        self._applied[transacao_id] = self._apply(transacao_id)
+                    except Exception as e:
+                        log.error("Erro ao atualizar rollups", transacao_id=transacao_id, error=str(e))
+        self._ready.set()
+
+_syncs: Dict[Tuple[str, str], RollupSync] = {}
+_syncs_lock = threading.Lock()
+
+def get_rollup_sync(app_id: str, user_id: str) -> RollupSync:
+    """Retorna o listener de rollups do tenant, iniciando-o na primeira chamada (bloqueante)"""
+    key = (app_id, user_id)
+    with _syncs_lock:
+        sync = _syncs.get(key)
+        if sync is None:
+            sync = RollupSync(app_id, user_id)
+            sync.start()
+            _syncs[key] = sync
+        return sync
+
+def rollup_sync_tenants() -> List[Tuple[str, str]]:
+    """Tenants de ROLLUP_SYNC_TENANTS, ou o tenant do WhatsApp se a lista estiver vazia"""
+    settings = get_settings()
+    tenants = []
+    for item in settings.rollup_sync_tenants.split(","):
+        app_id, _, user_id = item.strip().partition(":")
+        if app_id and user_id:
+            tenants.append((app_id, user_id))
+    if not tenants and settings.whatsapp_app_id and settings.whatsapp_user_id:
+        tenants.append((settings.whatsapp_app_id, settings.whatsapp_user_id))
+    return tenants
+
+def start_rollup_syncs() -> int:
+    """Inicia os listeners dos tenants configurados (no processo principal; bloqueante)"""
+    started = 0
+    for app_id, user_id in rollup_sync_tenants():
+        try:
+            get_rollup_sync(app_id, user_id)
+            started += 1
+        except Exception as e:
+            log.error("Erro ao iniciar a sincronização dos rollups", app_id=app_id, user_id=user_id, error=str(e))
+    return started
+
+def stop_rollup_syncs() -> None:
+    """Encerra os listeners de rollups do processo"""
+    with _syncs_lock:
+        for sync in _syncs.values():
+            sync.stop()
+        _syncs.clear()
+
+def _summary(doc: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Converte um documento de rollup (centavos) para valores em reais"""
+    doc = doc or {}
+    
+    def reais(tree: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: reais(value) if isinstance(value, dict) else value / 100 for key, value in tree.items()}
+    
+    totais = doc.get("totais", {})
+    entradas = totais.get("Entrada", 0) / 100
+    saidas = totais.get("Saída", 0) / 100
+    return {
+        "periodo": doc.get("periodo"),
+        "entradas": entradas,
+        "saidas": saidas,
+        "saldo": round(entradas - saidas, 2),
+        "quantidade": doc.get("quantidade", {}),
+        **{dimension: reais(doc.get(dimension, {})) for dimension in DIMENSIONS}
+    }
+
+def get_rollups(app_id: str, user_id: str, doc_ids: Iterable[str]) -> List[Dict[str, Any]]:
+    """Lê os rollups pedidos em uma única chamada (sem consultar as transações)"""
+    db = get_firestore_client()
+    rollups = db.collection(_collection_path(app_id, user_id, "financeiroRollups"))
+    refs = [rollups.document(doc_id) for doc_id in doc_ids]
+    found = {doc.id: doc.to_dict() for doc in db.get_all(refs) if doc.exists}
+    return [
+        {**_summary(found.get(ref.id)), "periodo": ref.id.split("-", 1)[1]}
+        for ref in refs
+    ]
+
+def daily_ids(start: date, end: date) -> List[str]:
+    return [f"dia-{(start + timedelta(days=offset)).isoformat()}" for offset in range((end - start).days + 1)]
+
+def monthly_ids(start: date, end: date) -> List[str]:
+    ids = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        ids.append(f"mes-{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return ids
+
+def get_kpis(app_id: str, user_id: str, today: Optional[date] = None) -> Dict[str, Any]:
+    """KPIs do painel: hoje, mês atual e mês anterior, lidos de três documentos"""
+    today = today or datetime.now(clinic_timezone()).date()
+    previous_month = today.replace(day=1) - timedelta(days=1)
+    hoje, mes, mes_anterior = get_rollups(app_id, user_id, [
+        f"dia-{today.isoformat()}",
+        f"mes-{today.strftime('%Y-%m')}",
+        f"mes-{previous_month.strftime('%Y-%m')}"
+    ])
+    return {"hoje": hoje, "mes": mes, "mesAnterior": mes_anterior}
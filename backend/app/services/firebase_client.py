@@ -0,0 +1,110 @@
+from typing import Any, Dict, Optional
+import threading
+import time
+from ..config import get_settings
+from .lazy_import import lazy_import
+from .structured_log import get_logger
+
+firebase_admin = lazy_import("firebase_admin")
+credentials = lazy_import("firebase_admin.credentials")
+firestore = lazy_import("firebase_admin.firestore")
+
+log = get_logger(__name__)
+
+# Cliente Firestore único do processo, compartilhado por todas as ferramentas
+# e serviços (um único canal gRPC / pool de conexões)
+_lock = threading.Lock()
+_client: Optional[Any] = None
+_init_seconds: Optional[float] = None
+
+def _build_credentials() -> Any:
+    """Monta as credenciais a partir das variáveis FIREBASE_* do Settings"""
+    settings = get_settings()
+    
+    if settings.firebase_private_key and settings.firebase_client_email:
+        return credentials.Certificate({
+            "type": "service_account",
+            "project_id": settings.firebase_project_id,
+            # A chave costuma vir do .env com quebras de linha escapadas
+            "private_key": settings.firebase_private_key.replace("\\n", "\n"),
+            "client_email": settings.firebase_client_email,
+            "token_uri": "https://oauth2.googleapis.com/token",
+        })
+    
+    # Sem conta de serviço configurada, usa as credenciais padrão do ambiente
+    return credentials.ApplicationDefault()
+
+def get_firebase_app() -> Any:
+    """Retorna o app padrão do Firebase Admin, inicializando-o se necessário"""
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        settings = get_settings()
+        options = {"projectId": settings.firebase_project_id} if settings.firebase_project_id else None
+        return firebase_admin.initialize_app(_build_credentials(), options)
+
+def get_firestore_client() -> Any:
+    """Retorna o cliente Firestore compartilhado (inicialização lazy e thread-safe)"""
+    global _client, _init_seconds
+    
+    if _client is None:
+        with _lock:
+            if _client is None:
+                started_at = time.perf_counter()
+                _client = firestore.client(get_firebase_app())
+                _init_seconds = time.perf_counter() - started_at
+                log.info("Firestore inicializado", init_ms=round(_init_seconds * 1000, 1))
+    
+    return _client
+
+def set_firestore_client(client: Optional[Any]) -> None:
+    """Substitui o cliente do processo (ex.: InMemoryFirestore nos testes de carga)
+
+    Deve ser chamado antes de os índices e ferramentas usarem o Firestore;
+    None volta ao cliente real na próxima chamada.
+    """
+    global _client, _init_seconds
+    with _lock:
+        _client = client
+        _init_seconds = 0.0 if client is not None else None
+
+def get_firestore_stats() -> Dict[str, Any]:
+    """Retorna informações sobre a inicialização do cliente Firestore"""
+    return {
+        "initialized": _client is not None,
+        "init_ms": round(_init_seconds * 1000, 3) if _init_seconds is not None else None
+    }
+
+def benchmark_client_init(requests: int = 200) -> Dict[str, Any]:
+    """Compara inicializar o Firebase a cada requisição com o cliente compartilhado
+
+    "per_request" reproduz o que cada FirebaseTool fazia antes: credenciais,
+    initialize_app (aqui com um nome novo, senão o SDK recusa a segunda vez) e
+    firestore.client(). Nenhuma leitura é feita, então não depende da rede,
+    mas precisa das credenciais FIREBASE_* (ou das padrão do ambiente).
+    Rodar com: python -m app.services.firebase_client
+    """
+    started_at = time.perf_counter()
+    for index in range(requests):
+        app = firebase_admin.initialize_app(_build_credentials(), name=f"benchmark-{index}")
+        firestore.client(app)
+        firebase_admin.delete_app(app)
+    per_request_s = time.perf_counter() - started_at
+    
+    get_firestore_client()
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        get_firestore_client()
+    shared_s = time.perf_counter() - started_at
+    
+    return {
+        "requests": requests,
+        "per_request_init_ms": round(per_request_s / requests * 1000, 3),
+        "shared_client_ms": round(shared_s / requests * 1000, 6),
+        "first_init_ms": get_firestore_stats()["init_ms"]
+    }
+
+if __name__ == "__main__":
+    import json
+    
+    print(json.dumps(benchmark_client_init(), indent=2))
@@ -0,0 +1,192 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar, copy_context
+import asyncio
+import functools
+import threading
+from ..config import get_settings
+from .firebase_client import get_firestore_client
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Limite de operações de um WriteBatch do Firestore
+MAX_BATCH_WRITES = 500
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_current_writes: ContextVar[Optional["TurnWrites"]] = ContextVar("firestore_turn_writes", default=None)
+_stats = {"turns": 0, "commits": 0, "writes": 0, "failures": 0}
+_stats_lock = threading.Lock()
+
+def get_firestore_executor() -> ThreadPoolExecutor:
+    """Pool de threads exclusivo das chamadas bloqueantes ao Firestore"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_settings().firestore_executor_workers,
+                    thread_name_prefix="firestore"
+                )
+    return _executor
+
+def shutdown_firestore_executor() -> None:
+    """Aguarda as chamadas em andamento e encerra o pool (no desligamento da aplicação)"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+async def run_firestore(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Executa uma chamada do SDK do Firestore fora do event loop
+
+    O contexto (inclusive as escritas do turno em andamento) é copiado para a
+    thread, então ferramentas chamadas daqui continuam agrupando suas escritas.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_firestore_executor(), call)
+
+class TurnWrites:
+    """Escritas de um turno do agente, gravadas juntas em um único commit atômico
+
+    As ferramentas registram as escritas aqui em vez de gravar na hora; o
+    commit acontece no fim do turno, antes de a resposta ser enviada. Efeitos
+    em memória feitos antecipadamente (ex.: índice da agenda) registram uma
+    função de desfazer, chamada se o commit falhar.
+    """
+    
+    def __init__(self):
+        self._writes: List[Tuple[str, Any, Any, Dict[str, Any]]] = []
+        self._rollbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._writes)
+    
+    def set(self, ref, data: Dict[str, Any], merge: bool = False) -> None:
+        with self._lock:
+            self._writes.append(("set", ref, data, {"merge": merge}))
+    
+    def update(self, ref, data: Dict[str, Any], option: Any = None) -> None:
+        with self._lock:
+            self._writes.append(("update", ref, data, {"option": option} if option is not None else {}))
+    
+    def delete(self, ref) -> None:
+        with self._lock:
+            self._writes.append(("delete", ref, None, {}))
+    
+    def on_failure(self, callback: Callable[[], None]) -> None:
+        """Registra como desfazer um efeito em memória caso o commit falhe"""
+        with self._lock:
+            self._rollbacks.append(callback)
+    
+    def commit(self) -> int:
+        """Grava o que está pendente em um WriteBatch (chamada bloqueante)
+
+        Pode ser chamado mais de uma vez no turno (ex.: antes de começar a enviar
+        a resposta em streaming); retorna o número de escritas gravadas.
+        """
+        with self._lock:
+            writes, self._writes = self._writes, []
+            rollbacks, self._rollbacks = self._rollbacks, []
+            if not writes:
+                # Efeitos já gravados por conta própria (ex.: agendamento em transação) ficam valendo
+                return 0
+        
+        try:
+            if len(writes) > MAX_BATCH_WRITES:
+                raise ValueError(f"Turno com {len(writes)} escritas excede o limite de {MAX_BATCH_WRITES} do batch")
+            batch = get_firestore_client().batch()
+            for action, ref, data, options in writes:
+                if action == "delete":
+                    batch.delete(ref)
+                else:
+                    getattr(batch, action)(ref, data, **options)
+            batch.commit()
+        except Exception:
+            # Mantém os efeitos em memória para serem desfeitos pelo rollback
+            with self._lock:
+                self._rollbacks = rollbacks + self._rollbacks
+            raise
+        
+        with _stats_lock:
+            _stats["commits"] += 1
+            _stats["writes"] += len(writes)
+        return len(writes)
+    
+    def rollback(self) -> None:
+        with self._lock:
+            callbacks, self._rollbacks = self._rollbacks, []
+            self._writes = []
+        for callback in reversed(callbacks):
+            try:
+                callback()
+            except Exception as e:
+                log.error("Erro ao desfazer escrita do turno", error=str(e))
+
+def current_writes() -> Optional[TurnWrites]:
+    """Escritas do turno em andamento (None fora de um turno do agente)"""
+    return _current_writes.get()
+
+@asynccontextmanager
+async def turn_writes():
+    """Agrupa as escritas feitas dentro do bloco em um único commit no final
+
+    Se o bloco levantar uma exceção ou o commit falhar, nada é gravado e os
+    efeitos em memória registrados são desfeitos. Blocos aninhados usam as
+    escritas do bloco externo.
+    """
+    existing = _current_writes.get()
+    if existing is not None or not get_settings().firestore_turn_batching_enabled:
+        yield existing
+        return
+    
+    writes = TurnWrites()
+    token = _current_writes.set(writes)
+    try:
+        yield writes
+        await run_firestore(writes.commit)
+    except BaseException:
+        with _stats_lock:
+            _stats["failures"] += 1
+        writes.rollback()
+        raise
+    finally:
+        _current_writes.reset(token)
+        with _stats_lock:
+            _stats["turns"] += 1
+
+def write_set(ref, data: Dict[str, Any], merge: bool = False) -> None:
+    """Grava o documento no turno em andamento ou, fora de um turno, na hora"""
+    writes = current_writes()
+    if writes is not None:
+        writes.set(ref, data, merge=merge)
+    else:
+        ref.set(data, merge=merge)
+
+def write_update(ref, data: Dict[str, Any], option: Any = None) -> None:
+    writes = current_writes()
+    if writes is not None:
+        writes.update(ref, data, option=option)
+    elif option is not None:
+        ref.update(data, option=option)
+    else:
+        ref.update(data)
+
+def write_delete(ref) -> None:
+    writes = current_writes()
+    if writes is not None:
+        writes.delete(ref)
+    else:
+        ref.delete()
+
+def get_write_stats() -> Dict[str, Any]:
+    """Turnos, commits e escritas agrupadas desde o início do processo"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["writes_per_commit"] = round(stats["writes"] / stats["commits"], 2) if stats["commits"] else 0.0
+    return stats
@@ -0,0 +1,182 @@
+from typing import Any, Dict, Optional
+import asyncio
+import random
+import httpx
+from ..config import get_settings
+from .metrics import count_retry
+
+# Status que indicam falha temporária da Evolution API e podem ser repetidos
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class HTTPTransport:
+    """Cliente HTTP assíncrono compartilhado, com pool de conexões, keep-alive e retry"""
+    
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0
+    ):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Retorna o cliente httpx, criando-o caso o lifespan ainda não o tenha iniciado"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._client
+    
+    async def start(self) -> None:
+        """Abre o pool de conexões"""
+        _ = self.client
+    
+    async def close(self) -> None:
+        """Fecha o pool de conexões"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    def _backoff_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Calcula a espera antes da próxima tentativa (backoff exponencial com jitter)"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        retry_server_errors: bool = True
+    ) -> httpx.Response:
+        """Faz a requisição repetindo em caso de 5xx/429 ou falha de conexão
+
+        Com retry_server_errors=False, um 5xx é devolvido na hora: o servidor
+        pode ter processado o envio, então quem chama decide se repete (ex.: a
+        fila de saída, que já tem as próprias tentativas). 429 e falhas de
+        conexão continuam sendo repetidos, porque nesses casos nada foi enviado.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, headers=headers, json=json)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                # A requisição não chegou ao servidor, então é seguro repetir
+                if attempt >= self.retries:
+                    raise
+                count_retry("evolution_http")
+                await asyncio.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+            
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                return response
+            if not retry_server_errors and response.status_code != 429:
+                return response
+            
+            count_retry("evolution_http")
+            await asyncio.sleep(self._backoff_delay(attempt, response))
+            attempt += 1
+
+_transport: Optional[HTTPTransport] = None
+
+def get_http_transport() -> HTTPTransport:
+    """Retorna o transporte HTTP compartilhado do processo"""
+    global _transport
+    
+    if _transport is None:
+        settings = get_settings()
+        _transport = HTTPTransport(
+            timeout=settings.evolution_http_timeout,
+            connect_timeout=settings.evolution_http_connect_timeout,
+            max_connections=settings.evolution_http_max_connections,
+            max_keepalive_connections=settings.evolution_http_max_keepalive,
+            keepalive_expiry=settings.evolution_http_keepalive_expiry,
+            retries=settings.evolution_http_retries,
+            backoff_base=settings.evolution_http_backoff_base,
+            backoff_max=settings.evolution_http_backoff_max
+        )
+    return _transport
+
+async def close_http_transport() -> None:
+    """Fecha o transporte HTTP compartilhado (chamado no encerramento da aplicação)"""
+    global _transport
+    
+    if _transport is not None:
+        await _transport.close()
+        _transport = None
+
+async def benchmark_transport(requests: int = 500, concurrency: int = 20, latency_ms: float = 0.0) -> Dict[str, Any]:
+    """Compara um cliente httpx novo por envio com o transporte compartilhado
+
+    Os envios vão para o EvolutionStub local (sendText), então a diferença
+    medida é o custo de abrir conexões a cada mensagem. Rodar com:
+    python -m app.services.http_transport
+    """
+    import time
+    from .evolution_stub import EvolutionStub
+    
+    stub = EvolutionStub(latency_ms=latency_ms)
+    base_url = await stub.start()
+    url = f"{base_url}/message/sendText/benchmark"
+    headers = {"apikey": stub.api_key}
+    payload = {"number": "5511999990000", "text": "Lembrete: sua consulta é amanhã às 14h."}
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def per_call() -> None:
+        async with semaphore:
+            async with httpx.AsyncClient() as client:
+                response = await client.post(url, headers=headers, json=payload)
+                response.raise_for_status()
+    
+    transport = HTTPTransport(max_keepalive_connections=concurrency)
+    
+    async def shared() -> None:
+        async with semaphore:
+            response = await transport.request("POST", url, headers=headers, json=payload)
+            response.raise_for_status()
+    
+    try:
+        started_at = time.perf_counter()
+        await asyncio.gather(*(per_call() for _ in range(requests)))
+        per_call_s = time.perf_counter() - started_at
+        
+        await transport.start()
+        started_at = time.perf_counter()
+        await asyncio.gather(*(shared() for _ in range(requests)))
+        shared_s = time.perf_counter() - started_at
+    finally:
+        await transport.close()
+        await stub.stop()
+    
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "stub_latency_ms": latency_ms,
+        "per_call_client_ms_per_request": round(per_call_s / requests * 1000, 3),
+        "shared_transport_ms_per_request": round(shared_s / requests * 1000, 3),
+        "per_call_client_rps": round(requests / per_call_s, 1),
+        "shared_transport_rps": round(requests / shared_s, 1)
+    }
+
+if __name__ == "__main__":
+    import json
+    
+    print(json.dumps(asyncio.run(benchmark_transport()), indent=2))
@@ -0,0 +1,41 @@
+from typing import Any, Optional
+from types import ModuleType
+import importlib
+import threading
+
+# SDKs pesados (Firebase/Google Cloud, LangChain) são importados só quando a
+# primeira requisição precisa deles, para o app subir rápido. O tempo de
+# importação de app.main é verificado por app/import_budget.py.
+
+class LazyModule:
+    """Módulo importado no primeiro acesso a um atributo
+
+        firestore = lazy_import("firebase_admin.firestore")
+        ...
+        firestore.SERVER_TIMESTAMP   # importa aqui
+    """
+    
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+    
+    def _load(self) -> ModuleType:
+        module: Optional[ModuleType] = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+    
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+    
+    def __repr__(self) -> str:
+        state = "carregado" if self.__dict__["_module"] is not None else "não carregado"
+        return f"<módulo lazy {self.__dict__['_name']} ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
@@ -0,0 +1,405 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from ..agents.base_agent import set_chat_model_factory
+from ..agents.fake_llm import FakeChatModel, get_fake_llm_stats
+from ..config import get_settings
+from .agenda_index import to_utc_iso
+from .evolution_stub import EvolutionStub
+from .firebase_client import set_firestore_client
+from .memory_firestore import InMemoryFirestore
+
+# Teste de carga offline do pipeline do WhatsApp: Firestore em memória, modelo
+# de chat falso e Evolution API local. Nada sai da máquina. A partir de backend/:
+#
+#     python -m app.services.load_test --mensagens 500 --concorrencia 50
+#
+# Cada "paciente" virtual manda uma mensagem, espera a resposta chegar na
+# Evolution falsa e só então manda a próxima (como numa conversa real).
+#
+# Com --workers 1,2,4 o app roda em um servidor uvicorn de verdade (modo de
+# produção, um processo por worker, cada um com seu Firestore em memória) e o
+# relatório compara a vazão de cada quantidade de workers.
+
+APP_ID = "loadtest"
+USER_ID = "clinica"
+ROUTES = ("webhook", "whatsapp")
+
+# Mistura de mensagens: intenções atendidas sem LLM, perguntas para a LLM e uma
+# que faz o agente chamar a ferramenta de próxima consulta
+MESSAGES = [
+    "Olá, bom dia!",
+    "Quando é minha próxima consulta?",
+    "Vocês fazem clareamento dental? Qual o valor?",
+    "Preciso conferir meu cadastro, ID {patient_id}",
+    "Qual o horário de atendimento no sábado?",
+]
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+    
+    def pick(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+    
+    return {"count": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+def _phone(index: int) -> str:
+    return f"55119{index:08d}"
+
+def seed_tenant(db: InMemoryFirestore, patients: int) -> None:
+    """Cria os pacientes (um por paciente virtual) e uma consulta futura para cada um"""
+    base = f"artifacts/{APP_ID}/users/{USER_ID}"
+    tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=13, minute=0, second=0, microsecond=0)
+    db.seed(f"{base}/pacientes", {
+        f"pac-{index:05d}": {
+            "nome": f"Paciente {index:05d}",
+            "telefone": _phone(index),
+            "telefoneE164": "+" + _phone(index),
+            "email": f"paciente{index}@example.com",
+            "anamnese": {"alergias": "Nenhuma", "medicacoesUsoContinuo": ""}
+        }
+        for index in range(patients)
+    })
+    db.seed(f"{base}/agendaEvents", {
+        f"evt-{index:05d}": {
+            "pacienteId": f"pac-{index:05d}",
+            "pacienteNome": f"Paciente {index:05d}",
+            "titulo": "Limpeza",
+            "tipo": "Consulta",
+            "status": "Agendado",
+            "startDateTime": to_utc_iso(tomorrow + timedelta(minutes=30 * (index % 16))),
+            "endDateTime": to_utc_iso(tomorrow + timedelta(minutes=30 * (index % 16) + 30))
+        }
+        for index in range(patients)
+    })
+
+def _configure_environment(options: argparse.Namespace, evolution_url: str, data_dir: str) -> None:
+    """Aponta o backend para os substitutos locais (antes de importar o app)"""
+    os.environ.update({
+        "EVOLUTION_API_URL": evolution_url,
+        "EVOLUTION_API_KEY": "loadtest",
+        "WHATSAPP_APP_ID": APP_ID,
+        "WHATSAPP_USER_ID": USER_ID,
+        "WEBHOOK_INGESTION_MODE": options.modo,
+        "AGENT_STREAMING_ENABLED": "true" if options.streaming == "on" else "false",
+        "MEMORY_STORE_PATH": os.path.join(data_dir, "conversations.db"),
+        "OUTBOUND_QUEUE_PATH": os.path.join(data_dir, "outbound_queue.db"),
+        "INBOUND_QUEUE_PATH": os.path.join(data_dir, "inbound_queue.db"),
+        "SERVER_LOCK_PATH": os.path.join(data_dir, "server.lock"),
+        "INBOUND_QUEUE_MAX_PENDING": str(max(1000, options.concorrencia * 4)),
+    })
+    get_settings.cache_clear()
+
+async def _wait_reply(stub: EvolutionStub, number: str, started_at: float, options: argparse.Namespace) -> Optional[Dict[str, float]]:
+    """Primeira e última mensagem da resposta (a resposta termina após settle_ms sem novas mensagens)"""
+    first = await stub.wait_message(number, after=started_at, timeout=options.timeout)
+    if first is None:
+        return None
+    last = first
+    while True:
+        await asyncio.sleep(options.settle_ms / 1000)
+        arrivals = [at for at, _ in stub.messages(number) if at > last]
+        if not arrivals:
+            return {"first": first, "last": last}
+        last = arrivals[-1]
+
+async def _virtual_patient(
+    index: int,
+    client: httpx.AsyncClient,
+    stub: EvolutionStub,
+    counter: "itertools.count[int]",
+    options: argparse.Namespace,
+    samples: Dict[str, List[float]],
+    totals: Dict[str, int]
+) -> None:
+    number = _phone(index)
+    while True:
+        sequence = next(counter)
+        if sequence >= options.mensagens:
+            return
+        text = MESSAGES[sequence % len(MESSAGES)].format(patient_id=f"pac-{index:05d}")
+        route = ROUTES[sequence % 2] if options.rota == "ambas" else options.rota
+        message_id = f"lt-{sequence}"
+        
+        started_at = time.perf_counter()
+        try:
+            if route == "webhook":
+                response = await client.post(
+                    "/webhook/whatsapp",
+                    json={"from_number": number, "message": text, "message_id": message_id},
+                    headers={"app-id": APP_ID, "user-id": USER_ID}
+                )
+            else:
+                response = await client.post("/whatsapp/webhook", json={"from": number, "body": text, "id": message_id})
+        except httpx.HTTPError as e:
+            totals["errors"] += 1
+            print(f"Erro na requisição {message_id}: {str(e)}")
+            continue
+        samples[f"ack_{route}"].append((time.perf_counter() - started_at) * 1000)
+        if response.status_code >= 400:
+            totals["errors"] += 1
+            continue
+        
+        reply = await _wait_reply(stub, number, started_at, options)
+        if reply is None:
+            totals["timeouts"] += 1
+            continue
+        totals["replies"] += 1
+        samples["first_reply"].append((reply["first"] - started_at) * 1000)
+        samples["last_reply"].append((reply["last"] - started_at) * 1000)
+
+async def _drive(
+    client: httpx.AsyncClient,
+    stub: EvolutionStub,
+    options: argparse.Namespace
+) -> Tuple[Dict[str, List[float]], Dict[str, int], float]:
+    """Roda os pacientes virtuais contra o app e retorna (amostras, totais, duração)"""
+    samples: Dict[str, List[float]] = {"ack_webhook": [], "ack_whatsapp": [], "first_reply": [], "last_reply": []}
+    totals = {"replies": 0, "errors": 0, "timeouts": 0}
+    counter = itertools.count()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(
+        _virtual_patient(index, client, stub, counter, options, samples, totals)
+        for index in range(options.concorrencia)
+    ))
+    return samples, totals, time.perf_counter() - started_at
+
+def _llm_factory(options: argparse.Namespace) -> Any:
+    return lambda model_name, temperature: FakeChatModel(
+        latency_ms=options.llm_latencia_ms,
+        jitter_ms=options.llm_jitter_ms,
+        tokens_per_second=options.llm_tokens_por_segundo
+    )
+
+async def run_load_test(options: argparse.Namespace) -> Dict[str, Any]:
+    stub = EvolutionStub(latency_ms=options.evolution_latencia_ms, failure_rate=options.evolution_falhas)
+    evolution_url = await stub.start()
+    db = InMemoryFirestore(latency_ms=options.firestore_latencia_ms, jitter_ms=options.firestore_latencia_ms / 2)
+    patients = max(options.pacientes or 0, options.concorrencia)
+    seed_tenant(db, patients)
+    set_firestore_client(db)
+    set_chat_model_factory(_llm_factory(options))
+    
+    try:
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as data_dir:
+            _configure_environment(options, evolution_url, data_dir)
+            # Importado só agora: o app lê as configurações na importação
+            from ..main import app
+            from .firestore_async import get_write_stats
+            
+            transport = httpx.ASGITransport(app=app)
+            async with app.router.lifespan_context(app):
+                async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=options.timeout) as client:
+                    samples, totals, elapsed = await _drive(client, stub, options)
+            
+            llm = get_fake_llm_stats()
+            firestore = db.stats()
+            return {
+                "config": {
+                    "mensagens": options.mensagens,
+                    "concorrencia": options.concorrencia,
+                    "rota": options.rota,
+                    "modo": options.modo,
+                    "streaming": options.streaming
+                },
+                "elapsed_seconds": round(elapsed, 2),
+                "throughput_msgs_per_second": round(totals["replies"] / elapsed, 2) if elapsed else 0.0,
+                **totals,
+                "stages_ms": {
+                    **{name: _percentiles(values) for name, values in samples.items() if values},
+                    "llm_call": _percentiles(llm["durations_ms"]),
+                    **{f"firestore_{op}": _percentiles(values) for op, values in firestore["durations_ms"].items()},
+                    "evolution_request": _percentiles(list(stub.durations_ms))
+                },
+                "llm_calls": llm["calls"],
+                "llm_tool_calls": llm["tool_calls"],
+                "firestore_ops": firestore["ops"],
+                "firestore_writes": get_write_stats(),
+                "evolution": dict(stub.counts)
+            }
+    finally:
+        await stub.stop()
+        set_chat_model_factory(None)
+        set_firestore_client(None)
+
+# Comparação entre quantidades de workers (servidor uvicorn em subprocesso)
+
+OPTIONS_ENV = "LOADTEST_OPTIONS"
+
+def create_offline_app() -> Any:
+    """Fábrica do app para o uvicorn (--factory) usada em cada worker do teste
+
+    Lê as opções do teste do ambiente, instala os substitutos locais e só então
+    importa o app.
+    """
+    options = argparse.Namespace(**json.loads(os.environ[OPTIONS_ENV]))
+    db = InMemoryFirestore(latency_ms=options.firestore_latencia_ms, jitter_ms=options.firestore_latencia_ms / 2)
+    seed_tenant(db, max(options.pacientes or 0, options.concorrencia))
+    set_firestore_client(db)
+    set_chat_model_factory(_llm_factory(options))
+    from ..main import app
+    return app
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _wait_server(base_url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    """Espera o servidor responder (todos os workers passam pelo lifespan antes)"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=1.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Servidor encerrou na inicialização (código {process.returncode})")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Servidor não respondeu a tempo")
+
+async def run_workers_comparison(options: argparse.Namespace, worker_counts: List[int]) -> Dict[str, Any]:
+    """Roda o mesmo teste contra o servidor de produção com cada quantidade de workers"""
+    stub = EvolutionStub(latency_ms=options.evolution_latencia_ms, failure_rate=options.evolution_falhas)
+    evolution_url = await stub.start()
+    backend_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = []
+    try:
+        for workers in worker_counts:
+            with tempfile.TemporaryDirectory(prefix="loadtest-") as data_dir:
+                _configure_environment(options, evolution_url, data_dir)
+                port = _free_port()
+                env = {
+                    **os.environ,
+                    OPTIONS_ENV: json.dumps(vars(options)),
+                    "SERVER_MODE": "prod",
+                    "SERVER_WORKERS": str(workers),
+                    "LOG_LEVEL": "WARNING"
+                }
+                process = subprocess.Popen(
+                    [
+                        sys.executable, "-m", "uvicorn", "app.services.load_test:create_offline_app",
+                        "--factory", "--host", "127.0.0.1", "--port", str(port),
+                        "--workers", str(workers), "--log-level", "warning", "--no-access-log"
+                    ],
+                    cwd=backend_dir,
+                    env=env
+                )
+                base_url = f"http://127.0.0.1:{port}"
+                try:
+                    await _wait_server(base_url, process)
+                    async with httpx.AsyncClient(base_url=base_url, timeout=options.timeout) as client:
+                        samples, totals, elapsed = await _drive(client, stub, options)
+                finally:
+                    process.send_signal(signal.SIGTERM)
+                    try:
+                        await asyncio.to_thread(process.wait, options.timeout)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                
+                results.append({
+                    "workers": workers,
+                    "elapsed_seconds": round(elapsed, 2),
+                    "throughput_msgs_per_second": round(totals["replies"] / elapsed, 2) if elapsed else 0.0,
+                    **totals,
+                    "stages_ms": {name: _percentiles(values) for name, values in samples.items() if values}
+                })
+    finally:
+        await stub.stop()
+    
+    return {
+        "config": {
+            "mensagens": options.mensagens,
+            "concorrencia": options.concorrencia,
+            "rota": options.rota,
+            "modo": options.modo,
+            "streaming": options.streaming
+        },
+        "runs": results
+    }
+
+def _print_workers_report(report: Dict[str, Any]) -> None:
+    config = report["config"]
+    print(
+        f"\n{config['mensagens']} mensagens por rodada, concorrência {config['concorrencia']}, "
+        f"rota {config['rota']}, modo {config['modo']}, streaming {config['streaming']}"
+    )
+    print(f"\n{'workers':>8}{'msg/s':>10}{'respostas':>11}{'erros':>7}{'ack p95':>10}{'1ª resp p50':>13}{'1ª resp p95':>13}")
+    for run in report["runs"]:
+        stages = run["stages_ms"]
+        acks = [stage["p95"] for name, stage in stages.items() if name.startswith("ack_")]
+        first = stages.get("first_reply", {"p50": None, "p95": None})
+        print(
+            f"{run['workers']:>8}{run['throughput_msgs_per_second']:>10}{run['replies']:>11}"
+            f"{run['errors'] + run['timeouts']:>7}{max(acks) if acks else '-':>10}"
+            f"{first['p50'] if first['p50'] is not None else '-':>13}{first['p95'] if first['p95'] is not None else '-':>13}"
+        )
+
+def _print_report(report: Dict[str, Any]) -> None:
+    config = report["config"]
+    print(
+        f"\n{config['mensagens']} mensagens, concorrência {config['concorrencia']}, rota {config['rota']}, "
+        f"modo {config['modo']}, streaming {config['streaming']}"
+    )
+    print(
+        f"{report['replies']} respostas em {report['elapsed_seconds']} s "
+        f"({report['throughput_msgs_per_second']} msg/s), {report['errors']} erros, {report['timeouts']} timeouts"
+    )
+    print(f"\n{'etapa':<24}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, values in report["stages_ms"].items():
+        if values["count"]:
+            print(f"{stage:<24}{values['count']:>8}{values['p50']:>10}{values['p95']:>10}{values['p99']:>10}")
+    print(f"\nLLM: {report['llm_calls']} chamadas ({report['llm_tool_calls']} com ferramenta)")
+    print(f"Firestore: {report['firestore_ops']}")
+    print(f"Evolution: {report['evolution']}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Teste de carga offline dos webhooks do WhatsApp")
+    parser.add_argument("--mensagens", type=int, default=200, help="total de mensagens enviadas")
+    parser.add_argument("--concorrencia", type=int, default=20, help="pacientes virtuais conversando ao mesmo tempo")
+    parser.add_argument("--pacientes", type=int, default=None, help="pacientes cadastrados (mínimo: a concorrência)")
+    parser.add_argument("--rota", choices=["ambas", *ROUTES], default="ambas", help="/webhook/whatsapp, /whatsapp/webhook ou as duas alternadas")
+    parser.add_argument("--modo", choices=["async", "sync"], default="async", help="WEBHOOK_INGESTION_MODE")
+    parser.add_argument("--streaming", choices=["on", "off"], default="on", help="resposta do agente em trechos")
+    parser.add_argument("--llm-latencia-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--llm-tokens-por-segundo", type=float, default=80.0)
+    parser.add_argument("--firestore-latencia-ms", type=float, default=5.0)
+    parser.add_argument("--evolution-latencia-ms", type=float, default=50.0)
+    parser.add_argument("--evolution-falhas", type=float, default=0.0, help="fração dos envios que falham com HTTP 500")
+    parser.add_argument("--timeout", type=float, default=30.0, help="espera máxima pela resposta (s)")
+    parser.add_argument("--settle-ms", type=float, default=300.0, help="silêncio que encerra uma resposta em trechos")
+    parser.add_argument("--workers", default=None, help="compara o servidor de produção com estas quantidades de workers (ex.: 1,2,4)")
+    parser.add_argument("--json", action="store_true", help="imprime o relatório em JSON")
+    options = parser.parse_args()
+    
+    worker_counts = [int(count) for count in options.workers.split(",")] if options.workers else None
+    del options.workers
+    if worker_counts:
+        report = asyncio.run(run_workers_comparison(options, worker_counts))
+    else:
+        report = asyncio.run(run_load_test(options))
+    if options.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif worker_counts:
+        _print_workers_report(report)
+    else:
+        _print_report(report)
+
+if __name__ == "__main__":
+    main()
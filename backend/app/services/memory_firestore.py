@@ -0,0 +1,572 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+import copy
+import queue
+import random
+import string
+import threading
+import time
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from google.cloud.firestore_v1.field_path import parse_field_path
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Substituto do cliente Firestore em memória, usado nos testes de carga offline
+# (set_firestore_client). Cobre o subconjunto da API usado pelo backend:
+# documentos, consultas simples, batches, get_all, listeners e as sentinelas
+# DELETE_FIELD / SERVER_TIMESTAMP / Increment. Transações não são suportadas.
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": lambda value, expected: value == expected,
+    "!=": lambda value, expected: value != expected,
+    "<": lambda value, expected: value < expected,
+    "<=": lambda value, expected: value <= expected,
+    ">": lambda value, expected: value > expected,
+    ">=": lambda value, expected: value >= expected,
+    "in": lambda value, expected: value in expected,
+    "not-in": lambda value, expected: value not in expected,
+    "array-contains": lambda value, expected: isinstance(value, list) and expected in value,
+    "array-contains-any": lambda value, expected: isinstance(value, list) and any(item in value for item in expected),
+}
+_MISSING = object()
+_ID_CHARS = string.ascii_letters + string.digits
+
+def _split(path: str) -> List[str]:
+    return parse_field_path(path)
+
+def _lookup(data: Dict[str, Any], parts: List[str]) -> Any:
+    value: Any = data
+    for part in parts:
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def _order_value(data: Dict[str, Any], parts: List[str]) -> Tuple[bool, Any]:
+    value = _lookup(data, parts)
+    return (False, 0) if value is _MISSING or value is None else (True, value)
+
+def _resolve(value: Any, current: Any, now: datetime) -> Any:
+    """Substitui as sentinelas do Firestore pelo valor gravado"""
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, firestore.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, dict):
+        return {key: _resolve(item, _MISSING, now) for key, item in value.items() if item is not firestore.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+def _merge(target: Dict[str, Any], data: Dict[str, Any], now: datetime) -> None:
+    """set(merge=True): mescla os mapas recursivamente"""
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value, now)
+        else:
+            target[key] = _resolve(value, target.get(key, _MISSING), now)
+
+def _apply_update(target: Dict[str, Any], data: Dict[str, Any], now: datetime) -> None:
+    """update(): chaves são caminhos de campo ("a.b", "a.`11`")"""
+    for path, value in data.items():
+        *parents, leaf = _split(path)
+        node = target
+        for part in parents:
+            if not isinstance(node.get(part), dict):
+                if value is firestore.DELETE_FIELD:
+                    node = None
+                    break
+                node[part] = {}
+            node = node[part]
+        if node is None:
+            continue
+        if value is firestore.DELETE_FIELD:
+            node.pop(leaf, None)
+        else:
+            node[leaf] = _resolve(value, node.get(leaf, _MISSING), now)
+
+def _project(data: Dict[str, Any], field_paths: Optional[List[str]]) -> Dict[str, Any]:
+    if field_paths is None:
+        return copy.deepcopy(data)
+    projected: Dict[str, Any] = {}
+    for path in field_paths:
+        parts = _split(path)
+        value = _lookup(data, parts)
+        if value is _MISSING:
+            continue
+        node = projected
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = copy.deepcopy(value)
+    return projected
+
+class ChangeType(Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+class DocumentChange:
+    def __init__(self, type: ChangeType, document: "DocumentSnapshot"):
+        self.type = type
+        self.document = document
+
+class WriteResult:
+    def __init__(self, update_time: datetime):
+        self.update_time = update_time
+
+class WriteOption:
+    """Pré-condição de escrita (write_option(last_update_time=...))"""
+    
+    def __init__(self, last_update_time: Optional[datetime] = None, exists: Optional[bool] = None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+class DocumentSnapshot:
+    def __init__(
+        self,
+        reference: "DocumentReference",
+        data: Optional[Dict[str, Any]],
+        create_time: Optional[datetime] = None,
+        update_time: Optional[datetime] = None,
+        read_time: Optional[datetime] = None
+    ):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+    
+    @property
+    def id(self) -> str:
+        return self.reference.id
+    
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+    
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+    
+    def get(self, field_path: str) -> Any:
+        value = _lookup(self._data or {}, _split(field_path))
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+class DocumentReference:
+    def __init__(self, client: "InMemoryFirestore", collection_path: str, document_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+    
+    @property
+    def path(self) -> str:
+        return f"{self._collection_path}/{self.id}"
+    
+    @property
+    def parent(self) -> "CollectionReference":
+        return CollectionReference(self._client, self._collection_path)
+    
+    def collection(self, collection_id: str) -> "CollectionReference":
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+    
+    def get(self, field_paths: Optional[List[str]] = None, transaction: Any = None, **kwargs: Any) -> DocumentSnapshot:
+        return self._client._get(self, field_paths)
+    
+    def create(self, document_data: Dict[str, Any]) -> WriteResult:
+        return self._client._commit([("create", self, document_data, {})])
+    
+    def set(self, document_data: Dict[str, Any], merge: bool = False) -> WriteResult:
+        return self._client._commit([("set", self, document_data, {"merge": merge})])
+    
+    def update(self, field_updates: Dict[str, Any], option: Optional[WriteOption] = None) -> WriteResult:
+        return self._client._commit([("update", self, field_updates, {"option": option})])
+    
+    def delete(self, option: Optional[WriteOption] = None) -> WriteResult:
+        return self._client._commit([("delete", self, None, {"option": option})])
+    
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, DocumentReference) and other.path == self.path
+    
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+class Query:
+    """Consulta imutável sobre uma coleção (cada método retorna uma cópia)"""
+    
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+    
+    def __init__(self, client: "InMemoryFirestore", collection_path: str):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters: List[Tuple[List[str], str, Any]] = []
+        self._orders: List[Tuple[List[str], str]] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._projection: Optional[List[str]] = None
+        self._start_after: Optional[Any] = None
+    
+    def _copy(self) -> "Query":
+        query = Query(self._client, self._collection_path)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        query._limit = self._limit
+        query._offset = self._offset
+        query._projection = self._projection
+        query._start_after = self._start_after
+        return query
+    
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, filter: Any = None) -> "Query":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Operador não suportado pelo Firestore em memória: {op_string}")
+        query = self._copy()
+        query._filters.append((_split(field_path), op_string, value))
+        return query
+    
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "Query":
+        query = self._copy()
+        query._orders.append((_split(field_path), direction))
+        return query
+    
+    def limit(self, count: int) -> "Query":
+        query = self._copy()
+        query._limit = count
+        return query
+    
+    def offset(self, num_to_skip: int) -> "Query":
+        query = self._copy()
+        query._offset = num_to_skip
+        return query
+    
+    def select(self, field_paths: List[str]) -> "Query":
+        query = self._copy()
+        query._projection = list(field_paths)
+        return query
+    
+    def start_after(self, document_fields_or_snapshot: Any) -> "Query":
+        query = self._copy()
+        query._start_after = document_fields_or_snapshot
+        return query
+    
+    def _matches(self, data: Dict[str, Any]) -> bool:
+        for parts, op_string, expected in self._filters:
+            value = _lookup(data, parts)
+            if value is _MISSING:
+                return False
+            try:
+                if not _OPERATORS[op_string](value, expected):
+                    return False
+            except TypeError:
+                # Valores de tipos diferentes não se comparam no Firestore
+                return False
+        return True
+    
+    def _run(self, documents: Dict[str, Tuple[Dict[str, Any], datetime, datetime]]) -> List[Tuple[str, Dict[str, Any], datetime, datetime]]:
+        rows = [(doc_id, data, created, updated) for doc_id, (data, created, updated) in documents.items() if self._matches(data)]
+        # Ordenação estável: do último critério para o primeiro, com o id como desempate
+        rows.sort(key=lambda row: row[0])
+        for parts, direction in reversed(self._orders):
+            rows.sort(key=lambda row: _order_value(row[1], parts), reverse=direction == self.DESCENDING)
+        
+        if self._start_after is not None:
+            cursor = self._start_after
+            if isinstance(cursor, DocumentSnapshot):
+                position = next((i for i, row in enumerate(rows) if row[0] == cursor.id), None)
+                rows = rows[position + 1:] if position is not None else rows
+            else:
+                boundary = tuple(cursor.get(".".join(parts)) for parts, _ in self._orders)
+                rows = [row for row in rows if tuple(_lookup(row[1], parts) for parts, _ in self._orders) > boundary]
+        
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+    
+    def stream(self, transaction: Any = None, **kwargs: Any) -> Iterator[DocumentSnapshot]:
+        return iter(self._client._query(self))
+    
+    def get(self, transaction: Any = None, **kwargs: Any) -> List[DocumentSnapshot]:
+        return self._client._query(self)
+    
+    def on_snapshot(self, callback: Callable[[List[DocumentSnapshot], List[DocumentChange], datetime], None]) -> "Watch":
+        return self._client._watch(self, callback)
+
+class CollectionReference(Query):
+    def __init__(self, client: "InMemoryFirestore", collection_path: str):
+        super().__init__(client, collection_path.strip("/"))
+    
+    @property
+    def id(self) -> str:
+        return self._collection_path.rsplit("/", 1)[-1]
+    
+    def document(self, document_id: Optional[str] = None) -> DocumentReference:
+        if document_id is None:
+            document_id = "".join(random.choice(_ID_CHARS) for _ in range(20))
+        return DocumentReference(self._client, self._collection_path, document_id)
+    
+    def add(self, document_data: Dict[str, Any], document_id: Optional[str] = None) -> Tuple[datetime, DocumentReference]:
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+class WriteBatch:
+    def __init__(self, client: "InMemoryFirestore"):
+        self._client = client
+        self._writes: List[Tuple[str, DocumentReference, Any, Dict[str, Any]]] = []
+    
+    def __len__(self) -> int:
+        return len(self._writes)
+    
+    def create(self, reference: DocumentReference, document_data: Dict[str, Any]) -> None:
+        self._writes.append(("create", reference, document_data, {}))
+    
+    def set(self, reference: DocumentReference, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append(("set", reference, document_data, {"merge": merge}))
+    
+    def update(self, reference: DocumentReference, field_updates: Dict[str, Any], option: Optional[WriteOption] = None) -> None:
+        self._writes.append(("update", reference, field_updates, {"option": option}))
+    
+    def delete(self, reference: DocumentReference, option: Optional[WriteOption] = None) -> None:
+        self._writes.append(("delete", reference, None, {"option": option}))
+    
+    def commit(self) -> List[WriteResult]:
+        writes, self._writes = self._writes, []
+        if not writes:
+            return []
+        result = self._client._commit(writes)
+        return [result] * len(writes)
+
+class Watch:
+    def __init__(self, client: "InMemoryFirestore", query: Query, callback: Callable[..., None]):
+        self._client = client
+        self.query = query
+        self.callback = callback
+        self.ids: set = set()
+    
+    def unsubscribe(self) -> None:
+        self._client._unwatch(self)
+
+class InMemoryFirestore:
+    """Cliente Firestore em memória, thread-safe, com latência simulada por chamada
+
+    latency_ms (+ jitter_ms aleatório) é aplicado em cada RPC (get, stream,
+    commit...) bloqueando a thread, como o cliente real; os listeners são
+    notificados em uma thread própria, na ordem das escritas.
+    """
+    
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._collections: Dict[str, Dict[str, Tuple[Dict[str, Any], datetime, datetime]]] = {}
+        self._watches: List[Watch] = []
+        self._lock = threading.RLock()
+        self._last_time = datetime.now(timezone.utc)
+        self._events: "queue.Queue[Tuple[Watch, List[DocumentSnapshot], List[DocumentChange], datetime]]" = queue.Queue()
+        self._notifier: Optional[threading.Thread] = None
+        self._ops: Dict[str, int] = {}
+        self._durations: Dict[str, deque] = {}
+    
+    # API pública (subconjunto do google.cloud.firestore.Client)
+    
+    def collection(self, collection_path: str) -> CollectionReference:
+        return CollectionReference(self, collection_path)
+    
+    def document(self, document_path: str) -> DocumentReference:
+        collection_path, document_id = document_path.strip("/").rsplit("/", 1)
+        return DocumentReference(self, collection_path, document_id)
+    
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+    
+    def write_option(self, last_update_time: Optional[datetime] = None, exists: Optional[bool] = None) -> WriteOption:
+        return WriteOption(last_update_time, exists)
+    
+    def get_all(self, references: List[DocumentReference], field_paths: Optional[List[str]] = None, transaction: Any = None) -> Iterator[DocumentSnapshot]:
+        started_at = self._rpc()
+        with self._lock:
+            snapshots = [self._snapshot(reference, field_paths) for reference in references]
+        self._record("get_all", started_at)
+        return iter(snapshots)
+    
+    def transaction(self, **kwargs: Any) -> Any:
+        raise NotImplementedError("Transações não são suportadas pelo Firestore em memória")
+    
+    def close(self) -> None:
+        with self._lock:
+            self._watches = []
+    
+    # Carga de dados e estatísticas
+    
+    def seed(self, collection_path: str, documents: Dict[str, Dict[str, Any]]) -> None:
+        """Grava documentos diretamente, sem latência nem notificação (antes do teste)"""
+        now = self._now()
+        with self._lock:
+            collection = self._collections.setdefault(collection_path.strip("/"), {})
+            for document_id, data in documents.items():
+                collection[document_id] = (copy.deepcopy(data), now, now)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Chamadas por tipo de operação e as durações (ms) das mais recentes"""
+        with self._lock:
+            return {
+                "ops": dict(self._ops),
+                "durations_ms": {op: list(samples) for op, samples in self._durations.items()},
+                "documents": sum(len(collection) for collection in self._collections.values())
+            }
+    
+    # Implementação
+    
+    def _rpc(self) -> float:
+        started_at = time.perf_counter()
+        delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        return started_at
+    
+    def _record(self, op: str, started_at: float) -> None:
+        with self._lock:
+            self._ops[op] = self._ops.get(op, 0) + 1
+            self._durations.setdefault(op, deque(maxlen=10000)).append((time.perf_counter() - started_at) * 1000)
+    
+    def _now(self) -> datetime:
+        """Horário de gravação sempre crescente (serve de update_time)"""
+        with self._lock:
+            now = max(datetime.now(timezone.utc), self._last_time + timedelta(microseconds=1))
+            self._last_time = now
+            return now
+    
+    def _snapshot(self, reference: DocumentReference, field_paths: Optional[List[str]] = None) -> DocumentSnapshot:
+        entry = self._collections.get(reference._collection_path, {}).get(reference.id)
+        if entry is None:
+            return DocumentSnapshot(reference, None, read_time=self._last_time)
+        data, created, updated = entry
+        return DocumentSnapshot(reference, _project(data, field_paths), created, updated, self._last_time)
+    
+    def _get(self, reference: DocumentReference, field_paths: Optional[List[str]]) -> DocumentSnapshot:
+        started_at = self._rpc()
+        with self._lock:
+            snapshot = self._snapshot(reference, field_paths)
+        self._record("get", started_at)
+        return snapshot
+    
+    def _query(self, query: Query) -> List[DocumentSnapshot]:
+        started_at = self._rpc()
+        with self._lock:
+            rows = query._run(self._collections.get(query._collection_path, {}))
+            snapshots = [
+                DocumentSnapshot(
+                    DocumentReference(self, query._collection_path, doc_id),
+                    _project(data, query._projection),
+                    created,
+                    updated,
+                    self._last_time
+                )
+                for doc_id, data, created, updated in rows
+            ]
+        self._record("query", started_at)
+        return snapshots
+    
+    def _check(self, action: str, reference: DocumentReference, options: Dict[str, Any]) -> None:
+        entry = self._collections.get(reference._collection_path, {}).get(reference.id)
+        option = options.get("option")
+        if action == "create" and entry is not None:
+            raise FailedPrecondition(f"Documento já existe: {reference.path}")
+        if action == "update" and entry is None:
+            raise NotFound(f"Documento não encontrado: {reference.path}")
+        if option is not None:
+            if option.exists is not None and option.exists != (entry is not None):
+                raise FailedPrecondition(f"Pré-condição de existência falhou: {reference.path}")
+            if option.last_update_time is not None and (entry is None or entry[2] != option.last_update_time):
+                raise FailedPrecondition(f"Documento alterado desde a leitura: {reference.path}")
+    
+    def _commit(self, writes: List[Tuple[str, DocumentReference, Any, Dict[str, Any]]]) -> WriteResult:
+        """Aplica as escritas de forma atômica (valida todas antes de gravar)"""
+        started_at = self._rpc()
+        with self._lock:
+            for action, reference, _, options in writes:
+                self._check(action, reference, options)
+            
+            now = self._now()
+            touched: Dict[str, DocumentReference] = {}
+            for action, reference, data, options in writes:
+                collection = self._collections.setdefault(reference._collection_path, {})
+                entry = collection.get(reference.id)
+                if action == "delete":
+                    collection.pop(reference.id, None)
+                else:
+                    current = copy.deepcopy(entry[0]) if entry is not None else {}
+                    if action == "update":
+                        _apply_update(current, data, now)
+                    elif action == "set" and options.get("merge"):
+                        _merge(current, data, now)
+                    else:
+                        current = _resolve(data, _MISSING, now)
+                    collection[reference.id] = (current, entry[1] if entry is not None else now, now)
+                touched[reference.path] = reference
+            self._notify(list(touched.values()), now)
+        self._record("commit", started_at)
+        return WriteResult(now)
+    
+    def _watch(self, query: Query, callback: Callable[..., None]) -> Watch:
+        watch = Watch(self, query, callback)
+        with self._lock:
+            rows = query._run(self._collections.get(query._collection_path, {}))
+            docs = [
+                DocumentSnapshot(DocumentReference(self, query._collection_path, doc_id), copy.deepcopy(data), created, updated, self._last_time)
+                for doc_id, data, created, updated in rows
+            ]
+            watch.ids = {doc.id for doc in docs}
+            self._watches.append(watch)
+            self._enqueue(watch, docs, [DocumentChange(ChangeType.ADDED, doc) for doc in docs], self._last_time)
+        return watch
+    
+    def _unwatch(self, watch: Watch) -> None:
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+    
+    def _notify(self, references: List[DocumentReference], now: datetime) -> None:
+        """Calcula as mudanças de cada listener afetado (chamado com o lock)"""
+        for watch in self._watches:
+            collection_path = watch.query._collection_path
+            changes = []
+            for reference in references:
+                if reference._collection_path != collection_path:
+                    continue
+                snapshot = self._snapshot(reference)
+                matches = snapshot.exists and watch.query._matches(snapshot._data)
+                if matches:
+                    kind = ChangeType.MODIFIED if reference.id in watch.ids else ChangeType.ADDED
+                    watch.ids.add(reference.id)
+                    changes.append(DocumentChange(kind, snapshot))
+                elif reference.id in watch.ids:
+                    watch.ids.discard(reference.id)
+                    changes.append(DocumentChange(ChangeType.REMOVED, DocumentSnapshot(reference, {}, read_time=now)))
+            if changes:
+                # docs traz só os documentos alterados (o backend usa apenas as mudanças)
+                docs = [change.document for change in changes if change.type is not ChangeType.REMOVED]
+                self._enqueue(watch, docs, changes, now)
+    
+    def _enqueue(self, watch: Watch, docs: List[DocumentSnapshot], changes: List[DocumentChange], read_time: datetime) -> None:
+        self._events.put((watch, docs, changes, read_time))
+        if self._notifier is None:
+            self._notifier = threading.Thread(target=self._dispatch, name="memory-firestore-watch", daemon=True)
+            self._notifier.start()
+    
+    def _dispatch(self) -> None:
+        while True:
+            watch, docs, changes, read_time = self._events.get()
+            if watch not in self._watches:
+                continue
+            try:
+                watch.callback(docs, changes, read_time)
+            except Exception as e:
+                log.error("Erro no listener do Firestore em memória", error=str(e))
@@ -0,0 +1,243 @@
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+from ..config import get_settings
+
+# Limites (ms) dos buckets dos histogramas de latência
+DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+LabelValues = Tuple[str, ...]
+
+class Histogram:
+    """Histograma com buckets fixos (contagem acumulada no formato do Prometheus)"""
+    
+    def __init__(self, name: str, description: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelValues, List[Any]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [contagem por bucket (+Inf no fim), soma, total]
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def _quantile(self, counts: List[int], total: int, fraction: float) -> Optional[float]:
+        """Estimativa do quantil pela interpolação linear dentro do bucket"""
+        if not total:
+            return None
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index >= len(self.buckets):
+                    return float(lower)
+                return round(lower + (self.buckets[index] - lower) * (rank - seen) / count, 1)
+            seen += count
+        return None
+    
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            series = [(labels, list(counts), total_sum, total) for labels, (counts, total_sum, total) in self._series.items()]
+        return [
+            {
+                **dict(zip(self.label_names, labels)),
+                "count": total,
+                "avg_ms": round(total_sum / total, 1) if total else None,
+                "p50_ms": self._quantile(counts, total, 0.5),
+                "p95_ms": self._quantile(counts, total, 0.95),
+                "p99_ms": self._quantile(counts, total, 0.99)
+            }
+            for labels, counts, total_sum, total in sorted(series)
+        ]
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total_sum, total) for labels, (counts, total_sum, total) in self._series.items()]
+        for labels, counts, total_sum, total in sorted(series):
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_join_labels(base, _format_labels(('le',), (str(bound),)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_join_labels(base, _format_labels(('le',), ('+Inf',)))} {total}")
+            lines.append(f"{self.name}_sum{_join_labels(base)} {round(total_sum, 3)}")
+            lines.append(f"{self.name}_count{_join_labels(base)} {total}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: Sequence[str]):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+    
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [{**dict(zip(self.label_names, labels)), "value": value} for labels, value in values]
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_join_labels(_format_labels(self.label_names, labels))} {value}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values))
+
+def _join_labels(*parts: str) -> str:
+    labels = ",".join(part for part in parts if part)
+    return f"{{{labels}}}" if labels else ""
+
+class Span:
+    """Trecho cronometrado do processamento de uma mensagem (etapa + filhos)"""
+    
+    __slots__ = ("stage", "name", "trace_id", "started_at", "duration_ms", "error", "children")
+    
+    def __init__(self, stage: str, name: str, trace_id: Optional[str]):
+        self.stage = stage
+        self.name = name
+        self.trace_id = trace_id
+        self.started_at = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+    
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"stage": self.stage, "duration_ms": self.duration_ms}
+        if self.name:
+            data["name"] = self.name
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+class Metrics:
+    """Métricas do pipeline: latência por etapa, erros, novas tentativas e traces recentes"""
+    
+    def __init__(self, enabled: bool = True, trace_buffer: int = 200):
+        self.enabled = enabled
+        self.stage_latency = Histogram(
+            "bmodonto_stage_latency_ms",
+            "Latência de cada etapa do processamento das mensagens (ms)",
+            ("stage", "name")
+        )
+        self.errors = Counter("bmodonto_errors_total", "Erros por etapa", ("stage", "name"))
+        self.retries = Counter("bmodonto_retries_total", "Novas tentativas por destino", ("target",))
+        self._traces: Deque[Dict[str, Any]] = deque(maxlen=trace_buffer)
+    
+    def record_trace(self, root: Span) -> None:
+        self._traces.append({"trace_id": root.trace_id, "at": time.time(), **root.to_dict()})
+    
+    def traces(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return list(self._traces)[-limit:]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "stages": self.stage_latency.snapshot(),
+            "errors": self.errors.snapshot(),
+            "retries": self.retries.snapshot()
+        }
+    
+    def render_prometheus(self) -> str:
+        lines = self.stage_latency.render() + self.errors.render() + self.retries.render()
+        return "\n".join(lines) + "\n"
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+_current_span: ContextVar[Optional[Span]] = ContextVar("metrics_current_span", default=None)
+
+def get_metrics() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                settings = get_settings()
+                _metrics = Metrics(settings.metrics_enabled, settings.metrics_trace_buffer)
+    return _metrics
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+@contextmanager
+def span(stage: str, name: str = "", trace_id: Optional[str] = None) -> Iterator[Optional[Span]]:
+    """Cronometra a etapa e a registra no histograma (funciona em código síncrono e assíncrono)
+
+    Spans abertos dentro do bloco (inclusive nas ferramentas, que rodam no pool
+    do Firestore com o contexto copiado) viram filhos deste. Um span raiz com
+    trace_id (ex.: id da mensagem do WhatsApp) entra na lista de traces recentes.
+    """
+    metrics = get_metrics()
+    if not metrics.enabled:
+        yield None
+        return
+    
+    parent = _current_span.get()
+    current = Span(stage, name, trace_id or (parent.trace_id if parent is not None else None))
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = e.__class__.__name__
+        metrics.errors.inc(stage, name)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.duration_ms = round((time.perf_counter() - current.started_at) * 1000, 2)
+        metrics.stage_latency.observe(current.duration_ms, stage, name)
+        if parent is not None:
+            parent.children.append(current)
+        elif trace_id is not None:
+            metrics.record_trace(current)
+
+def record_span(stage: str, duration_ms: float, name: str = "", error: Optional[str] = None) -> None:
+    """Registra uma etapa já cronometrada (ex.: chamada à LLM medida pelo callback)"""
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return
+    metrics.stage_latency.observe(duration_ms, stage, name)
+    if error is not None:
+        metrics.errors.inc(stage, name)
+    parent = _current_span.get()
+    if parent is not None:
+        finished = Span(stage, name, parent.trace_id)
+        finished.duration_ms = round(duration_ms, 2)
+        finished.error = error
+        parent.children.append(finished)
+
+def count_error(stage: str, name: str = "") -> None:
+    """Conta um erro que não virou exceção (ex.: ferramenta que devolve "Erro ...")"""
+    metrics = get_metrics()
+    if metrics.enabled:
+        metrics.errors.inc(stage, name)
+
+def count_retry(target: str) -> None:
+    metrics = get_metrics()
+    if metrics.enabled:
+        metrics.retries.inc(target)
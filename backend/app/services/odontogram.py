@@ -0,0 +1,365 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import copy
+import json
+import time
+from ..config import get_settings
+from .firebase_client import get_firestore_client
+from .firestore_async import current_writes
+from .lazy_import import lazy_import
+
+firestore = lazy_import("firebase_admin.firestore")
+google_exceptions = lazy_import("google.api_core.exceptions")
+firestore_field_path = lazy_import("google.cloud.firestore_v1.field_path")
+
+# Campo compacto (mapa número do dente -> apenas o que difere do dente padrão),
+# editado por caminho. O documento guarda um só formato, conforme
+# ODONTOGRAM_COMPACT_ENABLED: desligado, o array completo em "odontograma" que o
+# frontend lê e grava direto no Firestore; ligado, só o compacto (o array sai na
+# migração). Os leitores entendem os dois; com os dois campos presentes (versões
+# anteriores gravavam ambos), vale o array.
+COMPACT_FIELD = "odontogramaCompacto"
+VERSION_FIELD = "odontogramaVersao"
+LEGACY_FIELD = "odontograma"
+VERSION = 1
+
+# Mesma ordem e quadrantes do INITIAL_TEETH_DATA do frontend (notação FDI)
+QUADRANTS = {
+    1: "Superior Direito",
+    2: "Superior Esquerdo",
+    3: "Inferior Esquerdo",
+    4: "Inferior Direito"
+}
+TOOTH_NUMBERS = tuple(quadrant * 10 + position for quadrant in (1, 2, 3, 4) for position in range(1, 9))
+# Listas do dente guardadas como mapas id -> item, para permitir atualizar um item pelo caminho
+LIST_FIELDS = ("tratamentos", "condicoesPatologicas", "restauracoesProtesesExistentes", "anomalias")
+DEFAULT_STATUS = {"tipo": "Presente"}
+# Posição do item na lista original (mapas do Firestore não preservam ordem)
+POSITION_KEY = "_pos"
+
+def default_tooth(number: int) -> Dict[str, Any]:
+    """Dente no estado inicial do frontend (createTooth em constants.ts)"""
+    return {
+        "id": f"T{number}",
+        "number": number,
+        "quadrant": QUADRANTS[number // 10],
+        "statusGeral": dict(DEFAULT_STATUS),
+        "condicoesPatologicas": [],
+        "restauracoesProtesesExistentes": [],
+        "anomalias": [],
+        "tratamentos": [],
+        "notes": ""
+    }
+
+def _is_default(key: str, value: Any) -> bool:
+    if key == "statusGeral":
+        return value == DEFAULT_STATUS
+    if key == "notes":
+        return not value
+    return value is None
+
+def compact_tooth(tooth: Dict[str, Any]) -> Dict[str, Any]:
+    """Mantém apenas os campos do dente que diferem do padrão"""
+    record: Dict[str, Any] = {}
+    for key, value in tooth.items():
+        if key in ("id", "number", "quadrant"):
+            continue
+        if key in LIST_FIELDS:
+            items = {}
+            for position, item in enumerate(value or []):
+                item_id = str(item.get("id") or f"i{position}")
+                items[item_id] = {**item, "id": item_id, POSITION_KEY: position}
+            if items:
+                record[key] = items
+        elif not _is_default(key, value):
+            record[key] = value
+    return record
+
+def compact(teeth: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Converte o odontograma completo (32 dentes) no formato esparso"""
+    result = {}
+    for tooth in teeth or []:
+        number = tooth.get("number")
+        if number not in TOOTH_NUMBERS:
+            continue
+        record = compact_tooth(tooth)
+        if record:
+            result[str(number)] = record
+    return result
+
+def expand(compacted: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reconstrói o odontograma completo no formato do frontend"""
+    compacted = compacted or {}
+    teeth = []
+    for number in TOOTH_NUMBERS:
+        tooth = default_tooth(number)
+        for key, value in (compacted.get(str(number)) or {}).items():
+            if key in LIST_FIELDS:
+                items = sorted((value or {}).values(), key=lambda item: item.get(POSITION_KEY, float("inf")))
+                tooth[key] = [{k: v for k, v in item.items() if k != POSITION_KEY} for item in items]
+            else:
+                tooth[key] = value
+        teeth.append(tooth)
+    return teeth
+
+def compact_enabled() -> bool:
+    return get_settings().odontogram_compact_enabled
+
+def is_compact(data: Dict[str, Any]) -> bool:
+    """True se o documento só tem o odontograma compacto (sem o array do frontend)"""
+    return not data.get(LEGACY_FIELD) and (bool(data.get(VERSION_FIELD)) or COMPACT_FIELD in data)
+
+def odontogram_from_doc(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Odontograma do documento do paciente (o array do frontend, se existir)"""
+    if is_compact(data):
+        return expand(data.get(COMPACT_FIELD))
+    legacy = data.get(LEGACY_FIELD)
+    return legacy if legacy else expand({})
+
+def iter_treatments(data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Tratamentos de todos os dentes, sem expandir os dentes padrão"""
+    if is_compact(data):
+        for record in (data.get(COMPACT_FIELD) or {}).values():
+            yield from (record.get("tratamentos") or {}).values()
+    else:
+        for tooth in data.get(LEGACY_FIELD) or []:
+            yield from tooth.get("tratamentos") or []
+
+def expand_doc(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento do paciente com o odontograma no formato do frontend"""
+    if COMPACT_FIELD not in data and VERSION_FIELD not in data:
+        return data
+    data = dict(data)
+    compacted = data.pop(COMPACT_FIELD, None)
+    data.pop(VERSION_FIELD, None)
+    if not data.get(LEGACY_FIELD):
+        data[LEGACY_FIELD] = expand(compacted)
+    return data
+
+def replacement_fields(teeth: Sequence[Dict[str, Any]], create: bool = False) -> Dict[str, Any]:
+    """Campos para gravar um odontograma completo no formato em uso"""
+    if compact_enabled():
+        fields = {COMPACT_FIELD: compact(teeth), VERSION_FIELD: VERSION, LEGACY_FIELD: firestore.DELETE_FIELD}
+    else:
+        fields = {LEGACY_FIELD: list(teeth or []), COMPACT_FIELD: firestore.DELETE_FIELD, VERSION_FIELD: firestore.DELETE_FIELD}
+    if create:
+        # Documento novo: não há campo do outro formato para remover
+        fields = {key: value for key, value in fields.items() if value is not firestore.DELETE_FIELD}
+    return fields
+
+def needs_conversion(data: Dict[str, Any]) -> bool:
+    """True se o documento não está (só) no formato em uso"""
+    if compact_enabled():
+        return not data.get(VERSION_FIELD) or LEGACY_FIELD in data
+    return bool(data.get(VERSION_FIELD)) or COMPACT_FIELD in data
+
+def patch_paths(operations: Sequence[Dict[str, Any]]) -> List[Tuple[Tuple[str, ...], Any]]:
+    """Converte operações de patch em (caminho, valor) relativos ao campo compacto
+
+    Operações aceitas (uma por item da lista):
+    - {"dente": 36, "campos": {"statusGeral": {...}, "notes": "..."}}
+    - {"dente": 36, "lista": "tratamentos", "item": {"id": "...", ...}} (inclui ou substitui)
+    - {"dente": 36, "lista": "tratamentos", "id": "...", "campos": {"status": "Executado"}}
+    - {"dente": 36, "lista": "tratamentos", "id": "...", "remover": true}
+    - {"dente": 36, "remover": true} (volta o dente ao padrão)
+
+    Valores None (ou iguais ao padrão, no nível do dente) removem o campo.
+    """
+    paths: List[Tuple[Tuple[str, ...], Any]] = []
+    for operation in operations:
+        try:
+            number = int(operation.get("dente"))
+        except (TypeError, ValueError):
+            raise ValueError(f"Dente inválido: {operation.get('dente')}")
+        if number not in TOOTH_NUMBERS:
+            raise ValueError(f"Dente inválido: {number}")
+        tooth = (str(number),)
+        lista = operation.get("lista")
+        
+        if lista is None:
+            if operation.get("remover"):
+                paths.append((tooth, firestore.DELETE_FIELD))
+                continue
+            for key, value in (operation.get("campos") or {}).items():
+                if key in ("id", "number", "quadrant") or key in LIST_FIELDS:
+                    raise ValueError(f"Campo do dente não pode ser alterado por caminho: {key}")
+                paths.append((tooth + (key,), firestore.DELETE_FIELD if _is_default(key, value) else value))
+            continue
+        
+        if lista not in LIST_FIELDS:
+            raise ValueError(f"Lista inválida: {lista}")
+        if "item" in operation:
+            item = dict(operation["item"] or {})
+            item_id = str(item.get("id") or "")
+            if not item_id:
+                raise ValueError("O item precisa de id")
+            # Itens novos vão para o fim da lista (posição pelo relógio, sem ler o documento)
+            item.setdefault(POSITION_KEY, int(time.time() * 1000))
+            paths.append((tooth + (lista, item_id), item))
+            continue
+        
+        item_id = str(operation.get("id") or "")
+        if not item_id:
+            raise ValueError("Informe o id do item")
+        if operation.get("remover"):
+            paths.append((tooth + (lista, item_id), firestore.DELETE_FIELD))
+            continue
+        for key, value in (operation.get("campos") or {}).items():
+            if key in ("id", POSITION_KEY):
+                continue
+            paths.append((tooth + (lista, item_id, key), firestore.DELETE_FIELD if value is None else value))
+    return _fold(paths)
+
+def _fold(paths: List[Tuple[Tuple[str, ...], Any]]) -> List[Tuple[Tuple[str, ...], Any]]:
+    """Junta caminhos sobrepostos (o Firestore não aceita um campo e seu ancestral no mesmo update)"""
+    result: List[Tuple[Tuple[str, ...], Any]] = []
+    for parts, value in paths:
+        for index, (base, base_value) in enumerate(result):
+            if len(parts) > len(base) and parts[:len(base)] == base:
+                target = copy.deepcopy(base_value) if isinstance(base_value, dict) else {}
+                result[index] = (base, apply_paths(target, [(parts[len(base):], value)]))
+                break
+        else:
+            result = [(base, base_value) for base, base_value in result if base[:len(parts)] != parts]
+            result.append((parts, value))
+    return result
+
+def apply_paths(compacted: Dict[str, Any], paths: Sequence[Tuple[Tuple[str, ...], Any]]) -> Dict[str, Any]:
+    """Aplica os caminhos em memória (usado ao migrar um documento no formato antigo)"""
+    for parts, value in paths:
+        tree = compacted
+        for part in parts[:-1]:
+            tree = tree.setdefault(part, {})
+        if value is firestore.DELETE_FIELD:
+            tree.pop(parts[-1], None)
+        else:
+            tree[parts[-1]] = value
+    return compacted
+
+def field_path(*parts: str) -> str:
+    """Caminho de campo do Firestore com escape (números e ids com hífen precisam de crase)"""
+    return firestore_field_path.FieldPath(*parts).to_api_repr()
+
+def merge_updates(field: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Atualização por caminho das chaves enviadas de um campo do tipo mapa (None remove)"""
+    return {
+        field_path(field, key): firestore.DELETE_FIELD if value is None else value
+        for key, value in data.items()
+    }
+
+def path_updates(paths: Sequence[Tuple[Tuple[str, ...], Any]]) -> Dict[str, Any]:
+    """Update por caminho no campo compacto ("odontogramaCompacto.`36`.tratamentos.`id`.status")"""
+    return {field_path(COMPACT_FIELD, *parts): value for parts, value in paths}
+
+def _rewritten_fields(data: Dict[str, Any], paths: Sequence[Tuple[Tuple[str, ...], Any]]) -> Dict[str, Any]:
+    """Aplica o patch ao odontograma atual e o regrava inteiro no formato em uso"""
+    compacted = apply_paths(compact(odontogram_from_doc(data)), paths)
+    return replacement_fields(expand(compacted))
+
+def apply_patch(doc_ref, operations: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+    """Aplica um patch no odontograma do paciente
+
+    No formato compacto, grava apenas os caminhos alterados; documentos ainda
+    no outro formato são convertidos na mesma transação. Sem o compacto, o
+    patch é aplicado ao array atual, regravado inteiro. Dentro de um turno do
+    agente, a escrita entra no commit do fim do turno (a regravação usa a data
+    de atualização lida como pré-condição).
+    Lança ValueError para operações inválidas e NotFound se o paciente não existe.
+    """
+    paths = patch_paths(operations)
+    if not paths:
+        return {"caminhos": 0, "migrado": 0}
+    writes = current_writes()
+    if writes is not None:
+        return _stage_patch(writes, doc_ref, paths)
+    
+    @firestore.transactional
+    def run(transaction) -> Dict[str, int]:
+        # O array só vem (e pesa) em documentos que ainda não foram convertidos
+        snapshot = doc_ref.get(field_paths=[VERSION_FIELD, LEGACY_FIELD], transaction=transaction)
+        if not snapshot.exists:
+            raise google_exceptions.NotFound("Paciente não encontrado")
+        if not needs_conversion(snapshot.to_dict() or {}) and compact_enabled():
+            transaction.update(doc_ref, path_updates(paths))
+            return {"caminhos": len(paths), "migrado": 0}
+        
+        data = doc_ref.get(field_paths=[LEGACY_FIELD, COMPACT_FIELD, VERSION_FIELD], transaction=transaction).to_dict() or {}
+        transaction.update(doc_ref, _rewritten_fields(data, paths))
+        return {"caminhos": len(paths), "migrado": int(needs_conversion(data))}
+    
+    return run(get_firestore_client().transaction())
+
+def _stage_patch(writes, doc_ref, paths: Sequence[Tuple[Tuple[str, ...], Any]]) -> Dict[str, int]:
+    snapshot = doc_ref.get(field_paths=[VERSION_FIELD, LEGACY_FIELD])
+    if not snapshot.exists:
+        raise google_exceptions.NotFound("Paciente não encontrado")
+    if not needs_conversion(snapshot.to_dict() or {}) and compact_enabled():
+        writes.update(doc_ref, path_updates(paths))
+        return {"caminhos": len(paths), "migrado": 0}
+    
+    current = doc_ref.get(field_paths=[LEGACY_FIELD, COMPACT_FIELD, VERSION_FIELD])
+    data = current.to_dict() or {}
+    option = get_firestore_client().write_option(last_update_time=current.update_time)
+    writes.update(doc_ref, _rewritten_fields(data, paths), option=option)
+    return {"caminhos": len(paths), "migrado": int(needs_conversion(data))}
+
+def migrate_collection(collection, batch_size: int = 200) -> Dict[str, int]:
+    """Converte os odontogramas do tenant para o formato em uso
+
+    Com ODONTOGRAM_COMPACT_ENABLED, grava o compacto e remove o array; sem ele,
+    recria o array nos documentos compactados (o frontend lê desse campo).
+    Documentos com os dois campos ficam só com um.
+    """
+    db = get_firestore_client()
+    migrated = scanned = 0
+    batch = db.batch()
+    pending = 0
+    for doc in collection.select([LEGACY_FIELD, COMPACT_FIELD, VERSION_FIELD]).stream():
+        scanned += 1
+        data = doc.to_dict() or {}
+        if not needs_conversion(data):
+            continue
+        batch.update(doc.reference, replacement_fields(odontogram_from_doc(data)))
+        migrated += 1
+        pending += 1
+        if pending >= batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return {"pacientes": scanned, "migrados": migrated}
+
+def benchmark_odontogram(treatments_per_patient: int = 6) -> Dict[str, Any]:
+    """Compara o tamanho do odontograma e do payload de uma edição (antigo x compacto)
+
+    Rodar com: python -m app.services.odontogram
+    """
+    teeth = expand({})
+    for index in range(treatments_per_patient):
+        tooth = teeth[(index * 5) % len(teeth)]
+        tooth["tratamentos"].append({
+            "id": f"trat-{index}",
+            "procedimentoId": "rest_01",
+            "procedimentoNome": "Restauração em Resina Composta",
+            "status": "Planejado",
+            "valor": 180.0,
+            "dataPlanejamento": "2025-01-10"
+        })
+    teeth[3]["statusGeral"] = {"tipo": "Extraído", "substituidoPorProtese": False}
+    
+    def size(value: Any) -> int:
+        return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    
+    edit = [{"dente": teeth[0]["number"], "lista": "tratamentos", "id": "trat-0", "campos": {"status": "Executado"}}]
+    delta = path_updates(patch_paths(edit))
+    legacy_bytes, compact_bytes = size(teeth), size(compact(teeth))
+    return {
+        "documento_antigo_bytes": legacy_bytes,
+        "documento_compacto_bytes": compact_bytes,
+        "edicao_antiga_bytes": legacy_bytes,
+        "edicao_delta_bytes": size(delta),
+        "ida_e_volta_ok": expand(compact(teeth)) == teeth
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(benchmark_odontogram(), indent=2))
@@ -0,0 +1,438 @@
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from datetime import datetime
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from ..config import get_settings
+from ..integrations.whatsapp import WhatsAppIntegration
+from .metrics import count_retry, span
+from .rate_limiter import get_token_bucket
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Handler de envio: recebe o payload da mensagem e faz a chamada à Evolution API
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT UNIQUE,
+    recipient TEXT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbound_status_next
+    ON outbound_messages (status, next_attempt_at);
+"""
+
+# Mensagens de um destinatário saem na ordem em que entraram: só a mais antiga
+# ainda não finalizada (pendente, em backoff ou em envio) pode ser pega. Os
+# lembretes em lote vão por último, para não atrasar as respostas das conversas
+_CLAIM_QUERY = """
+SELECT id, kind, payload, attempts FROM outbound_messages AS m
+WHERE status = 'pending' AND next_attempt_at <= ?
+  AND NOT EXISTS (
+      SELECT 1 FROM outbound_messages AS earlier
+      WHERE earlier.recipient = m.recipient AND earlier.id < m.id
+        AND earlier.status IN ('pending', 'processing')
+  )
+ORDER BY kind = 'reminder', id LIMIT ?
+"""
+
+def _recipient(payload: Dict[str, Any]) -> Optional[str]:
+    digits = "".join(ch for ch in str(payload.get("to") or "") if ch.isdigit())
+    return digits or None
+
+class OutboundQueue:
+    """Fila persistente (SQLite) de mensagens de saída do WhatsApp
+
+    Os produtores apenas gravam a mensagem e retornam; um grupo de consumidores
+    assíncronos drena a fila em lotes, repete falhas com backoff exponencial e
+    move para a dead-letter as mensagens que esgotaram as tentativas. Para um
+    mesmo destinatário, uma mensagem só é enviada depois que a anterior foi
+    finalizada. Enviadas e dead-letter antigas são apagadas periodicamente.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        workers: int = 4,
+        batch_size: int = 20,
+        max_attempts: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0,
+        poll_interval: float = 0.5,
+        retention_seconds: float = 86400,
+        dead_retention_seconds: float = 7 * 86400,
+        purge_interval: float = 3600
+    ):
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.dead_retention_seconds = dead_retention_seconds
+        self.purge_interval = purge_interval
+        self.handlers: Dict[str, Handler] = {}
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbound_messages)")}
+        if "recipient" not in columns:
+            # Filas criadas antes da ordenação por destinatário
+            self._conn.execute("ALTER TABLE outbound_messages ADD COLUMN recipient TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbound_recipient ON outbound_messages (recipient, status, id)"
+        )
+        self._db_lock = threading.Lock()
+        
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._draining = False
+        self._tasks: List[asyncio.Task] = []
+        self._purge_task: Optional[asyncio.Task] = None
+        self._sent_times: Deque[float] = deque(maxlen=10000)
+        self._sent_total = 0
+        self._failed_total = 0
+        self._dead_total = 0
+    
+    def register_handler(self, kind: str, handler: Handler) -> None:
+        """Associa um tipo de mensagem à função que faz o envio"""
+        self.handlers[kind] = handler
+    
+    # Operações no SQLite (síncronas, executadas fora do event loop)
+    
+    def _insert_row(self, now: float, kind: str, payload: Dict[str, Any], dedup_key: Optional[str]) -> int:
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO outbound_messages "
+            "(dedup_key, recipient, kind, payload, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (dedup_key, _recipient(payload), kind, json.dumps(payload, ensure_ascii=False, default=str), now, now, now)
+        )
+        if cursor.rowcount == 0:
+            # Mensagem duplicada: retorna o id da que já está na fila
+            row = self._conn.execute(
+                "SELECT id FROM outbound_messages WHERE dedup_key = ?", (dedup_key,)
+            ).fetchone()
+            return row[0]
+        return cursor.lastrowid
+    
+    def _insert(self, kind: str, payload: Dict[str, Any], dedup_key: Optional[str]) -> int:
+        with self._db_lock:
+            return self._insert_row(time.time(), kind, payload, dedup_key)
+    
+    def _insert_many(self, kind: str, items: List[Tuple[Dict[str, Any], Optional[str]]]) -> List[int]:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [self._insert_row(now, kind, payload, dedup_key) for payload, dedup_key in items]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+    
+    def _claim(self, limit: int) -> List[Tuple[int, str, Dict[str, Any], int]]:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(_CLAIM_QUERY, (now, limit)).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE outbound_messages SET status = 'processing', updated_at = ? WHERE id = ?",
+                        [(now, row[0]) for row in rows]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+    
+    def _finish(self, sent: List[int], failed: List[Tuple[int, int, str]]) -> int:
+        """Grava o resultado do lote e retorna quantas mensagens foram para a dead-letter"""
+        now = time.time()
+        dead = 0
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE outbound_messages SET status = 'sent', last_error = NULL, updated_at = ? WHERE id = ?",
+                    [(now, message_id) for message_id in sent]
+                )
+                for message_id, attempts, error in failed:
+                    if attempts >= self.max_attempts:
+                        dead += 1
+                        self._conn.execute(
+                            "UPDATE outbound_messages SET status = 'dead', attempts = ?, last_error = ?, "
+                            "updated_at = ? WHERE id = ?",
+                            (attempts, error, now, message_id)
+                        )
+                    else:
+                        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempts)))
+                        self._conn.execute(
+                            "UPDATE outbound_messages SET status = 'pending', attempts = ?, last_error = ?, "
+                            "next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                            (attempts, error, now + delay, now, message_id)
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dead
+    
+    def _recover(self) -> None:
+        """Devolve à fila as mensagens que estavam em processamento quando o processo caiu"""
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbound_messages SET status = 'pending' WHERE status = 'processing'"
+            )
+        self._purge()
+    
+    def _purge(self) -> int:
+        """Apaga enviadas e dead-letter mais antigas que a retenção (libera as chaves de dedup)"""
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbound_messages WHERE (status = 'sent' AND updated_at < ?) "
+                "OR (status = 'dead' AND updated_at < ?)",
+                (now - self.retention_seconds, now - self.dead_retention_seconds)
+            )
+        return cursor.rowcount
+    
+    def _statuses(self, ids: List[int]) -> Dict[int, Tuple[str, int, Optional[str]]]:
+        statuses: Dict[int, Tuple[str, int, Optional[str]]] = {}
+        with self._db_lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT id, status, attempts, last_error FROM outbound_messages "
+                    f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                statuses.update({row[0]: (row[1], row[2], row[3]) for row in rows})
+        return statuses
+    
+    def _counts(self) -> Dict[str, int]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM outbound_messages GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+    
+    # API assíncrona
+    
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> int:
+        """Grava a mensagem na fila e retorna imediatamente o id"""
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo de mensagem não suportado: {kind}")
+        
+        message_id = await asyncio.to_thread(self._insert, kind, payload, dedup_key)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return message_id
+    
+    async def enqueue_many(self, kind: str, items: List[Tuple[Dict[str, Any], Optional[str]]]) -> List[int]:
+        """Grava várias mensagens (payload, dedup_key) em uma única transação"""
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo de mensagem não suportado: {kind}")
+        
+        message_ids = await asyncio.to_thread(self._insert_many, kind, items)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return message_ids
+    
+    async def statuses(self, message_ids: List[int]) -> Dict[int, Tuple[str, int, Optional[str]]]:
+        """Retorna (status, tentativas, último erro) das mensagens ainda guardadas na fila"""
+        return await asyncio.to_thread(self._statuses, message_ids)
+    
+    async def _process_batch(self, batch: List[Tuple[int, str, Dict[str, Any], int]]) -> None:
+        async def send(message_id: int, kind: str, payload: Dict[str, Any]) -> Optional[str]:
+            try:
+                with span("outbound_send", kind):
+                    await self.handlers[kind](payload)
+                return None
+            except Exception as e:
+                return str(e) or e.__class__.__name__
+        
+        errors = await asyncio.gather(*[send(message_id, kind, payload) for message_id, kind, payload, _ in batch])
+        
+        sent = [item[0] for item, error in zip(batch, errors) if error is None]
+        failed = [(item[0], item[3] + 1, error) for item, error in zip(batch, errors) if error is not None]
+        dead = await asyncio.to_thread(self._finish, sent, failed)
+        
+        now = time.monotonic()
+        self._sent_times.extend([now] * len(sent))
+        self._sent_total += len(sent)
+        self._failed_total += len(failed)
+        self._dead_total += dead
+        for message_id, attempts, error in failed:
+            count_retry("outbound_queue")
+            log.warning("Falha ao enviar mensagem", message_id=message_id, attempts=attempts, error=error)
+    
+    async def _consumer(self) -> None:
+        while not self._stopping or self._draining:
+            try:
+                batch = await asyncio.to_thread(self._claim, self.batch_size)
+                if not batch:
+                    if self._stopping:
+                        return
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Erro no consumidor da fila de saída", error=str(e))
+                await asyncio.sleep(self.poll_interval)
+    
+    async def _purger(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                removed = await asyncio.to_thread(self._purge)
+                if removed:
+                    log.info("Mensagens antigas removidas da fila de saída", removed=removed)
+            except Exception as e:
+                log.error("Erro ao limpar a fila de saída", error=str(e))
+    
+    async def start(self, recover: bool = True) -> None:
+        """Recupera mensagens pendentes e inicia os consumidores
+
+        Com vários processos usando o mesmo arquivo, só um deve recuperar
+        (recover=True): nos demais, "processing" pode ser um envio em andamento.
+        """
+        if self._tasks:
+            return
+        if recover:
+            await asyncio.to_thread(self._recover)
+        self._stopping = False
+        self._draining = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._consumer()) for _ in range(self.workers)]
+        self._purge_task = asyncio.create_task(self._purger())
+    
+    async def stop(self, timeout: float = 10.0, drain: bool = False) -> None:
+        """Para os consumidores, aguardando o lote em andamento
+
+        Com drain=True, antes envia o que já está pronto na fila (ex.: respostas
+        dos últimos turnos no desligamento); o que estiver em backoff fica para
+        o próximo início.
+        """
+        self._stopping = True
+        self._draining = drain
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._tasks = []
+    
+    async def metrics(self) -> Dict[str, Any]:
+        """Retorna profundidade da fila e taxa de envio"""
+        counts = await asyncio.to_thread(self._counts)
+        window = 60.0
+        now = time.monotonic()
+        recent = sum(1 for sent_at in self._sent_times if now - sent_at <= window)
+        return {
+            "depth": counts.get("pending", 0) + counts.get("processing", 0),
+            "pending": counts.get("pending", 0),
+            "processing": counts.get("processing", 0),
+            "dead_letter": counts.get("dead", 0),
+            "sent_total": self._sent_total,
+            "failed_attempts_total": self._failed_total,
+            "dead_total": self._dead_total,
+            "drain_rate_per_second": round(recent / window, 3),
+            "workers": len(self._tasks),
+            "timestamp": datetime.now().isoformat()
+        }
+
+def _register_whatsapp_handlers(queue: OutboundQueue, whatsapp: Optional[WhatsAppIntegration] = None) -> None:
+    """Registra os tipos de mensagem enviados pela WhatsAppIntegration"""
+    settings = get_settings()
+    
+    def get_whatsapp() -> WhatsAppIntegration:
+        nonlocal whatsapp
+        if whatsapp is None:
+            # Um 5xx volta como falha do lote e é repetido com o backoff da fila
+            whatsapp = WhatsAppIntegration(retry_server_errors=False)
+        return whatsapp
+    
+    async def send_text(payload: Dict[str, Any]) -> Any:
+        return await get_whatsapp().send_message(to=payload["to"], message=payload["message"])
+    
+    async def send_reminder(payload: Dict[str, Any]) -> Any:
+        # Lembretes saem em massa: ritmo limitado por instância da Evolution
+        client = get_whatsapp()
+        await get_token_bucket(
+            client.instance_name,
+            rate=settings.reminder_rate_per_second,
+            capacity=settings.reminder_burst
+        ).acquire()
+        return await client.send_reminder(
+            to=payload["to"],
+            patient_name=payload["patient_name"],
+            date=datetime.fromisoformat(payload["date"]),
+            procedure=payload["procedure"]
+        )
+    
+    async def send_payment_confirmation(payload: Dict[str, Any]) -> Any:
+        return await get_whatsapp().send_payment_confirmation(
+            to=payload["to"],
+            patient_name=payload["patient_name"],
+            amount=payload["amount"],
+            date=datetime.fromisoformat(payload["date"])
+        )
+    
+    queue.register_handler("text", send_text)
+    queue.register_handler("reminder", send_reminder)
+    queue.register_handler("payment_confirmation", send_payment_confirmation)
+
+_queue: Optional[OutboundQueue] = None
+
+def get_outbound_queue() -> OutboundQueue:
+    """Retorna a fila de saída do processo"""
+    global _queue
+    
+    if _queue is None:
+        settings = get_settings()
+        _queue = OutboundQueue(
+            path=settings.outbound_queue_path,
+            workers=settings.outbound_queue_workers,
+            batch_size=settings.outbound_queue_batch_size,
+            max_attempts=settings.outbound_queue_max_attempts,
+            backoff_base=settings.outbound_queue_backoff_base,
+            backoff_max=settings.outbound_queue_backoff_max
+        )
+        _register_whatsapp_handlers(_queue)
+    return _queue
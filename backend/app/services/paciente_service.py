@@ -0,0 +1,17 @@
+from typing import Any, Dict, Optional
+from ..config import get_settings
+from .phone_index import get_phone_index
+
+class PacienteService:
+    def __init__(self, app_id: Optional[str] = None, user_id: Optional[str] = None):
+        settings = get_settings()
+        # Tenant padrão do número de WhatsApp da clínica
+        self.app_id = app_id or settings.whatsapp_app_id
+        self.user_id = user_id or settings.whatsapp_user_id
+    
+    async def get_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Busca um paciente pelo telefone (aceita número livre ou JID do WhatsApp)"""
+        if not self.app_id or not self.user_id:
+            raise ValueError("WHATSAPP_APP_ID/WHATSAPP_USER_ID não configurados no ambiente")
+        
+        return await get_phone_index(self.app_id, self.user_id).lookup(phone)
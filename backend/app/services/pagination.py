@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import base64
+import hashlib
+import json
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from .lazy_import import lazy_import
+
+firestore_v1 = lazy_import("google.cloud.firestore_v1")
+
+def collection_path(app_id: str, user_id: str, collection: str) -> str:
+    """Retorna o caminho da coleção no Firestore"""
+    return f"artifacts/{app_id}/users/{user_id}/{collection}"
+
+def encode_cursor(doc_id: str) -> str:
+    """Cursor opaco para a próxima página (id do último documento retornado)"""
+    return base64.urlsafe_b64encode(doc_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def parse_fields(fields: Optional[str], default: Sequence[str]) -> List[str]:
+    """Campos da projeção (select) a partir do parâmetro "fields" separado por vírgulas"""
+    if not fields:
+        return list(default)
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+def fetch_page(
+    collection,
+    query,
+    order_by: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+    descending: bool = False
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Busca uma página ordenada com paginação por cursor e projeção de campos
+
+    Lê apenas limit + 1 documentos (o extra indica se há próxima página), de
+    forma que o custo da página não depende do tamanho da coleção.
+    """
+    direction = firestore_v1.Query.DESCENDING if descending else firestore_v1.Query.ASCENDING
+    query = query.order_by(order_by, direction=direction)
+    if fields:
+        # A projeção precisa incluir o campo de ordenação para o cursor funcionar
+        query = query.select(sorted(set(fields) | {order_by}))
+    
+    if cursor:
+        snapshot = collection.document(decode_cursor(cursor)).get(field_paths=[order_by])
+        if not snapshot.exists:
+            raise HTTPException(status_code=400, detail="Cursor expirado")
+        query = query.start_after(snapshot)
+    
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    
+    items = []
+    for doc in docs:
+        data = doc.to_dict() or {}
+        if fields and order_by not in fields:
+            data.pop(order_by, None)
+        items.append({"id": doc.id, **data})
+    
+    next_cursor = encode_cursor(docs[-1].id) if has_more and docs else None
+    return items, next_cursor
+
+def etag_response(request: Request, content: Any) -> Response:
+    """Responde com ETag e devolve 304 quando o cliente já tem a mesma versão"""
+    encoded = jsonable_encoder(content)
+    body = json.dumps(encoded, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    etag = 'W/"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [value.strip() for value in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=encoded, headers=headers)
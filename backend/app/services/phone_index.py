@@ -0,0 +1,268 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import threading
+from .firebase_client import get_firestore_client
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Campos do paciente mantidos em memória no índice (sem odontograma/anamnese)
+INDEXED_FIELDS = ("nome", "telefone", "cpf")
+# Campos lidos pelo listener: os indexados e o telefone já normalizado (backfill)
+LISTENER_FIELDS = [*INDEXED_FIELDS, "telefoneE164"]
+
+def normalize_phone(raw: Optional[str], default_country: str = "55") -> Optional[str]:
+    """Normaliza um telefone livre ou JID do WhatsApp para E.164 (+5511987654321)"""
+    if not raw:
+        return None
+    
+    # JIDs chegam como "5511987654321@s.whatsapp.net" ou "5511987654321:12@s.whatsapp.net"
+    number = str(raw).split("@")[0].split(":")[0]
+    digits = "".join(ch for ch in number if ch.isdigit())
+    
+    if digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith("0"):
+        # Prefixo de operadora/tronco nacional (ex.: 011 ou 0xx11)
+        digits = digits.lstrip("0")
+    
+    if len(digits) in (10, 11):
+        digits = default_country + digits
+    
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+def phone_lookup_keys(e164: str) -> List[str]:
+    """Retorna as variantes equivalentes do número (com e sem o nono dígito no Brasil)"""
+    keys = [e164]
+    digits = e164[1:]
+    if digits.startswith("55"):
+        if len(digits) == 13 and digits[4] == "9":
+            keys.append("+" + digits[:4] + digits[5:])
+        elif len(digits) == 12 and digits[4] in "6789":
+            keys.append("+" + digits[:4] + "9" + digits[4:])
+    return keys
+
+class PhoneIndex:
+    """Índice em memória telefone (E.164) -> pacientes de um tenant
+
+    Um número pode pertencer a mais de um paciente (ex.: pais e filhos com o
+    mesmo WhatsApp); get_all/lookup_all retornam todos. É alimentado por um
+    listener do Firestore na coleção de pacientes, que mantém o índice
+    atualizado e grava o campo normalizado `telefoneE164` nos documentos que
+    ainda não o possuem.
+    """
+    
+    def __init__(self, app_id: str, user_id: str, default_country: str = "55"):
+        self.app_id = app_id
+        self.user_id = user_id
+        self.default_country = default_country
+        # telefone -> {id do paciente -> registro}
+        self._by_phone: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._keys_by_id: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+    
+    @property
+    def collection_path(self) -> str:
+        return f"artifacts/{self.app_id}/users/{self.user_id}/pacientes"
+    
+    def _remove(self, paciente_id: str) -> None:
+        for key in self._keys_by_id.pop(paciente_id, ()):
+            entries = self._by_phone.get(key)
+            if entries is not None:
+                entries.pop(paciente_id, None)
+                if not entries:
+                    del self._by_phone[key]
+    
+    def _add(self, paciente_id: str, data: Dict[str, Any]) -> Optional[str]:
+        """Indexa o paciente e retorna o telefone normalizado"""
+        e164 = normalize_phone(data.get("telefone"), self.default_country)
+        if not e164:
+            return None
+        
+        entry = {"id": paciente_id, "telefoneE164": e164}
+        entry.update({field: data.get(field) for field in INDEXED_FIELDS})
+        keys = set(phone_lookup_keys(e164))
+        for key in keys:
+            self._by_phone.setdefault(key, {})[paciente_id] = entry
+        self._keys_by_id[paciente_id] = keys
+        return e164
+    
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        backfill: List[Tuple[Any, str]] = []
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                self._remove(doc.id)
+                if change.type.name == "REMOVED":
+                    continue
+                
+                data = doc.to_dict() or {}
+                e164 = self._add(doc.id, data)
+                if e164 and data.get("telefoneE164") != e164:
+                    backfill.append((doc.reference, e164))
+        self._ready.set()
+        
+        if backfill:
+            self._backfill(backfill)
+    
+    def _backfill(self, updates: List[Tuple[Any, str]]) -> None:
+        """Grava o telefone normalizado nos documentos (lotes de até 500 escritas)"""
+        db = get_firestore_client()
+        for start in range(0, len(updates), 500):
+            batch = db.batch()
+            for reference, e164 in updates[start:start + 500]:
+                batch.update(reference, {"telefoneE164": e164})
+            try:
+                batch.commit()
+            except Exception as e:
+                log.error("Erro ao gravar telefoneE164", error=str(e))
+    
+    def start(self) -> None:
+        """Inicia o listener de pacientes (idempotente)"""
+        if self._watch is None:
+            # Só os campos do índice: sem baixar odontograma, anamnese etc. de cada paciente
+            query = get_firestore_client().collection(self.collection_path).select(LISTENER_FIELDS)
+            self._watch = query.on_snapshot(self._on_snapshot)
+    
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self._ready.clear()
+    
+    def _query_firestore(self, keys: List[str]) -> List[Dict[str, Any]]:
+        """Consulta direta pelo campo indexado, usada enquanto o cache carrega"""
+        collection = get_firestore_client().collection(self.collection_path)
+        entries = []
+        for doc in collection.where("telefoneE164", "in", keys).select(LISTENER_FIELDS).stream():
+            data = doc.to_dict() or {}
+            entry = {"id": doc.id, "telefoneE164": data.get("telefoneE164")}
+            entry.update({field: data.get(field) for field in INDEXED_FIELDS})
+            entries.append(entry)
+        return entries
+    
+    def get_all(self, phone: str) -> List[Dict[str, Any]]:
+        """Busca os pacientes com o telefone (O(1) após o carregamento inicial)"""
+        e164 = normalize_phone(phone, self.default_country)
+        if not e164:
+            return []
+        
+        keys = phone_lookup_keys(e164)
+        if not self._ready.is_set():
+            return self._query_firestore(keys)
+        
+        found: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for key in keys:
+                for paciente_id, entry in self._by_phone.get(key, {}).items():
+                    found.setdefault(paciente_id, dict(entry))
+        return list(found.values())
+    
+    def get(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Busca um paciente pelo telefone (com o número compartilhado, o primeiro encontrado)"""
+        entries = self.get_all(phone)
+        return entries[0] if entries else None
+    
+    async def lookup_all(self, phone: str) -> List[Dict[str, Any]]:
+        """Versão assíncrona de get_all (sem bloquear o event loop no carregamento inicial)"""
+        if self._ready.is_set():
+            return self.get_all(phone)
+        return await asyncio.to_thread(self.get_all, phone)
+    
+    async def lookup(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Versão assíncrona de get"""
+        entries = await self.lookup_all(phone)
+        return entries[0] if entries else None
+    
+    def __len__(self) -> int:
+        return len(self._keys_by_id)
+
+_indexes: Dict[Tuple[str, str], PhoneIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_phone_index(app_id: str, user_id: str) -> PhoneIndex:
+    """Retorna o índice de telefones do tenant, iniciando o listener na primeira chamada"""
+    key = (app_id, user_id)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = PhoneIndex(app_id, user_id)
+            index.start()
+            _indexes[key] = index
+        return index
+
+def benchmark_lookup(patients: int = 50_000, lookups: int = 10_000, seed: int = 7) -> Dict[str, Any]:
+    """Mede a busca por telefone com 50 mil pacientes em memória
+
+    O índice é carregado com um snapshot sintético (sem Firestore) e comparado
+    com a varredura da lista de pacientes normalizando cada telefone, que é o
+    que uma busca sem índice faz depois de baixar a coleção. Os números
+    buscados vêm no formato do WhatsApp (JID, parte sem o nono dígito).
+    Rodar com: python -m app.services.phone_index
+    """
+    import random
+    import time
+    from types import SimpleNamespace
+    
+    rng = random.Random(seed)
+    records = []
+    for index in range(patients):
+        local = f"119{rng.randrange(10**7, 10**8)}"
+        records.append((f"p{index}", {
+            "nome": f"Paciente {index}",
+            "telefone": f"({local[:2]}) {local[2:7]}-{local[7:]}",
+            "cpf": None,
+            "telefoneE164": "+55" + local
+        }))
+    changes = [
+        SimpleNamespace(
+            type=SimpleNamespace(name="ADDED"),
+            document=SimpleNamespace(id=paciente_id, reference=None, to_dict=lambda data=data: data)
+        )
+        for paciente_id, data in records
+    ]
+    queries = []
+    for _ in range(lookups):
+        digits = rng.choice(records)[1]["telefoneE164"][1:]
+        queries.append(f"{digits[:4]}{digits[5:]}@s.whatsapp.net" if rng.random() < 0.3 else f"{digits}@s.whatsapp.net")
+    
+    index = PhoneIndex("benchmark", "benchmark")
+    started_at = time.perf_counter()
+    index._on_snapshot(None, changes, None)
+    build_s = time.perf_counter() - started_at
+    
+    started_at = time.perf_counter()
+    found = sum(1 for phone in queries if index.get(phone) is not None)
+    index_s = time.perf_counter() - started_at
+    
+    def scan(phone: str) -> Optional[str]:
+        keys = set(phone_lookup_keys(normalize_phone(phone) or ""))
+        for paciente_id, data in records:
+            if normalize_phone(data["telefone"]) in keys:
+                return paciente_id
+        return None
+    
+    scanned = queries[:max(1, lookups // 500)]
+    started_at = time.perf_counter()
+    for phone in scanned:
+        scan(phone)
+    scan_s = time.perf_counter() - started_at
+    
+    return {
+        "patients": patients,
+        "lookups": lookups,
+        "found": found,
+        "index_build_ms": round(build_s * 1000, 1),
+        "index_lookup_us": round(index_s / lookups * 1e6, 2),
+        "scan_lookup_us": round(scan_s / len(scanned) * 1e6, 1),
+        "speedup": round((scan_s / len(scanned)) / (index_s / lookups)) if index_s else None
+    }
+
+if __name__ == "__main__":
+    import json
+    
+    print(json.dumps(benchmark_lookup(), indent=2))
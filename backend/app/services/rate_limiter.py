@@ -0,0 +1,43 @@
+from typing import Dict, Tuple
+import asyncio
+import time
+
+class TokenBucket:
+    """Limitador de taxa (token bucket) para uso em corrotinas"""
+    
+    def __init__(self, rate: float, capacity: int):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate e capacity devem ser positivos")
+        
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    async def acquire(self, tokens: float = 1) -> None:
+        """Aguarda até que haja tokens disponíveis e os consome"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+# Um bucket por chave (ex.: instância da Evolution) compartilhado por todo o processo
+_buckets: Dict[Tuple[str, float, int], TokenBucket] = {}
+
+def get_token_bucket(key: str, rate: float, capacity: int) -> TokenBucket:
+    """Retorna o bucket associado à chave, criando-o se necessário"""
+    bucket_key = (key, rate, capacity)
+    bucket = _buckets.get(bucket_key)
+    if bucket is None:
+        bucket = TokenBucket(rate=rate, capacity=capacity)
+        _buckets[bucket_key] = bucket
+    return bucket
@@ -0,0 +1,303 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import asyncio
+import uuid
+from ..config import get_settings
+from ..integrations.whatsapp import WhatsAppIntegration
+from ..models.reminder import Reminder, ReminderJobStatus, ReminderResult
+from .firebase_client import get_firestore_client
+from .agenda_index import clinic_timezone, parse_event_datetime, to_utc_iso
+from .firestore_async import run_firestore
+from .outbound_queue import OutboundQueue, get_outbound_queue
+from .phone_index import normalize_phone
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Eventos que não geram lembrete para o paciente
+IGNORED_EVENT_TYPES = {"Horário Bloqueado", "Reunião", "Evento Geral"}
+IGNORED_EVENT_STATUS = {"Cancelado", "Concluído", "Não Compareceu"}
+
+# Quantidade de jobs finalizados mantidos em memória para consulta
+MAX_TRACKED_JOBS = 100
+
+def _count(job: ReminderJobStatus) -> None:
+    """Recalcula os totais do job a partir do resultado de cada lembrete"""
+    job.queued = sum(1 for result in job.results if result.status == "queued")
+    job.sent = sum(1 for result in job.results if result.status == "sent")
+    job.failed = sum(1 for result in job.results if result.status == "failed")
+
+def _collection_path(app_id: str, user_id: str, collection: str) -> str:
+    """Retorna o caminho da coleção no Firestore"""
+    return f"artifacts/{app_id}/users/{user_id}/{collection}"
+
+def load_reminders(app_id: str, user_id: str, day: date) -> Tuple[List[Reminder], List[ReminderResult]]:
+    """Lê os agendamentos do dia e junta com o telefone dos pacientes
+
+    O dia é o da clínica (CLINIC_TIMEZONE): o frontend grava startDateTime em
+    UTC, então a janela consultada é meia-noite a meia-noite no fuso da
+    clínica convertida para UTC, e o horário do lembrete volta para o fuso da
+    clínica. Retorna os lembretes a enviar e os eventos ignorados por falta de
+    telefone.
+    """
+    db = get_firestore_client()
+    tz = clinic_timezone()
+    start = to_utc_iso(datetime.combine(day, datetime.min.time(), tz))
+    end = to_utc_iso(datetime.combine(day + timedelta(days=1), datetime.min.time(), tz))
+    
+    events_ref = db.collection(_collection_path(app_id, user_id, "agendaEvents"))
+    events = [
+        (doc.id, doc.to_dict())
+        for doc in events_ref.where("startDateTime", ">=", start).where("startDateTime", "<", end).stream()
+    ]
+    events = [
+        (event_id, event) for event_id, event in events
+        if event.get("pacienteId")
+        and event.get("tipo") not in IGNORED_EVENT_TYPES
+        and event.get("status") not in IGNORED_EVENT_STATUS
+    ]
+    
+    # Busca todos os pacientes envolvidos em uma única chamada
+    patients_ref = db.collection(_collection_path(app_id, user_id, "pacientes"))
+    patient_ids = sorted({event["pacienteId"] for _, event in events})
+    patients: Dict[str, Dict[str, Any]] = {}
+    if patient_ids:
+        refs = [patients_ref.document(patient_id) for patient_id in patient_ids]
+        for doc in db.get_all(refs, field_paths=["nome", "telefone"]):
+            if doc.exists:
+                patients[doc.id] = doc.to_dict()
+    
+    reminders: List[Reminder] = []
+    skipped: List[ReminderResult] = []
+    for event_id, event in events:
+        patient = patients.get(event["pacienteId"], {})
+        e164 = normalize_phone(patient.get("telefone"))
+        if not e164:
+            skipped.append(ReminderResult(event_id=event_id, to="", status="skipped", error="Paciente sem telefone"))
+            continue
+        starts_at = parse_event_datetime(event.get("startDateTime"))
+        if starts_at is None:
+            skipped.append(ReminderResult(event_id=event_id, to=e164.lstrip("+"), status="skipped", error="Horário inválido"))
+            continue
+        
+        reminders.append(Reminder(
+            event_id=event_id,
+            paciente_id=event["pacienteId"],
+            patient_name=patient.get("nome") or event.get("pacienteNome") or "",
+            to=e164.lstrip("+"),
+            date=starts_at.astimezone(tz),
+            procedure=event.get("titulo") or event.get("tipo") or "Consulta"
+        ))
+    
+    return reminders, skipped
+
+def reminder_dedup_key(event_id: str, starts_at: datetime) -> str:
+    """Um lembrete por consulta e dia (reagendada para outro dia, gera outro lembrete)"""
+    return f"reminder:{event_id}:{starts_at.date().isoformat()}"
+
+def reminder_payload(reminder: Reminder) -> Dict[str, Any]:
+    """Payload da mensagem "reminder" da fila de saída"""
+    return {
+        "to": reminder.to,
+        "patient_name": reminder.patient_name,
+        "date": reminder.date.isoformat(),
+        "procedure": reminder.procedure
+    }
+
+# Status da fila de saída -> status do lembrete no job
+_QUEUE_STATUS = {"pending": "queued", "processing": "queued", "sent": "sent", "dead": "failed"}
+
+class ReminderDispatcher:
+    """Coloca os lembretes do dia na fila de saída e acompanha o envio
+
+    O envio em si fica com a fila: novas tentativas com backoff, ritmo por
+    instância da Evolution (REMINDER_RATE_PER_SECOND) e a chave de dedup por
+    consulta e dia, para que rodar o job de novo não duplique lembretes.
+    """
+    
+    def __init__(self, queue: Optional[OutboundQueue] = None):
+        self._queue = queue
+        self.jobs: Dict[str, ReminderJobStatus] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    @property
+    def queue(self) -> OutboundQueue:
+        return self._queue or get_outbound_queue()
+    
+    async def dispatch(self, job: ReminderJobStatus, reminders: List[Reminder]) -> None:
+        """Grava os lembretes na fila em uma única transação, registrando o id de cada um"""
+        results = [ReminderResult(event_id=reminder.event_id, to=reminder.to) for reminder in reminders]
+        job.results.extend(results)
+        try:
+            queue_ids = await self.queue.enqueue_many("reminder", [
+                (reminder_payload(reminder), reminder_dedup_key(reminder.event_id, reminder.date))
+                for reminder in reminders
+            ])
+        except Exception as e:
+            for result in results:
+                result.status = "failed"
+                result.error = str(e)
+            _count(job)
+            raise
+        
+        for result, queue_id in zip(results, queue_ids):
+            result.queue_id = queue_id
+            result.status = "queued"
+        _count(job)
+    
+    async def refresh(self, job: ReminderJobStatus) -> ReminderJobStatus:
+        """Atualiza o resultado dos lembretes ainda na fila (enviado ou falhou de vez)"""
+        pending = [result for result in job.results if result.status == "queued" and result.queue_id is not None]
+        if not pending:
+            return job
+        statuses = await self.queue.statuses([result.queue_id for result in pending])
+        for result in pending:
+            # Ausente: já removido pela retenção da fila; fica o último status conhecido
+            if result.queue_id in statuses:
+                status, attempts, error = statuses[result.queue_id]
+                result.status = _QUEUE_STATUS.get(status, result.status)
+                result.attempts = attempts
+                result.error = error
+        _count(job)
+        return job
+    
+    async def run(self, job: ReminderJobStatus) -> ReminderJobStatus:
+        """Carrega os agendamentos do dia e dispara os lembretes"""
+        job.status = "running"
+        job.started_at = datetime.now()
+        try:
+            day = date.fromisoformat(job.date)
+            # A leitura do Firestore é síncrona, então roda fora do event loop
+            reminders, skipped = await run_firestore(load_reminders, job.app_id, job.user_id, day)
+            
+            job.total = len(reminders) + len(skipped)
+            job.skipped = len(skipped)
+            job.results.extend(skipped)
+            
+            await self.dispatch(job, reminders)
+            job.status = "completed"
+        except Exception as e:
+            log.error("Erro ao enviar lembretes em lote", error=str(e))
+            job.status = "error"
+        finally:
+            job.finished_at = datetime.now()
+        
+        return job
+    
+    def start(self, app_id: str, user_id: str, day: Optional[date] = None) -> ReminderJobStatus:
+        """Agenda o envio em segundo plano e retorna o job para acompanhamento"""
+        day = day or (datetime.now(clinic_timezone()).date() + timedelta(days=1))
+        job = ReminderJobStatus(
+            job_id=uuid.uuid4().hex,
+            app_id=app_id,
+            user_id=user_id,
+            date=day.isoformat()
+        )
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > MAX_TRACKED_JOBS:
+            self.jobs.pop(next(iter(self.jobs)))
+        
+        task = asyncio.create_task(self.run(job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        return job
+    
+    async def get_job(self, job_id: str) -> Optional[ReminderJobStatus]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return await self.refresh(job)
+
+_dispatcher: Optional[ReminderDispatcher] = None
+
+def get_reminder_dispatcher() -> ReminderDispatcher:
+    """Retorna o dispatcher de lembretes do processo"""
+    global _dispatcher
+    
+    if _dispatcher is None:
+        _dispatcher = ReminderDispatcher()
+    return _dispatcher
+
+async def benchmark_dispatch(reminders: int = 2000, latency_ms: float = 50.0) -> Dict[str, Any]:
+    """Mede o envio de 2.000 lembretes contra o EvolutionStub local
+
+    Usa as configurações padrão (fila de saída e REMINDER_RATE_PER_SECOND):
+    mede quanto o job leva para gravar os lembretes na fila e quanto a fila
+    leva para entregá-los. Rodar com: python -m app.services.reminder_dispatcher
+    """
+    import os
+    import tempfile
+    import time
+    from .evolution_stub import EvolutionStub
+    from .http_transport import close_http_transport
+    from .outbound_queue import _register_whatsapp_handlers
+    
+    settings = get_settings()
+    stub = EvolutionStub(latency_ms=latency_ms)
+    base_url = await stub.start()
+    os.environ["EVOLUTION_API_KEY"] = stub.api_key
+    whatsapp = WhatsAppIntegration(retry_server_errors=False)
+    whatsapp.base_url = base_url
+    whatsapp.instance_name = "benchmark"
+    
+    starts_at = datetime.now(clinic_timezone()).replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    items = [
+        Reminder(
+            event_id=f"e{index}",
+            paciente_id=f"p{index}",
+            patient_name=f"Paciente {index}",
+            to=f"55119{index:08d}",
+            date=starts_at + timedelta(minutes=15 * (index % 40)),
+            procedure="Limpeza"
+        )
+        for index in range(reminders)
+    ]
+    
+    with tempfile.TemporaryDirectory(prefix="reminders-") as data_dir:
+        queue = OutboundQueue(
+            path=os.path.join(data_dir, "outbound_queue.db"),
+            workers=settings.outbound_queue_workers,
+            batch_size=settings.outbound_queue_batch_size,
+            max_attempts=settings.outbound_queue_max_attempts,
+            backoff_base=settings.outbound_queue_backoff_base,
+            backoff_max=settings.outbound_queue_backoff_max
+        )
+        _register_whatsapp_handlers(queue, whatsapp)
+        dispatcher = ReminderDispatcher(queue=queue)
+        job = ReminderJobStatus(job_id="benchmark", app_id="benchmark", user_id="benchmark", date=starts_at.date().isoformat())
+        try:
+            await queue.start()
+            started_at = time.perf_counter()
+            await dispatcher.dispatch(job, items)
+            enqueue_s = time.perf_counter() - started_at
+            while (await queue.metrics())["depth"]:
+                await asyncio.sleep(0.05)
+            delivered_s = time.perf_counter() - started_at
+            
+            # Rodar o job de novo não gera lembretes duplicados
+            again = ReminderJobStatus(job_id="again", app_id="benchmark", user_id="benchmark", date=job.date)
+            await dispatcher.dispatch(again, items)
+            await dispatcher.refresh(job)
+            await dispatcher.refresh(again)
+        finally:
+            await queue.stop()
+            await close_http_transport()
+            await stub.stop()
+    
+    return {
+        "reminders": reminders,
+        "stub_latency_ms": latency_ms,
+        "rate_per_second": settings.reminder_rate_per_second,
+        "outbound_workers": settings.outbound_queue_workers,
+        "enqueue_s": round(enqueue_s, 3),
+        "delivered_s": round(delivered_s, 2),
+        "sent": job.sent,
+        "failed": job.failed,
+        "templates_received": stub.counts["sendTemplate"],
+        "rerun_duplicates": sum(1 for a, b in zip(job.results, again.results) if a.queue_id != b.queue_id)
+    }
+
+if __name__ == "__main__":
+    import json
+    
+    print(json.dumps(asyncio.run(benchmark_dispatch()), indent=2))
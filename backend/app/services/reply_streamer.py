@@ -0,0 +1,202 @@
+from typing import Any, Deque, Dict, List, Optional
+from collections import deque
+import asyncio
+import re
+import time
+from ..config import get_settings
+from ..integrations.whatsapp import WhatsAppIntegration
+from .metrics import span
+from .outbound_queue import get_outbound_queue
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Fim de frase seguido de espaço (ignora "1." de listas numeradas e números decimais)
+SENTENCE_END = re.compile(r"(?<!\d)[.!?…]+[\"')\]]*\s+")
+# Abreviações comuns que não encerram a frase
+ABBREVIATIONS = {"dr", "dra", "sr", "sra", "srta", "prof", "profa", "av", "n", "nº", "obs", "ex", "etc"}
+
+class SentenceChunker:
+    """Junta os tokens da LLM em trechos completos (parágrafos ou frases)
+
+    Um trecho só é liberado depois de ter pelo menos min_chars caracteres (para
+    não mandar mensagens de uma palavra) e nunca passa de max_chars.
+    """
+    
+    def __init__(self, min_chars: int = 60, max_chars: int = 600):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+    
+    def feed(self, text: str) -> List[str]:
+        """Adiciona tokens e retorna os trechos que ficaram completos"""
+        self._buffer += text
+        chunks = []
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return chunks
+            if chunk:
+                chunks.append(chunk)
+    
+    def flush(self) -> List[str]:
+        """Retorna o que sobrou no buffer (no fim da resposta)"""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+    
+    def split(self, text: str) -> List[str]:
+        """Divide um texto já completo nos mesmos trechos do streaming"""
+        return self.feed(text) + self.flush()
+    
+    def _cut(self, position: int) -> str:
+        chunk, self._buffer = self._buffer[:position], self._buffer[position:]
+        return chunk.strip()
+    
+    def _is_abbreviation(self, end: int) -> bool:
+        words = self._buffer[:end].split()
+        return bool(words) and words[-1].rstrip(".").lower() in ABBREVIATIONS
+    
+    def _next_chunk(self) -> Optional[str]:
+        buffer = self._buffer
+        paragraph = buffer.find("\n\n")
+        # O primeiro limite (fim de frase ou de parágrafo) libera o trecho
+        limit = min(paragraph if paragraph != -1 else len(buffer), self.max_chars)
+        for match in SENTENCE_END.finditer(buffer):
+            if match.end() > limit:
+                break
+            if match.end() >= self.min_chars and not self._is_abbreviation(match.start() + 1):
+                return self._cut(match.end())
+        if paragraph != -1 and paragraph <= self.max_chars:
+            return self._cut(paragraph + 2)
+        
+        if len(buffer) > self.max_chars:
+            space = buffer.rfind(" ", 0, self.max_chars)
+            return self._cut(space if space > 0 else self.max_chars)
+        return None
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+class ReplyStats:
+    """Tempo até a primeira mensagem (TTFM) e latência total das respostas, por modo"""
+    
+    def __init__(self, window: int = 1000):
+        self._samples: Dict[str, Dict[str, Deque[float]]] = {}
+        self._window = window
+        self._chunks: Dict[str, int] = {}
+        self._replies: Dict[str, int] = {}
+    
+    def record(self, mode: str, ttfm_ms: Optional[float], total_ms: float, chunks: int) -> None:
+        samples = self._samples.setdefault(mode, {
+            "ttfm": deque(maxlen=self._window),
+            "total": deque(maxlen=self._window)
+        })
+        if ttfm_ms is not None:
+            samples["ttfm"].append(ttfm_ms)
+        samples["total"].append(total_ms)
+        self._chunks[mode] = self._chunks.get(mode, 0) + chunks
+        self._replies[mode] = self._replies.get(mode, 0) + 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        result = {}
+        for mode, samples in self._samples.items():
+            ttfm, total = list(samples["ttfm"]), list(samples["total"])
+            result[mode] = {
+                "replies": self._replies[mode],
+                "chunks_per_reply": round(self._chunks[mode] / self._replies[mode], 2),
+                "ttfm_ms": {"p50": _percentile(ttfm, 0.5), "p95": _percentile(ttfm, 0.95)},
+                "total_ms": {"p50": _percentile(total, 0.5), "p95": _percentile(total, 0.95)}
+            }
+        return result
+
+_stats = ReplyStats()
+_whatsapp: Optional[WhatsAppIntegration] = None
+
+def get_reply_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+def record_buffered_reply(total_ms: float) -> None:
+    """Registra uma resposta enviada inteira (TTFM igual à latência total)"""
+    _stats.record("buffered", total_ms, total_ms, 1)
+
+def _get_whatsapp() -> WhatsAppIntegration:
+    global _whatsapp
+    if _whatsapp is None:
+        _whatsapp = WhatsAppIntegration()
+    return _whatsapp
+
+class StreamedReply:
+    """Envia a resposta ao paciente trecho a trecho, na ordem, com "digitando..."
+
+    Os trechos vão direto pela Evolution API (a fila de saída tem vários
+    consumidores e não garante ordem); se um envio falhar, o trecho e os
+    seguintes passam para a fila persistente, que faz as novas tentativas.
+    Uso:
+
+        async with StreamedReply(to, dedup_prefix=f"reply:{message_id}") as reply:
+            await agent.stream_dental_query(message, conversation_id=to, on_chunk=reply.send)
+    """
+    
+    def __init__(self, to: str, dedup_prefix: Optional[str] = None, started_at: Optional[float] = None):
+        settings = get_settings()
+        self.to = to
+        self.dedup_prefix = dedup_prefix
+        self.presence_interval = settings.whatsapp_presence_interval_seconds
+        self.started_at = started_at or time.perf_counter()
+        self.first_message_at: Optional[float] = None
+        self.chunks = 0
+        self._fallback = False
+        self._presence_task: Optional[asyncio.Task] = None
+    
+    async def __aenter__(self) -> "StreamedReply":
+        self._presence_task = asyncio.create_task(self._keep_composing())
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self._stop_composing()
+        total_ms = (time.perf_counter() - self.started_at) * 1000
+        ttfm_ms = (self.first_message_at - self.started_at) * 1000 if self.first_message_at else None
+        _stats.record("streaming", ttfm_ms, total_ms, self.chunks)
+    
+    async def _keep_composing(self) -> None:
+        """Renova o "digitando..." enquanto a resposta é gerada"""
+        delay_ms = int(self.presence_interval * 1000)
+        while True:
+            sent_at = time.monotonic()
+            try:
+                await _get_whatsapp().send_presence(self.to, "composing", delay_ms=delay_ms)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Erro ao enviar presença", to=self.to, error=str(e))
+                return
+            # Algumas versões da Evolution só respondem depois do delay da presença
+            await asyncio.sleep(max(0.0, self.presence_interval - (time.monotonic() - sent_at)))
+    
+    async def _stop_composing(self) -> None:
+        if self._presence_task is not None:
+            self._presence_task.cancel()
+            try:
+                await self._presence_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._presence_task = None
+    
+    async def send(self, chunk: str) -> None:
+        """Envia um trecho completo da resposta"""
+        self.chunks += 1
+        dedup_key = f"{self.dedup_prefix}:{self.chunks}" if self.dedup_prefix else None
+        if not self._fallback:
+            try:
+                with span("outbound_send", "stream"):
+                    await _get_whatsapp().send_message(to=self.to, message=chunk)
+            except Exception as e:
+                log.warning("Erro ao enviar trecho da resposta, usando a fila", to=self.to, error=str(e))
+                self._fallback = True
+        if self._fallback:
+            await get_outbound_queue().enqueue("text", {"to": self.to, "message": chunk}, dedup_key=dedup_key)
+        if self.first_message_at is None:
+            self.first_message_at = time.perf_counter()
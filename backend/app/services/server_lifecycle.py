@@ -0,0 +1,150 @@
+from typing import Any, Dict, IO, Optional
+import asyncio
+import importlib
+import os
+import time
+import httpx
+from ..config import get_settings
+from .firestore_async import run_firestore
+from .firebase_client import get_firestore_client
+from .http_transport import get_http_transport
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Estado do processo servidor. Com SERVER_MODE=prod o uvicorn sobe
+# SERVER_WORKERS processos, cada um com uma cópia deste estado: o lifespan
+# aquece os componentes (antes de o processo aceitar conexões ou em segundo
+# plano, conforme SERVER_WARMUP) e, no desligamento, drena os turnos do
+# agente que já foram recebidos.
+
+class ServerState:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.primary = False
+        self.ready = False
+        self.draining = False
+        self.warmup_ms: Dict[str, Optional[float]] = {}
+        self.drain_ms: Optional[float] = None
+        self._lock_file: Optional[IO[str]] = None
+    
+    def acquire_primary(self, path: str) -> bool:
+        """Tenta ser o processo principal (o que recupera as filas em SQLite)
+
+        O lock é de arquivo e dura enquanto o processo viver. Sem fcntl
+        (Windows), o processo é sempre o principal.
+        """
+        try:
+            import fcntl
+        except ImportError:
+            self.primary = True
+            return True
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handle = open(path, "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            self.primary = False
+            return False
+        self._lock_file = handle
+        self.primary = True
+        return True
+    
+    def release_primary(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+    
+    def stats(self) -> Dict[str, Any]:
+        settings = get_settings()
+        return {
+            "pid": self.pid,
+            "mode": settings.server_mode,
+            "workers": settings.server_workers,
+            "primary": self.primary,
+            "ready": self.ready,
+            "draining": self.draining,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "warmup_ms": dict(self.warmup_ms),
+            "drain_ms": self.drain_ms
+        }
+
+_state: Optional[ServerState] = None
+
+def get_server_state() -> ServerState:
+    global _state
+    if _state is None:
+        _state = ServerState()
+    return _state
+
+def _elapsed_ms(started_at: float) -> float:
+    return round((time.perf_counter() - started_at) * 1000, 1)
+
+def preload_shared_state() -> Dict[str, Optional[float]]:
+    """Monta o estado só de leitura compartilhado pelas requisições (síncrono)
+
+    Configurações, os módulos do agente e, para o tenant do WhatsApp, o
+    agente: cliente da LLM, prompt compilado e esquemas das ferramentas ficam
+    no cache do processo.
+    """
+    timings: Dict[str, Optional[float]] = {}
+    started_at = time.perf_counter()
+    settings = get_settings()
+    timings["settings"] = _elapsed_ms(started_at)
+    
+    # LangChain, OpenAI e ferramentas (importados sob demanda pelo app)
+    started_at = time.perf_counter()
+    importlib.import_module("..agents.dental_agent", __package__)
+    timings["imports"] = _elapsed_ms(started_at)
+    
+    if settings.whatsapp_app_id and settings.whatsapp_user_id:
+        from ..agents.agent_registry import get_agent_registry
+        started_at = time.perf_counter()
+        try:
+            get_agent_registry().get(settings.whatsapp_app_id, settings.whatsapp_user_id)
+            timings["agent"] = _elapsed_ms(started_at)
+        except Exception as e:
+            timings["agent"] = None
+            log.warning("Agente não pré-carregado", error=str(e))
+    return timings
+
+async def warm_up() -> Dict[str, Optional[float]]:
+    """Aquece estado e clientes compartilhados antes de o processo receber tráfego
+
+    Falhas são registradas e não impedem a inicialização: o componente é
+    criado na primeira requisição, como sem o aquecimento.
+    """
+    timings = await asyncio.to_thread(preload_shared_state)
+    
+    # Firestore: credenciais e canal gRPC criados na thread do pool
+    started_at = time.perf_counter()
+    try:
+        await run_firestore(get_firestore_client)
+        timings["firestore"] = _elapsed_ms(started_at)
+    except Exception as e:
+        timings["firestore"] = None
+        log.warning("Firestore não aquecido", error=str(e))
+    
+    # Evolution API: deixa uma conexão keep-alive aberta no pool
+    started_at = time.perf_counter()
+    try:
+        await get_http_transport().client.get(get_settings().evolution_api_url, timeout=2.0)
+        timings["evolution"] = _elapsed_ms(started_at)
+    except httpx.HTTPError as e:
+        timings["evolution"] = None
+        log.warning("Conexão com a Evolution API não aquecida", error=str(e))
+    
+    return timings
+
+async def run_warm_up(state: ServerState) -> None:
+    """Aquece e registra os tempos no estado do processo (GET /server/metrics)"""
+    started_at = time.perf_counter()
+    timings = await warm_up()
+    timings["total"] = _elapsed_ms(started_at)
+    state.warmup_ms = timings
+    log.info("Aquecimento concluído", pid=state.pid, warmup_ms=timings)
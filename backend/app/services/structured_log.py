@@ -0,0 +1,258 @@
+from typing import Any, Dict, Optional, TextIO
+import io
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from ..config import get_settings
+from .metrics import current_span
+
+# Logs do backend em JSON (uma linha por evento), gravados por uma thread
+# própria: quem loga só coloca o registro numa fila, sem escrever no stdout
+# dentro do event loop. Os campos são mascarados na thread de escrita.
+
+ROOT_LOGGER = "app"
+
+# Campos mascarados por nome (em qualquer nível dos dicionários registrados)
+PHONE_FIELDS = {"phone", "to", "from", "from_number", "number", "telefone", "telefoneE164", "user_phone", "remoteJid"}
+CPF_FIELDS = {"cpf"}
+BODY_FIELDS = {"message", "body", "text", "response", "reply", "content", "conversation", "mensagem"}
+
+# Telefones (10 a 15 dígitos, com ou sem +/JID) e CPFs dentro de textos livres
+PHONE_PATTERN = re.compile(r"\+?\b\d{10,15}\b(?:@[\w.]+)?")
+CPF_PATTERN = re.compile(r"\b\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b")
+
+def mask_phone(value: Any) -> str:
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    return f"***{digits[-4:]}" if len(digits) > 4 else "***"
+
+def _mask_text(text: str) -> str:
+    text = CPF_PATTERN.sub("***.***.***-**", text)
+    return PHONE_PATTERN.sub(lambda match: mask_phone(match.group(0)), text)
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """Mascara telefones, CPFs e conteúdo de mensagens (pelo nome do campo e no texto)"""
+    if key in PHONE_FIELDS and value is not None and not isinstance(value, (dict, list)):
+        return mask_phone(value)
+    if key in CPF_FIELDS and value:
+        return "***.***.***-**"
+    if key in BODY_FIELDS and isinstance(value, str):
+        return f"[{len(value)} caracteres]"
+    if isinstance(value, dict):
+        return {item_key: redact(item, item_key) for item_key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, key) for item in value]
+    if isinstance(value, str):
+        return _mask_text(value)
+    return value
+
+class JsonFormatter(logging.Formatter):
+    """Formata o registro como uma linha JSON (campos extras no nível de cima)"""
+    
+    def __init__(self, redaction: bool = True):
+        super().__init__()
+        self.redaction = redaction
+    
+    def format(self, record: logging.LogRecord) -> str:
+        # Campos do StructuredLogger ("message" etc. não podem ir direto no LogRecord)
+        fields = dict(getattr(record, "fields", None) or {})
+        event = record.getMessage()
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        if self.redaction:
+            event = _mask_text(event)
+            fields = redact(fields)
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": event,
+            **fields
+        }
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enfileira o registro sem formatar (a formatação roda na thread de escrita)"""
+    
+    def __init__(self, max_size: int):
+        # SimpleQueue (em C) é bem mais barata que queue.Queue; o limite é checado à parte
+        super().__init__(queue.SimpleQueue())
+        self.max_size = max_size
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.max_size:
+            # Sob carga extrema, descarta em vez de bloquear o event loop
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+class StructuredLogger:
+    """Logger com campos nomeados: log.info("Mensagem processada", message_id=..., to=...)"""
+    
+    def __init__(self, logger: logging.Logger, sample_rate: float):
+        self._logger = logger
+        self.sample_rate = sample_rate
+    
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: Any = None) -> None:
+        if self._logger.isEnabledFor(level):
+            # Cópia rasa: o registro é formatado depois, em outra thread
+            extra = dict(fields)
+            active = current_span()
+            if active is not None and active.trace_id:
+                extra.setdefault("trace_id", active.trace_id)
+            if exc_info:
+                exc_info = sys.exc_info()
+            # Sem Logger.log: evita procurar o arquivo/linha de origem na pilha a cada chamada
+            record = self._logger.makeRecord(self._logger.name, level, "", 0, event, (), exc_info, extra={"fields": extra})
+            self._logger.handle(record)
+    
+    def debug(self, event: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, fields)
+    
+    def info(self, event: str, **fields: Any) -> None:
+        self._log(logging.INFO, event, fields)
+    
+    def warning(self, event: str, **fields: Any) -> None:
+        self._log(logging.WARNING, event, fields)
+    
+    def error(self, event: str, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields)
+    
+    def exception(self, event: str, **fields: Any) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=True)
+    
+    def sampled(self, event: str, **fields: Any) -> None:
+        """Log verboso (ex.: payload completo) gravado só em LOG_PAYLOAD_SAMPLE_RATE dos casos"""
+        if self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate):
+            self._log(logging.INFO, event, {**fields, "sampled": True})
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[_QueueHandler] = None
+
+def setup_logging(stream: Optional[TextIO] = None) -> None:
+    """Configura o logger "app" com a fila e a thread de escrita (idempotente)"""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+        settings = get_settings()
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter(redaction=settings.log_redaction_enabled))
+        _handler = _QueueHandler(settings.log_queue_max_size)
+        _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+        _listener.start()
+        
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers = [_handler]
+        root.setLevel(settings.log_level.upper())
+        root.propagate = False
+
+def shutdown_logging() -> None:
+    """Grava o que está na fila e para a thread de escrita (no encerramento)"""
+    global _listener, _handler
+    with _lock:
+        listener, _listener = _listener, None
+        if _handler is not None:
+            logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+            _handler = None
+    if listener is not None:
+        listener.stop()
+
+def get_logger(name: str) -> StructuredLogger:
+    """Logger estruturado do módulo (use __name__, que fica sob o logger "app")"""
+    setup_logging()
+    return StructuredLogger(logging.getLogger(name), get_settings().log_payload_sample_rate)
+
+def get_log_stats() -> Dict[str, Any]:
+    with _lock:
+        handler = _handler
+    return {
+        "queued": handler.queue.qsize() if handler is not None else 0,
+        "dropped": handler.dropped if handler is not None else 0
+    }
+
+class _BenchmarkSink(io.TextIOBase):
+    """Saída do benchmark: descarta o texto, com uma espera opcional por escrita
+    (simula o stdout de um contêiner quando o coletor de logs está lento)"""
+    
+    def __init__(self, write_latency_ms: float = 0.0):
+        self.write_latency = write_latency_ms / 1000
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, text: str) -> int:
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        return len(text)
+
+def benchmark_logging(requests: int = 2000, write_latency_ms: float = 0.0) -> Dict[str, Any]:
+    """Custo por requisição, na thread do event loop, dos logs do webhook
+
+    "print" reproduz os prints síncronos que o webhook fazia (URL, payload,
+    superuser, paciente, resposta, envio); "structured" faz os logs que os
+    substituíram (payload amostrado + uma linha por mensagem).
+    """
+    payload = {
+        "from": "5511987654321",
+        "body": "Olá, gostaria de confirmar minha consulta de amanhã às 14h. Meu CPF é 123.456.789-09.",
+        "timestamp": "1716400000",
+        "id": "3EB0C431C26A1916E1A8"
+    }
+    reply = "Consulta de 23/05/2024 às 14:00 confirmada! Até lá." * 3
+    
+    original = sys.stdout
+    sys.stdout = _BenchmarkSink(write_latency_ms)
+    try:
+        started_at = time.perf_counter()
+        for _ in range(requests):
+            print("Webhook recebido em: http://localhost:8000/whatsapp/webhook")
+            print(f"Payload recebido: {payload}")
+            print(f"É superuser? {False}")
+            print(f"Paciente encontrado: {True}")
+            print(f"Resposta gerada: {reply}")
+            print("Resposta enfileirada para envio")
+        print_us = (time.perf_counter() - started_at) / requests * 1e6
+    finally:
+        sys.stdout = original
+    
+    shutdown_logging()
+    setup_logging(stream=_BenchmarkSink(write_latency_ms))
+    log = get_logger(f"{ROOT_LOGGER}.benchmark")
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        log.sampled("Payload recebido", payload=payload)
+        log.info(
+            "Mensagem do WhatsApp processada",
+            from_number=payload["from"],
+            is_superuser=False,
+            patient_found=True,
+            response=reply,
+            queued=True
+        )
+    structured_us = (time.perf_counter() - started_at) / requests * 1e6
+    stats = get_log_stats()
+    shutdown_logging()
+    
+    return {
+        "requests": requests,
+        "write_latency_ms": write_latency_ms,
+        "print_us_per_request": round(print_us, 2),
+        "structured_us_per_request": round(structured_us, 2),
+        "sample_rate": log.sample_rate,
+        "dropped": stats["dropped"]
+    }
+
+if __name__ == "__main__":
+    print(json.dumps([benchmark_logging(), benchmark_logging(write_latency_ms=0.2)], indent=2))
@@ -0,0 +1,301 @@
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from ..config import get_settings
+from .structured_log import get_logger
+
+log = get_logger(__name__)
+
+# Handler de processamento: recebe o payload persistido da mensagem recebida
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbound_messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    conversation_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_inbound_status ON inbound_messages (status, seq);
+"""
+
+class BackpressureError(Exception):
+    """Mensagem recusada porque a fila (global ou da conversa) está cheia"""
+    
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+def build_message_id(timestamp: Any, *parts: Any) -> str:
+    """Gera um id para mensagens que chegam sem o id da Evolution
+
+    Com o timestamp da mensagem, o id é determinístico e a reentrega do mesmo
+    webhook é descartada. Sem timestamp não dá para distinguir uma reentrega
+    de uma nova mensagem com o mesmo texto ("ok" duas vezes), então o id leva
+    a hora de chegada e um nonce, e nenhuma mensagem é descartada.
+    """
+    if timestamp in (None, ""):
+        timestamp = f"recebida:{time.time():.6f}:{uuid.uuid4().hex}"
+    raw = "|".join(str(part) for part in (timestamp, *parts))
+    return "sha1:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class WebhookIngestor:
+    """Ingestão assíncrona dos webhooks do WhatsApp
+
+    A mensagem é validada, persistida (idempotente pelo id da Evolution) e o
+    webhook responde na hora. Um pool de workers processa as mensagens em
+    segundo plano, uma por vez por conversa (preservando a ordem) e alternando
+    entre conversas, para que um número muito ativo não atrase os demais.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        workers: int = 8,
+        max_pending: int = 1000,
+        max_per_conversation: int = 20,
+        retention_seconds: float = 86400,
+        purge_interval: float = 3600
+    ):
+        self.path = path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_per_conversation = max_per_conversation
+        self.retention_seconds = retention_seconds
+        self.purge_interval = purge_interval
+        self.handlers: Dict[str, Handler] = {}
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        
+        # Fila por conversa + fila circular de conversas prontas para processar
+        self._conversations: Dict[str, Deque[Tuple[str, str, Dict[str, Any]]]] = {}
+        self._scheduled: Set[str] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._pending = 0
+        self._tasks: List[asyncio.Task] = []
+        self._purge_task: Optional[asyncio.Task] = None
+        self._processed_total = 0
+        self._failed_total = 0
+        self._duplicates_total = 0
+        self._rejected_total = 0
+    
+    def register_handler(self, source: str, handler: Handler) -> None:
+        """Associa uma origem de webhook à função que processa a mensagem"""
+        self.handlers[source] = handler
+    
+    # Operações no SQLite (síncronas, executadas fora do event loop)
+    
+    def _insert(self, message_id: str, source: str, conversation_key: str, payload: Dict[str, Any]) -> bool:
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO inbound_messages "
+                "(message_id, source, conversation_key, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (message_id, source, conversation_key, json.dumps(payload, ensure_ascii=False, default=str), now, now)
+            )
+            return cursor.rowcount == 1
+    
+    def _mark(self, message_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE inbound_messages SET status = ?, error = ?, updated_at = ? WHERE message_id = ?",
+                (status, error, time.time(), message_id)
+            )
+    
+    def _purge(self) -> int:
+        """Apaga as mensagens já processadas mais antigas que a retenção"""
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "DELETE FROM inbound_messages WHERE status != 'pending' AND updated_at < ?",
+                (time.time() - self.retention_seconds,)
+            )
+        return cursor.rowcount
+    
+    def _load_pending(self) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+        """Carrega as mensagens não processadas (ex.: após uma queda do processo)"""
+        self._purge()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT message_id, source, conversation_key, payload FROM inbound_messages "
+                "WHERE status = 'pending' ORDER BY seq"
+            ).fetchall()
+        return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+    
+    # Agendamento em memória
+    
+    def _schedule(self, message_id: str, source: str, conversation_key: str, payload: Dict[str, Any]) -> None:
+        self._conversations.setdefault(conversation_key, deque()).append((message_id, source, payload))
+        self._pending += 1
+        self._idle.clear()
+        if conversation_key not in self._scheduled:
+            self._scheduled.add(conversation_key)
+            self._ready.put_nowait(conversation_key)
+    
+    async def ingest(
+        self,
+        source: str,
+        message_id: str,
+        conversation_key: str,
+        payload: Dict[str, Any]
+    ) -> bool:
+        """Persiste a mensagem e agenda o processamento
+
+        Retorna False se a mensagem já tinha sido recebida (reentrega da Evolution).
+        """
+        if source not in self.handlers:
+            raise ValueError(f"Origem de webhook não suportada: {source}")
+        if self._ready is None:
+            raise RuntimeError("Ingestão de webhooks não iniciada")
+        
+        if self._pending >= self.max_pending:
+            self._rejected_total += 1
+            raise BackpressureError("Fila de mensagens recebidas cheia", status_code=503)
+        if len(self._conversations.get(conversation_key, ())) >= self.max_per_conversation:
+            self._rejected_total += 1
+            raise BackpressureError("Muitas mensagens pendentes para esta conversa", status_code=429)
+        
+        inserted = await asyncio.to_thread(self._insert, message_id, source, conversation_key, payload)
+        if not inserted:
+            self._duplicates_total += 1
+            return False
+        
+        self._schedule(message_id, source, conversation_key, payload)
+        return True
+    
+    async def _worker(self) -> None:
+        while True:
+            conversation_key = await self._ready.get()
+            if conversation_key is None:
+                return
+            
+            messages = self._conversations[conversation_key]
+            message_id, source, payload = messages.popleft()
+            try:
+                await self.handlers[source](payload)
+                await asyncio.to_thread(self._mark, message_id, "done")
+                self._processed_total += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Erro ao processar mensagem recebida", message_id=message_id, error=str(e))
+                await asyncio.to_thread(self._mark, message_id, "failed", str(e))
+                self._failed_total += 1
+            finally:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.set()
+            
+            # Volta a conversa para o fim da fila se ainda houver mensagens dela
+            if messages:
+                self._ready.put_nowait(conversation_key)
+            else:
+                del self._conversations[conversation_key]
+                self._scheduled.discard(conversation_key)
+    
+    async def _purger(self) -> None:
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                removed = await asyncio.to_thread(self._purge)
+                if removed:
+                    log.info("Mensagens recebidas antigas removidas", removed=removed)
+            except Exception as e:
+                log.error("Erro ao limpar a fila de mensagens recebidas", error=str(e))
+    
+    async def start(self, recover: bool = True) -> None:
+        """Recarrega mensagens pendentes e inicia os workers
+
+        Com vários processos usando o mesmo arquivo, só um deve recarregar
+        (recover=True); nos demais, as pendentes são de outro processo.
+        """
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        if recover:
+            for message_id, source, conversation_key, payload in await asyncio.to_thread(self._load_pending):
+                if source in self.handlers:
+                    self._schedule(message_id, source, conversation_key, payload)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._purge_task = asyncio.create_task(self._purger())
+    
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Para os workers depois de drenar o que já foi recebido (até o timeout)
+
+        Os sinais de parada só entram na fila depois que não há mais mensagens
+        pendentes: um worker devolve a conversa ao fim da fila quando ela ainda
+        tem mensagens, e um sinal enfileirado antes disso pararia o worker com
+        a conversa pela metade.
+        """
+        if not self._tasks:
+            return
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+        deadline = time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning("Mensagens recebidas não drenadas no desligamento", pending=self._pending)
+        for _ in self._tasks:
+            self._ready.put_nowait(None)
+        _, pending = await asyncio.wait(self._tasks, timeout=max(deadline - time.monotonic(), 0.1))
+        for task in pending:
+            task.cancel()
+        self._tasks = []
+        self._idle = None
+        self._ready = None
+        self._conversations.clear()
+        self._scheduled.clear()
+        self._pending = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Retorna o estado da ingestão"""
+        return {
+            "pending": self._pending,
+            "conversations": len(self._conversations),
+            "workers": len(self._tasks),
+            "processed_total": self._processed_total,
+            "failed_total": self._failed_total,
+            "duplicates_total": self._duplicates_total,
+            "rejected_total": self._rejected_total
+        }
+
+_ingestor: Optional[WebhookIngestor] = None
+
+def get_webhook_ingestor() -> WebhookIngestor:
+    """Retorna o ingestor de webhooks do processo"""
+    global _ingestor
+    
+    if _ingestor is None:
+        settings = get_settings()
+        _ingestor = WebhookIngestor(
+            path=settings.inbound_queue_path,
+            workers=settings.inbound_queue_workers,
+            max_pending=settings.inbound_queue_max_pending,
+            max_per_conversation=settings.inbound_queue_max_per_conversation
+        )
+    return _ingestor
@@ -1,10 +1,11 @@
-import uvicorn
 import os
 from dotenv import load_dotenv
 
 # Carrega variáveis de ambiente
 load_dotenv()
 
+from app.server import main
+
 # Obtém o host das variáveis de ambiente ou usa localhost como padrão
 HOST = os.getenv("API_HOST", "127.0.0.1")  # 127.0.0.1 é o mesmo que localhost
 PORT = int(os.getenv("API_PORT", "8000"))
@@ -14,9 +15,5 @@ if __name__ == "__main__":
     print("Para acessar de outros dispositivos na rede, use seu IP local")
     print("Para descobrir seu IP local, execute 'ipconfig' no Windows")
     
-    uvicorn.run(
-        "app.main:app",
-        host=HOST,
-        port=PORT,
-        reload=True
-    ) 
\ No newline at end of file
+    # Desenvolvimento por padrão; --modo prod (ou SERVER_MODE=prod) para produção
+    main()
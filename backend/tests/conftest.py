@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Optional
+import itertools
+import pytest
+from firebase_admin import firestore
+
+class FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+    
+    def get(self, field_paths: Optional[List[str]] = None, transaction: Any = None):
+        return FakeSnapshot(self, self._db.docs.get(self.path))
+    
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._db.apply([("set", self, data, {"merge": merge})])
+    
+    def update(self, data: Dict[str, Any], option: Any = None) -> None:
+        self._db.apply([("update", self, data, {})])
+    
+    def delete(self) -> None:
+        self._db.apply([("delete", self, None, {})])
+
+class FakeSnapshot:
+    def __init__(self, reference: FakeDocument, data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = reference._db.update_times.get(reference.path)
+        self._data = data
+    
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+class FakeCollection:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self._db = db
+        self.path = path
+    
+    def document(self, doc_id: Optional[str] = None) -> FakeDocument:
+        return FakeDocument(self._db, f"{self.path}/{doc_id or next(self._db.ids)}")
+
+class FakeBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self._db = db
+        self._writes: List[Any] = []
+    
+    def set(self, ref, data, merge: bool = False) -> None:
+        self._writes.append(("set", ref, data, {"merge": merge}))
+    
+    def update(self, ref, data, option: Any = None) -> None:
+        self._writes.append(("update", ref, data, {}))
+    
+    def delete(self, ref) -> None:
+        self._writes.append(("delete", ref, None, {}))
+    
+    def commit(self) -> None:
+        self._db.commits += 1
+        self._db.apply(self._writes)
+
+class FakeFirestore:
+    """Firestore em memória: documentos por caminho, sem consultas"""
+    
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.writes: List[Any] = []
+        self.commits = 0
+        self.update_times: Dict[str, int] = {}
+        self.ids = (f"doc{number}" for number in itertools.count(1))
+    
+    def collection(self, path: str) -> FakeCollection:
+        return FakeCollection(self, path)
+    
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+    
+    def write_option(self, **kwargs: Any) -> Dict[str, Any]:
+        return kwargs
+    
+    def apply(self, writes: List[Any]) -> None:
+        for action, ref, data, options in writes:
+            self.writes.append((action, ref.path, data))
+            self.update_times[ref.path] = len(self.writes)
+            if action == "delete":
+                self.docs.pop(ref.path, None)
+            elif action == "set" and not options.get("merge"):
+                self.docs[ref.path] = dict(data)
+            else:
+                doc = self.docs.setdefault(ref.path, {})
+                doc.update(data)
+                for key in [key for key, value in data.items() if value is firestore.DELETE_FIELD]:
+                    doc.pop(key)
+    
+    def paths(self, collection: str) -> List[str]:
+        return [path for path in self.docs if path.rsplit("/", 1)[0].endswith(collection)]
+
+@pytest.fixture
+def fake_firestore(monkeypatch) -> FakeFirestore:
+    """Substitui o cliente do Firestore do app por um em memória"""
+    from app.services import financial_rollups, firebase_client, firestore_async, odontogram
+    
+    db = FakeFirestore()
+    for module in (firebase_client, financial_rollups, firestore_async, odontogram):
+        monkeypatch.setattr(module, "get_firestore_client", lambda: db)
+    return db
@@ -0,0 +1,43 @@
+import asyncio
+from app.services.financial_rollups import create_transacao
+from app.services.firestore_async import current_writes, turn_writes
+
+def test_create_transacao_inside_turn_is_committed_with_the_turn(fake_firestore):
+    async def turn():
+        async with turn_writes():
+            transacao_id = create_transacao("app", "user", {"tipo": "Entrada", "valor": 150, "data": "2026-10-18"})
+            # Ainda não gravado: entra no commit do fim do turno
+            assert len(current_writes()) == 4
+            assert fake_firestore.commits == 0
+        return transacao_id
+    
+    transacao_id = asyncio.run(turn())
+    
+    assert fake_firestore.commits == 1
+    assert f"artifacts/app/users/user/transacoesFinanceiras/{transacao_id}" in fake_firestore.docs
+    assert len(fake_firestore.paths("financeiroRollups")) == 2
+    assert fake_firestore.paths("financeiroRollupsAplicados") == [
+        f"artifacts/app/users/user/financeiroRollupsAplicados/{transacao_id}"
+    ]
+
+def test_process_payment_tool_inside_turn_writes_the_payment(fake_firestore):
+    from app.agents.tools.firebase_tools import ProcessPaymentTool
+    
+    tool = ProcessPaymentTool(app_id="app", user_id="user")
+    
+    async def turn():
+        async with turn_writes():
+            return tool._run(patient_id="p1", amount=200.0, method="PIX", description="Limpeza")
+    
+    result = asyncio.run(turn())
+    
+    assert result.startswith("Pagamento registrado com sucesso")
+    assert fake_firestore.commits == 1
+    [path] = fake_firestore.paths("transacoesFinanceiras")
+    assert fake_firestore.docs[path]["pacienteId"] == "p1"
+
+def test_create_transacao_outside_turn_commits_immediately(fake_firestore):
+    create_transacao("app", "user", {"tipo": "Saída", "valor": 40, "data": "2026-10-18"})
+    
+    assert fake_firestore.commits == 1
+    assert len(fake_firestore.paths("transacoesFinanceiras")) == 1
@@ -0,0 +1,12 @@
+from app.import_budget import LAZY_PACKAGES, check_import_budget
+
+def test_app_main_imports_within_budget_without_heavy_sdks():
+    report = check_import_budget(runs=3)
+    
+    assert report["eager_lazy_packages"] == [], f"SDKs importados na inicialização: {report['eager_lazy_packages']}"
+    assert report["total_ms"] <= report["budget_ms"], report["slowest_self_ms"]
+    assert report["ok"]
+
+def test_forbidden_modules_cover_the_heavy_sdks():
+    for package in ("langchain", "langchain_openai", "openai", "firebase_admin", "google.cloud", "grpc", "numpy"):
+        assert package in LAZY_PACKAGES
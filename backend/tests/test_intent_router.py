@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from app.agents.intent_router import ROUTER_PROMPT, IntentRouter
+
+@pytest.fixture
+def router(monkeypatch):
+    router = IntentRouter("app", "user")
+    async def answer(intent, phone):
+        return f"atalho:{intent}"
+    monkeypatch.setattr(router, "_answer", answer)
+    return router
+
+def _handle(router, message, previous):
+    async def last_reply():
+        return previous
+    return asyncio.run(router.handle(message, phone="5511999990000", last_reply=last_reply))
+
+def test_confirm_runs_on_a_new_conversation(router):
+    assert _handle(router, "confirmo", None) == "atalho:confirmar"
+
+def test_confirm_runs_after_the_router_prompt(router):
+    assert _handle(router, "confirmo", f"Olá, Ana! Sou o assistente virtual do consultório. {ROUTER_PROMPT}") == "atalho:confirmar"
+    assert _handle(router, "pode cancelar", "Sua próxima consulta (Limpeza) está marcada para 10/11/2026 às 14:00.") == "atalho:cancelar"
+
+def test_confirm_after_an_llm_question_goes_to_the_llm(router):
+    assert _handle(router, "confirmo", "Confirmo o pagamento de R$ 200,00 no Pix?") is None
+    assert _handle(router, "cancela", "Quer que eu agende a limpeza para sexta às 9h?") is None
+
+def test_greeting_ignores_the_conversation(router):
+    assert _handle(router, "bom dia", "Confirmo o pagamento de R$ 200,00 no Pix?") == "atalho:saudacao"
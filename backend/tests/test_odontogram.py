@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from app.config import get_settings
+from app.services import odontogram
+from app.services.firestore_async import turn_writes
+
+PATIENT = "artifacts/app/users/user/pacientes/p1"
+EDIT = [{"dente": 36, "lista": "tratamentos", "id": "trat-1", "campos": {"status": "Executado"}}]
+
+def _teeth():
+    teeth = odontogram.expand({})
+    tooth = next(tooth for tooth in teeth if tooth["number"] == 36)
+    tooth["tratamentos"].append({"id": "trat-1", "status": "Planejado", "valor": 180.0})
+    return teeth
+
+@pytest.fixture
+def compact_mode(monkeypatch):
+    monkeypatch.setattr(get_settings(), "odontogram_compact_enabled", True)
+
+def _patch(fake_firestore):
+    async def turn():
+        async with turn_writes():
+            return odontogram.apply_patch(fake_firestore.collection("artifacts/app/users/user/pacientes").document("p1"), EDIT)
+    return asyncio.run(turn())
+
+def test_compact_patch_sends_only_field_paths(fake_firestore, compact_mode):
+    fake_firestore.docs[PATIENT] = {"nome": "Ana", **odontogram.replacement_fields(_teeth(), create=True)}
+    
+    result = _patch(fake_firestore)
+    
+    assert result == {"caminhos": 1, "migrado": 0}
+    action, path, data = fake_firestore.writes[-1]
+    assert (action, path) == ("update", PATIENT)
+    assert data == {"odontogramaCompacto.`36`.tratamentos.`trat-1`.status": "Executado"}
+
+def test_compact_patch_converts_legacy_document(fake_firestore, compact_mode):
+    fake_firestore.docs[PATIENT] = {"nome": "Ana", "odontograma": _teeth()}
+    
+    result = _patch(fake_firestore)
+    
+    assert result == {"caminhos": 1, "migrado": 1}
+    _, _, data = fake_firestore.writes[-1]
+    assert data["odontograma"] is odontogram.firestore.DELETE_FIELD
+    assert data["odontogramaCompacto"]["36"]["tratamentos"]["trat-1"]["status"] == "Executado"
+
+def test_legacy_mode_patch_rewrites_only_the_array(fake_firestore):
+    fake_firestore.docs[PATIENT] = {"nome": "Ana", "odontograma": _teeth()}
+    
+    result = _patch(fake_firestore)
+    
+    assert result == {"caminhos": 1, "migrado": 0}
+    _, _, data = fake_firestore.writes[-1]
+    tooth = next(tooth for tooth in data["odontograma"] if tooth["number"] == 36)
+    assert tooth["tratamentos"][0]["status"] == "Executado"
+    assert "odontogramaCompacto" not in fake_firestore.docs[PATIENT]
+
+def test_readers_prefer_the_array_when_both_fields_exist():
+    teeth = _teeth()
+    stale = odontogram.compact(odontogram.expand({}))
+    doc = {"odontograma": teeth, "odontogramaCompacto": stale, "odontogramaVersao": 1}
+    
+    assert odontogram.odontogram_from_doc(doc) == teeth
+    assert [item["id"] for item in odontogram.iter_treatments(doc)] == ["trat-1"]
+
+def test_benchmark_edit_delta_is_smaller_than_the_document():
+    report = odontogram.benchmark_odontogram()
+    
+    assert report["ida_e_volta_ok"]
+    assert report["documento_compacto_bytes"] < report["documento_antigo_bytes"]
+    assert report["edicao_delta_bytes"] < report["edicao_antiga_bytes"] / 20
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime, timedelta
+from app.models.reminder import Reminder, ReminderJobStatus
+from app.services.outbound_queue import OutboundQueue
+from app.services.reminder_dispatcher import ReminderDispatcher
+
+STARTS_AT = datetime(2026, 10, 19, 8, 0)
+
+def _reminders(count):
+    return [
+        Reminder(
+            event_id=f"e{index}",
+            paciente_id=f"p{index}",
+            patient_name=f"Paciente {index}",
+            to=f"55119{index:08d}",
+            date=STARTS_AT + timedelta(minutes=30 * index),
+            procedure="Limpeza"
+        )
+        for index in range(count)
+    ]
+
+def _job(job_id):
+    return ReminderJobStatus(job_id=job_id, app_id="app", user_id="user", date=STARTS_AT.date().isoformat())
+
+def test_reminders_go_through_the_queue_once_per_event_and_day(tmp_path):
+    sent = []
+    
+    async def send_reminder(payload):
+        if payload["to"].endswith("1"):
+            raise RuntimeError("número inválido")
+        sent.append(payload["to"])
+    
+    async def run():
+        queue = OutboundQueue(str(tmp_path / "outbound.db"), max_attempts=1, poll_interval=0.01)
+        queue.register_handler("reminder", send_reminder)
+        dispatcher = ReminderDispatcher(queue=queue)
+        first, again = _job("first"), _job("again")
+        
+        await dispatcher.dispatch(first, _reminders(3))
+        await dispatcher.dispatch(again, _reminders(3))
+        assert first.queued == 3 and again.queued == 3
+        assert [r.queue_id for r in first.results] == [r.queue_id for r in again.results]
+        
+        await queue.start()
+        while (await queue.metrics())["depth"]:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return await dispatcher.refresh(first)
+    
+    job = asyncio.run(run())
+    
+    assert sorted(sent) == ["5511900000000", "5511900000002"]
+    assert (job.queued, job.sent, job.failed) == (0, 2, 1)
+    assert job.results[1].status == "failed" and job.results[1].error == "número inválido"
@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from app.agents import base_agent
+from app.agents.base_agent import BaseAgent
+from app.agents.memory_store import AI, AI_TOOLS, HUMAN, ConversationMemoryStore
+from app.agents.response_cache import ResponseCache
+
+QUESTION = "quanto custa uma limpeza completa"
+ANSWER = "A limpeza custa R$ 180,00."
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    store = ConversationMemoryStore(str(tmp_path / "memoria.db"))
+    cache = ResponseCache()
+    monkeypatch.setattr(base_agent, "get_memory_store", lambda: store)
+    monkeypatch.setattr(base_agent, "get_response_cache", lambda: cache)
+    # Só o necessário para o cache e o histórico (sem LLM)
+    agent = BaseAgent.__new__(BaseAgent)
+    agent.memory_namespace = "app:user"
+    agent.prompt_fingerprint = "prompt"
+    cache.put(agent.memory_namespace, agent.prompt_fingerprint, QUESTION, ANSWER)
+    return agent, store
+
+def _cached(agent, store, conversation):
+    window = store.load(agent.memory_namespace, conversation)
+    return asyncio.run(agent._cached_reply(QUESTION, conversation, window))
+
+def test_returning_patient_is_served_from_cache(agent):
+    agent, store = agent
+    store.append(agent.memory_namespace, "5511", [(HUMAN, "oi"), (AI, "Olá! Como posso ajudar?")])
+    
+    assert _cached(agent, store, "5511") == ANSWER
+    assert store.load(agent.memory_namespace, "5511").messages[-1] == (AI, ANSWER)
+
+def test_recent_tool_turn_goes_to_the_llm(agent):
+    agent, store = agent
+    store.append(agent.memory_namespace, "5511", [(HUMAN, "tem horário amanhã?"), (AI_TOOLS, "Tenho 9h e 10h.")])
+    
+    assert _cached(agent, store, "5511") is None
+    
+    # Passadas as últimas respostas, a ação não está mais em andamento
+    store.append(agent.memory_namespace, "5511", [(HUMAN, "as 10h"), (AI, "Combinado.")])
+    store.append(agent.memory_namespace, "5511", [(HUMAN, "obrigado"), (AI, "Por nada!")])
+    assert _cached(agent, store, "5511") == ANSWER
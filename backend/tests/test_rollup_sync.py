@@ -0,0 +1,41 @@
+from app.config import get_settings
+from app.routers import financeiro
+from app.services import financial_rollups
+
+class FakeSync:
+    started = []
+    
+    def __init__(self, app_id, user_id):
+        self.key = (app_id, user_id)
+    
+    def start(self):
+        if self.key[0] == "quebrado":
+            raise RuntimeError("sem permissão")
+        FakeSync.started.append(self.key)
+    
+    def stop(self):
+        FakeSync.started.remove(self.key)
+
+def test_primary_starts_one_listener_per_configured_tenant(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "rollup_sync_tenants", "app:user, quebrado:x, invalido,app:user2")
+    monkeypatch.setattr(financial_rollups, "RollupSync", FakeSync)
+    monkeypatch.setattr(financial_rollups, "_syncs", {})
+    
+    assert financial_rollups.start_rollup_syncs() == 2
+    assert financial_rollups.start_rollup_syncs() == 2
+    assert FakeSync.started == [("app", "user"), ("app", "user2")]
+    
+    financial_rollups.stop_rollup_syncs()
+    assert FakeSync.started == []
+
+def test_without_tenants_falls_back_to_the_whatsapp_tenant(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "rollup_sync_tenants", "")
+    monkeypatch.setattr(settings, "whatsapp_app_id", "app")
+    monkeypatch.setattr(settings, "whatsapp_user_id", "user")
+    
+    assert financial_rollups.rollup_sync_tenants() == [("app", "user")]
+
+def test_financeiro_routes_do_not_wait_for_the_listener():
+    assert financeiro.router.dependencies == []